@@ -1,25 +1,43 @@
-from typing import List
-from abc import ABC, abstractmethod
+from typing import Iterable, Iterator, List, Tuple
 
-# Define an abstract base class for sentence extraction
-class BasicSentanceExtractor(ABC):
+SENTENCE_DELIMITER = " . "
 
-    # Abstract method for extracting sentences from a note
-    @abstractmethod
-    def extract_sentences(self, note: str) -> List[str]:
-        # Split the note into sentences based on ' . ' delimiter
-        sentences = note.split(" . ")
-        sentences_ = []
-        
-        # Iterate through each sentence fragment
-        for i in range(len(sentences)):
+
+# Base class for sentence extraction, splits the note on the ' . ' delimiter
+class BasicSentanceExtractor:
+
+    # Extract the (start, end) character offsets of the sentences of a note
+    def extract_spans(self, note: str) -> List[Tuple[int, int]]:
+        spans = []
+        for start, end in self._delimited_spans(note):
             # Check if the fragment is a single word
-            if len(sentences[i].split()) == 1:
-                # Append single-word fragment to the previous sentence
-                sentences_[-1] = sentences_[-1] + " " + sentences[i]
+            if spans and len(note[start:end].split()) == 1:
+                # Extend the previous sentence over the single-word fragment
+                spans[-1] = (spans[-1][0], end)
             else:
                 # Add the fragment as a new sentence
-                sentences_.append(sentences[i])
-                
-        # Return the list of processed sentences
-        return sentences_
+                spans.append((start, end))
+        return spans
+
+    # Extract the sentence offsets of many notes, in order; extractors with a batched model override it
+    def extract_spans_many(self, notes: Iterable[str]) -> Iterator[List[Tuple[int, int]]]:
+        for note in notes:
+            yield self.extract_spans(note)
+
+    # Extract the sentences of a note, slices of the note at their offsets
+    def extract_sentences(self, note: str) -> List[str]:
+        return [note[start:end] for start, end in self.extract_spans(note)]
+
+    @staticmethod
+    def _delimited_spans(note: str, offset: int = 0, end: int = None) -> List[Tuple[int, int]]:
+        # offsets of the fragments of note[offset:end] between ' . ' delimiters, as note.split(" . ")
+        end = len(note) if end is None else end
+        spans = []
+        start = offset
+        while True:
+            position = note.find(SENTENCE_DELIMITER, start, end)
+            if position == -1:
+                spans.append((start, end))
+                return spans
+            spans.append((start, position))
+            start = position + len(SENTENCE_DELIMITER)
@@ -0,0 +1,89 @@
+import re
+from algos.sentence_extractor.basic import BasicSentanceExtractor
+from typing import List, Optional, Tuple
+
+# Words ending with a period that do not end a sentence (lower case, without the last period)
+ABBREVIATIONS = frozenset(
+    [
+        # titles & degrees
+        "dr", "mr", "mrs", "ms", "prof", "jr", "sr", "st", "m.d", "d.o", "r.n", "ph.d", "m.s",
+        # dosing
+        "p.o", "q.d", "b.i.d", "t.i.d", "q.i.d", "q.h.s", "h.s", "p.r.n", "q.o.d", "a.m", "p.m",
+        # misc
+        "no", "vs", "approx", "e.g", "i.e", "dept", "fig",
+    ]
+)
+
+# Sentence boundaries, in order of priority at a given position; the sentence ends where the match starts
+# and the next one starts where it ends. Every boundary starts on a whitespace: the leading lookahead makes
+# the other positions fail on their first character instead of trying each alternative
+_BOUNDARY = re.compile(
+    r"(?=\s)(?:"
+    # i2b2 tokenization, sentences are separated by a " . " token
+    r" \. "
+    # blank lines
+    r"|\s*\n[ \t]*\n\s*"
+    # all caps section headers: "HISTORY OF PRESENT ILLNESS :", "DD: 02/12/06"
+    r"|(?<![A-Z])\s+(?=[A-Z][A-Z/&()-]+(?: [A-Z/&()-]+)* ?:(?:\s|$))"
+    # list bullets: "- Aspirin", "2) Lasix", "3. Follow up"
+    r"|\s+(?=(?:[-*•]|\d{1,2}[.)])\s+[A-Z])"
+    # end of sentence punctuation before a capitalized word (checked against ABBREVIATIONS)
+    r"|(?P<punctuation>(?<=[.!?])\s+)(?=[\"'(\[]?[A-Z0-9])"
+    r")"
+)
+# the word right before a period, looked for in a short window: longer words are not abbreviations
+_WORD_BEFORE = re.compile(r"\S+$")
+_ABBREVIATION_WINDOW = 12
+_SPACE = re.compile(r"\s")
+
+
+class RuleBasedSentenceExtractor(BasicSentanceExtractor):
+    """
+    Single pass clinical sentence segmenter on precompiled regexes, no model needed.
+    Splits on the i2b2 " . " token, blank lines, section headers, list bullets and on . ! ? before a capitalized
+    word unless the period ends an abbreviation ("Dr.", "M.D.", "b.i.d.") or an initial. Like the other
+    extractors, a single word sentence is merged into the sentence before it.
+    """
+
+    def extract_spans(self, note: str) -> List[Tuple[int, int]]:
+        spans = []
+        start = 0
+        for match in _BOUNDARY.finditer(note):
+            end = match.start()
+            if match.lastgroup == "punctuation" and note[end - 1] == "." and self._is_abbreviation(note, end):
+                continue
+            self._add(note, spans, start, end)
+            start = match.end()
+        self._add(note, spans, start, len(note))
+        return spans
+
+    @staticmethod
+    def _is_abbreviation(note: str, end: int) -> bool:
+        # is the word ending with the period at note[end - 1] an abbreviation or an initial
+        window = max(0, end - _ABBREVIATION_WINDOW)
+        word = _WORD_BEFORE.search(note, window, end)
+        if word is None or (word.start() == window and window > 0):
+            return False
+        word = word.group()[:-1].lower()
+        return len(word) == 1 or word in ABBREVIATIONS
+
+    @staticmethod
+    def _add(note: str, spans: List[Tuple[int, int]], start: int, end: int):
+        span = _trim(note, start, end)
+        if span is None:
+            return
+        if spans and _SPACE.search(note, *span) is None:
+            # Extend the previous sentence over the single-word sentence
+            spans[-1] = (spans[-1][0], span[1])
+        else:
+            spans.append(span)
+
+
+def _trim(note: str, start: int, end: int) -> Optional[Tuple[int, int]]:
+    # offsets of note[start:end] without its surrounding whitespace, None if it is blank
+    fragment = note[start:end]
+    stripped = fragment.lstrip()
+    if not stripped:
+        return None
+    start += len(fragment) - len(stripped)
+    return start, start + len(stripped.rstrip())
@@ -1,17 +1,58 @@
-import spacy
+from common.utils.models import ModelRegistry
 from algos.sentence_extractor.basic import BasicSentanceExtractor
-from typing import List
+from typing import Iterable, Iterator, List, Tuple
+
+# Segmentation modes:
+# - parser: sentences from the dependency parse (most accurate), tagger / ner / lemmatizer are not loaded
+# - senter: the model's statistical sentence recognizer alone, several times faster than the parser
+# - sentencizer: punctuation rules only, no trained model needed
+SEGMENTATION_MODES = ("parser", "senter", "sentencizer")
+# components of the trained pipelines that sentence segmentation never uses
+UNUSED_COMPONENTS = ["tagger", "attribute_ruler", "lemmatizer", "ner"]
+
+
+def load_segmentation_pipeline(model: str, mode: str, warm_up: bool = False):
+    # the smallest pipeline producing doc.sents in the given mode, shared by every extractor of the process
+    if mode not in SEGMENTATION_MODES:
+        raise ValueError(f"Unknown segmentation mode '{mode}', expected one of {SEGMENTATION_MODES}")
+    registry = ModelRegistry()
+    if mode == "sentencizer":
+        return registry.get(model.split("_")[0], add=["sentencizer"], blank=True, warm_up=warm_up)
+    if mode == "senter":
+        return registry.get(model, exclude=UNUSED_COMPONENTS + ["parser"], enable=["senter"], warm_up=warm_up)
+    return registry.get(model, exclude=UNUSED_COMPONENTS, warm_up=warm_up)
+
 
 # Define a class SpacySentenceExtractor inheriting from BasicSentanceExtractor
 class SpacySentenceExtractor(BasicSentanceExtractor):
     # Initialize the Spacy model
-    def __init__(self):
+    def __init__(
+        self,
+        model: str = "en_core_web_sm",
+        mode: str = "parser",
+        batch_size: int = 64,
+        n_process: int = 1,
+        warm_up: bool = False,
+    ):
         super().__init__()
-        self.nlp = spacy.load("en_core_web_sm")
+        self.model = model
+        self.mode = mode
+        self.warm_up = warm_up
+        self.nlp = load_segmentation_pipeline(model, mode, warm_up)
+        self.batch_size = int(batch_size)
+        self.n_process = int(n_process)
+
+    def __reduce__(self):
+        # pickled as its settings (e.g. for process pool workers), the pipeline is loaded again on unpickling
+        return (self.__class__, (self.model, self.mode, self.batch_size, self.n_process, self.warm_up))
 
-    # Method to extract sentences from a given note
-    def extract_sentences(self, note: str) -> List[str]:
+    # Method to extract the sentence offsets of a given note
+    def extract_spans(self, note: str) -> List[Tuple[int, int]]:
         sentences_doc = self.nlp(note)
-        # Extract sentences from the processed note
-        sentences = [sentence.text for sentence in sentences_doc.sents]
-        return sentences
+        # Offsets of the sentences of the processed note
+        return [(sentence.start_char, sentence.end_char) for sentence in sentences_doc.sents]
+
+    # Batched extraction, the notes go through nlp.pipe
+    def extract_spans_many(self, notes: Iterable[str]) -> Iterator[List[Tuple[int, int]]]:
+        for sentences_doc in self.nlp.pipe(notes, batch_size=self.batch_size, n_process=self.n_process):
+            yield [(sentence.start_char, sentence.end_char) for sentence in sentences_doc.sents]
@@ -1,31 +1,80 @@
-import spacy
 from algos.sentence_extractor.basic import BasicSentanceExtractor
-from typing import List
+from algos.sentence_extractor.spacy import load_segmentation_pipeline
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Tuple
 
 class SpacyWithBasicSentenceExtractor(BasicSentanceExtractor):
-    def __init__(self):
+    # potential sentences longer than this many words are split further with spaCy
+    MAX_WORDS = 100
+
+    def __init__(
+        self,
+        model: str = "en_core_web_sm",
+        mode: str = "parser",
+        batch_size: int = 64,
+        n_process: int = 1,
+        warm_up: bool = False,
+    ):
         super().__init__()
-        self.nlp = spacy.load("en_core_web_sm")
+        self.model = model
+        self.mode = mode
+        self.warm_up = warm_up
+        self.nlp = load_segmentation_pipeline(model, mode, warm_up)
+        self.batch_size = int(batch_size)
+        self.n_process = int(n_process)
+
+    def __reduce__(self):
+        # pickled as its settings (e.g. for process pool workers), the pipeline is loaded again on unpickling
+        return (self.__class__, (self.model, self.mode, self.batch_size, self.n_process, self.warm_up))
+
+    def extract_spans(self, note: str) -> List[Tuple[int, int]]:
+        return next(self.extract_spans_many([note]))
+
+    def extract_spans_many(self, notes: Iterable[str]) -> Iterator[List[Tuple[int, int]]]:
+        # One nlp.pipe over the long fragments of all the notes; a note is yielded, in order,
+        # once spaCy has split all of its long fragments
+        pending = deque()  # [note index, note, fragments, spaCy splits by fragment start, long fragments left]
+        entries = {}
 
-    def extract_sentences(self, note: str) -> List[str]:
-        # Split the input note into potential sentences using " . " as the delimiter
-        sents = note.split(" . ")
+        def long_fragments():
+            for index, note in enumerate(notes):
+                # Split the input note into potential sentences using " . " as the delimiter
+                fragments = self._delimited_spans(note)
+                longs = [(start, end) for start, end in fragments if len(note[start:end].split()) > self.MAX_WORDS]
+                entry = [index, note, fragments, {}, len(longs)]
+                pending.append(entry)
+                entries[index] = entry
+                for start, end in longs:
+                    yield note[start:end], (index, start)
+
+        def completed():
+            while pending and pending[0][4] == 0:
+                index, note, fragments, split, _ = pending.popleft()
+                del entries[index]
+                yield self._refine(note, fragments, split)
+
+        docs = self.nlp.pipe(
+            long_fragments(), as_tuples=True, batch_size=self.batch_size, n_process=self.n_process
+        )
+        for doc, (index, start) in docs:
+            entry = entries[index]
+            entry[3][start] = [(start + st.start_char, start + st.end_char) for st in doc.sents]
+            entry[4] -= 1
+            yield from completed()
+        yield from completed()
+
+    def _refine(self, note: str, spans: List[Tuple[int, int]], split: Dict[int, list]) -> List[Tuple[int, int]]:
         sentences = []
+        for start, end in spans:
+            # If the potential sentence is longer than 100 words, use spaCy's split of it
+            sentences.extend(split.get(start, [(start, end)]))
 
-        for s in sents:
-            # If the potential sentence is longer than 100 words, use spaCy to split it further
-            if len(s.split()) > 100:
-                doc = self.nlp(s)
-                sentences.extend([st.text for st in doc.sents])
-            else:
-                sentences.append(s)
-        
         # Combine very short sentences (likely artifacts of the initial split) with the preceding sentence
-        refined_sentences = []
-        for sentence in sentences:
-            if refined_sentences and len(sentence.split()) == 1:
-                refined_sentences[-1] += " " + sentence
+        refined_spans = []
+        for start, end in sentences:
+            if refined_spans and len(note[start:end].split()) == 1:
+                refined_spans[-1] = (refined_spans[-1][0], end)
             else:
-                refined_sentences.append(sentence)
+                refined_spans.append((start, end))
 
-        return refined_sentences
+        return refined_spans
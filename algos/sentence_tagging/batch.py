@@ -0,0 +1,183 @@
+from abc import ABC, abstractmethod
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Optional, Tuple, Type
+from llama_index.core.prompts import PromptTemplate
+from llama_index.llms.openai.utils import to_openai_tool
+import openai
+from pydantic import BaseModel, ValidationError
+from algos.sentence_tagging.gpt import TaggingSentenceByGPT, load_secrets
+from algos.sentence_tagging.mock import MockResponder
+
+# batch statuses after which the job does not change anymore
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+
+
+def build_batch_request(
+    custom_id: str, model: str, prompt: str, output_cls: Type[BaseModel], **prompt_args
+) -> dict:
+    # one line of a batch input file, the same request OpenAIPydanticProgram sends online
+    tool = to_openai_tool(output_cls, description=TaggingSentenceByGPT.DESCRIPTION)
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": CHAT_COMPLETIONS_URL,
+        "body": {
+            "model": model,
+            "temperature": 0,
+            "messages": [
+                {"role": "user", "content": PromptTemplate(prompt).format(**prompt_args)}
+            ],
+            "tools": [tool],
+            "tool_choice": {"type": "function", "function": {"name": tool["function"]["name"]}},
+        },
+    }
+
+
+def parse_batch_result(
+    line: str, output_cls: Type[BaseModel]
+) -> Tuple[str, Optional[BaseModel]]:
+    # (custom_id, response object), the object is None for a failed or unusable answer
+    result = json.loads(line)
+    response = result.get("response") or {}
+    if result.get("error") or response.get("status_code") != 200:
+        return result["custom_id"], None
+    try:
+        message = response["body"]["choices"][0]["message"]
+        arguments = message["tool_calls"][0]["function"]["arguments"]
+        return result["custom_id"], output_cls.model_validate_json(arguments)
+    except (KeyError, IndexError, TypeError, ValidationError):
+        return result["custom_id"], None
+
+
+class BatchBackend(ABC):
+    """
+    Endpoint running batch jobs: a jsonl file of requests in, a jsonl file of results out.
+    """
+
+    def __init__(self, job_dir: str, api_base: str = None):
+        self.job_dir = job_dir
+
+    @abstractmethod
+    def submit(self, requests_path: str) -> str:
+        # uploads the requests file & starts the job, returns the batch id
+        pass
+
+    @abstractmethod
+    def status(self, batch_id: str) -> dict:
+        # {"status", "output_file_id", "error_file_id", "request_counts"}
+        pass
+
+    @abstractmethod
+    def download(self, file_id: str, path: str) -> None:
+        pass
+
+
+class OpenAIBatchBackend(BatchBackend):
+    # OpenAI's batch api (or any endpoint implementing it), ~half the price of online requests
+
+    def __init__(self, job_dir: str, api_base: str = None):
+        super().__init__(job_dir, api_base)
+        load_secrets()
+        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=api_base)
+
+    def submit(self, requests_path: str) -> str:
+        with open(requests_path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=CHAT_COMPLETIONS_URL,
+            completion_window="24h",
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> dict:
+        batch = self.client.batches.retrieve(batch_id)
+        return {
+            "status": batch.status,
+            "output_file_id": batch.output_file_id,
+            "error_file_id": batch.error_file_id,
+            "request_counts": batch.request_counts.model_dump() if batch.request_counts else {},
+        }
+
+    def download(self, file_id: str, path: str) -> None:
+        self.client.files.content(file_id).write_to_file(path)
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File based stand-in for the batch api, for tests & dry runs without network.
+    Jobs live in {job_dir}/local_endpoint, a job completes on the first poll `complete_after` seconds
+    after its submission; answers come from the mock server's responder, `error_rate` of them fail.
+    """
+
+    def __init__(self, job_dir: str, api_base: str = None, complete_after: float = 0, error_rate: float = 0.0):
+        super().__init__(job_dir, api_base)
+        self.endpoint_dir = f"{job_dir}/local_endpoint"
+        self.complete_after = float(complete_after)
+        self.error_rate = float(error_rate)
+        os.makedirs(self.endpoint_dir, exist_ok=True)
+
+    def _job_path(self, batch_id: str) -> str:
+        return f"{self.endpoint_dir}/{batch_id}.json"
+
+    def _file_path(self, file_id: str) -> str:
+        return f"{self.endpoint_dir}/{file_id}.jsonl"
+
+    def submit(self, requests_path: str) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex[:16]}"
+        shutil.copyfile(requests_path, self._file_path(f"{batch_id}_input"))
+        self._save(batch_id, {"status": "in_progress", "created_at": time.time()})
+        return batch_id
+
+    def status(self, batch_id: str) -> dict:
+        with open(self._job_path(batch_id), "r") as f:
+            job = json.load(f)
+        if job["status"] == "in_progress" and time.time() - job["created_at"] >= self.complete_after:
+            job = self._run(batch_id)
+        return {
+            "status": job["status"],
+            "output_file_id": job.get("output_file_id"),
+            "error_file_id": job.get("error_file_id"),
+            "request_counts": job.get("request_counts", {}),
+        }
+
+    def download(self, file_id: str, path: str) -> None:
+        shutil.copyfile(self._file_path(file_id), path)
+
+    def _run(self, batch_id: str) -> dict:
+        responder = MockResponder(latency_ms=0, jitter_ms=0, error_500=self.error_rate)
+        completed = failed = 0
+        output_id, error_id = f"{batch_id}_output", f"{batch_id}_error"
+        with open(self._file_path(f"{batch_id}_input"), "r") as requests, open(
+            self._file_path(output_id), "w"
+        ) as output, open(self._file_path(error_id), "w") as errors:
+            for line in requests:
+                request = json.loads(line)
+                result = {"id": f"batch_req_{uuid.uuid4().hex[:16]}", "custom_id": request["custom_id"], "error": None}
+                if responder.pick_error() is None:
+                    result["response"] = {"status_code": 200, "body": responder.completion(request["body"])}
+                    output.write(json.dumps(result) + "\n")
+                    completed += 1
+                else:
+                    result["response"] = {"status_code": 500, "body": {"error": {"message": "server error (local batch)"}}}
+                    errors.write(json.dumps(result) + "\n")
+                    failed += 1
+        job = {
+            "status": "completed",
+            "output_file_id": output_id,
+            "error_file_id": error_id if failed else None,
+            "request_counts": {"total": completed + failed, "completed": completed, "failed": failed},
+        }
+        self._save(batch_id, job)
+        return job
+
+    def _save(self, batch_id: str, job: dict) -> None:
+        tmp_path = f"{self._job_path(batch_id)}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._job_path(batch_id))
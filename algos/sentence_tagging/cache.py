@@ -0,0 +1,130 @@
+from functools import lru_cache
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Optional, Type
+from loguru import logger
+from pydantic import BaseModel, ValidationError
+
+
+@lru_cache(maxsize=None)
+def _schema_fingerprint(output_cls: Type[BaseModel]) -> str:
+    # the json schema of a response structure never changes within a process
+    return json.dumps(output_cls.model_json_schema(), sort_keys=True)
+
+
+class TaggingCache:
+    """
+    Persistent, content addressed cache of validated tagging responses, backed by SQLite.
+
+    - key: sha256 of (model, prompt template, output schema, sentence text)
+    - value: the response object serialized as json
+    Several processes can share the same file: WAL journal, busy timeout & one transaction per write.
+    Once the file grows above `max_size_mb`, least recently used entries are evicted.
+    """
+
+    FILE_NAME = "tagging_cache.sqlite"
+    # the size of the cache is checked after every EVICTION_CHECK_EVERY writes
+    EVICTION_CHECK_EVERY = 100
+
+    def __init__(self, cache_dir: str, max_size_mb: float = 512):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = f"{cache_dir}/{self.FILE_NAME}"
+        self.max_size_bytes = int(float(max_size_mb) * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes = 0
+
+        # autocommit mode, every statement is its own transaction
+        self.conn = sqlite3.connect(
+            self.path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+        )
+
+    @staticmethod
+    def make_key(model: str, prompt: str, output_cls: Type[BaseModel], text: str) -> str:
+        payload = json.dumps(
+            [model, prompt, _schema_fingerprint(output_cls), text], ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, output_cls: Type[BaseModel]) -> Optional[BaseModel]:
+        row = self.conn.execute(
+            "SELECT value FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        try:
+            response = output_cls.model_validate_json(row[0])
+        except ValidationError:
+            # stale entry written for an older version of the schema
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.misses += 1
+            return None
+        self.conn.execute(
+            "UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key)
+        )
+        self.hits += 1
+        return response
+
+    def put(self, key: str, response: BaseModel) -> None:
+        value = response.model_dump_json()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+            (key, value, len(value), time.time()),
+        )
+        self._writes += 1
+        if self._writes % self.EVICTION_CHECK_EVERY == 0:
+            self.evict()
+
+    def size_bytes(self) -> int:
+        row = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return row[0]
+
+    def evict(self) -> int:
+        # drop least recently used entries until the cache is back under 90% of its budget
+        size = self.size_bytes()
+        if size <= self.max_size_bytes:
+            return 0
+        target = int(self.max_size_bytes * 0.9)
+        rows = self.conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        ).fetchall()
+        keys = []
+        for key, entry_size in rows:
+            if size <= target:
+                break
+            keys.append((key,))
+            size -= entry_size
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self.conn.execute("COMMIT")
+        evicted = len(keys)
+        self.evictions += evicted
+        logger.info(f"Tagging cache: evicted {evicted} entries from {self.path}")
+        return evicted
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "cache_hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "cache_evictions": self.evictions,
+        }
+
+    def close(self) -> None:
+        self.conn.close()
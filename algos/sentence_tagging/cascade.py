@@ -0,0 +1,165 @@
+import time
+from typing import List, Optional, Sequence
+from pydantic import BaseModel
+from algos.sentence_tagging.prefilter import PHIPrefilter
+
+class TierStats:
+    # calls & latencies of one tier of the cascade
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.latencies = []
+
+    def record(self, latency: float) -> None:
+        self.calls += 1
+        self.latencies.append(latency)
+
+    def stats(self) -> dict:
+        ordered = sorted(self.latencies)
+
+        def quantile(q):
+            return round(ordered[int(q * (len(ordered) - 1))] * 1000) if ordered else None
+
+        return {
+            f"{self.name}_calls": self.calls,
+            f"{self.name}_latency_p50_ms": quantile(0.5),
+            f"{self.name}_latency_p95_ms": quantile(0.95),
+        }
+
+
+class CascadeTagging:
+    """
+    Tags with a cheap model first and asks the expensive model again only when the cheap answer is doubtful.
+
+    escalate_on - criteria, any of:
+    - "unmatched": an entity of the answer is not found verbatim in the text (it would be dropped
+      by get_human_readable_annotations_*).
+    - "prefilter": the answer disagrees with the rule based prefilter, entities in a text it rules out
+      or no entity at all in a text holding a PHI shaped number (date, phone number, id, age over 89;
+      not any digit, clinical text is full of doses, vitals & counts).
+    - "length": a sentence of the text is at least `min_chars` characters long. A text made of several
+      sentences joined by `separator` (a window of a note) is measured sentence by sentence.
+    A batch request is escalated as a whole when any of its sentences meets a criterion.
+    """
+
+    CRITERIA = ("unmatched", "prefilter", "length")
+
+    def __init__(
+        self,
+        cheap,
+        expensive,
+        escalate_on: Sequence[str] = ("unmatched",),
+        min_chars: int = 400,
+        separator: Optional[str] = None,
+    ):
+        unknown = set(escalate_on) - set(self.CRITERIA)
+        if unknown:
+            raise ValueError(f"Unknown escalation criteria {sorted(unknown)}, expected {self.CRITERIA}")
+        self.cheap = cheap
+        self.expensive = expensive
+        self.model = cheap.model
+        self.escalate_on = tuple(escalate_on)
+        self.min_chars = int(min_chars)
+        self.separator = separator
+        self.prefilter = PHIPrefilter()
+        self.tiers = {"cheap": TierStats("cascade_cheap"), "expensive": TierStats("cascade_expensive")}
+        self.escalations = {criterion: 0 for criterion in self.CRITERIA}
+        self.escalated = 0
+        self.requests = 0
+
+    @staticmethod
+    def _entities(response: BaseModel) -> List[str]:
+        # every string returned in a list field of the response
+        entities = []
+        for _, value in response:
+            if isinstance(value, list):
+                entities.extend(entity for entity in value if isinstance(entity, str))
+        return entities
+
+    def escalation_reason(self, text: str, response: BaseModel) -> str:
+        # the first criterion met by the cheap answer, None to keep it
+        entities = self._entities(response)
+        if "unmatched" in self.escalate_on and any(
+            entity and entity not in text for entity in entities
+        ):
+            return "unmatched"
+        if "prefilter" in self.escalate_on:
+            if entities and not self.prefilter.needs_model(text):
+                return "prefilter"
+            if not entities and self.prefilter.has_phi_shape(text):
+                return "prefilter"
+        if "length" in self.escalate_on and self._longest_sentence(text) >= self.min_chars:
+            return "length"
+        return None
+
+    def _longest_sentence(self, text: str) -> int:
+        if not self.separator:
+            return len(text)
+        return max(len(sentence) for sentence in text.split(self.separator))
+
+    async def _timed(self, tier: str, call):
+        start = time.monotonic()
+        response = await call
+        self.tiers[tier].record(time.monotonic() - start)
+        return response
+
+    async def _cascade(self, texts: List[str], items, cheap_call, expensive_call):
+        # items - (text index, response) pairs of the cheap answer to check
+        self.requests += 1
+        response = await self._timed("cheap", cheap_call())
+        for i, item in items(response):
+            reason = self.escalation_reason(texts[i], item)
+            if reason is not None:
+                self.escalations[reason] += 1
+                self.escalated += 1
+                return await self._timed("expensive", expensive_call())
+        return response
+
+    async def atagging_sentence(self, sentence: str, prompt: str, object_info):
+        return await self._cascade(
+            [sentence],
+            lambda response: [(0, response)],
+            lambda: self.cheap.atagging_sentence(sentence, prompt, object_info),
+            lambda: self.expensive.atagging_sentence(sentence, prompt, object_info),
+        )
+
+    async def atagging_sentences(self, sentences: List[str], prompt: str, object_info):
+        return await self._cascade(
+            sentences,
+            lambda response: [
+                (item.index, item)
+                for item in response.sentences
+                if 0 <= item.index < len(sentences)
+            ],
+            lambda: self.cheap.atagging_sentences(sentences, prompt, object_info),
+            lambda: self.expensive.atagging_sentences(sentences, prompt, object_info),
+        )
+
+    def summary(self) -> dict:
+        summary = dict(self.cheap.summary())
+        # a cache shared by both tiers is reported once
+        shared_cache = getattr(self.cheap, "cache", None) is not None and getattr(
+            self.cheap, "cache", None
+        ) is getattr(self.expensive, "cache", None)
+        summary.update(
+            {
+                f"escalation_{key}": value
+                for key, value in self.expensive.summary().items()
+                if not (shared_cache and key.startswith("cache_"))
+            }
+        )
+        for tier in self.tiers.values():
+            summary.update(tier.stats())
+        summary["cascade_escalated"] = self.escalated
+        summary["cascade_escalation_rate"] = (
+            round(self.escalated / self.requests, 4) if self.requests else 0.0
+        )
+        summary.update(
+            {f"cascade_escalated_{criterion}": count for criterion, count in self.escalations.items()}
+        )
+        return summary
+
+    async def aclose(self):
+        await self.cheap.aclose()
+        await self.expensive.aclose()
@@ -1,32 +1,177 @@
+from functools import cache
 from llama_index.program.openai import OpenAIPydanticProgram
 from llama_index.llms.openai import OpenAI
 from dotenv import load_dotenv
+import httpx
 import os
+from typing import List
+from algos.sentence_tagging.cache import TaggingCache
+from algos.sentence_tagging.ratelimit import RateLimiter
+
+
+@cache
+def load_secrets():
+    # secrets are read once per process, not on every tagger construction
+    load_dotenv(dotenv_path="_secrets/.env")
 
 
 class TaggingSentenceByGPT:
 
+    # llama-index LLM talking to the endpoint & the environment variable holding its api key
+    LLM_CLASS = OpenAI
+    API_KEY_ENV = "OPENAI_API_KEY"
+    # description of the output structure given to the model
+    DESCRIPTION = "extract user information from given sentence"
+
     # constructure for a class which takes model name as input
-    def __init__(self, model="gpt-4o"):
+    # api_base - base url of the (OpenAI-compatible) endpoint, None for api.openai.com
+    # api_key - overrides the key read from API_KEY_ENV
+    # max_connections - size of the keep-alive connection pool shared by all the calls of this tagger
+    # cache - optional TaggingCache, responses found in it are not requested again
+    # rate_limiter - optional RateLimiter shared by the concurrent calls, it owns the retries of the async calls
+    def __init__(
+        self,
+        model="gpt-4o",
+        api_base=None,
+        api_key=None,
+        max_connections=100,
+        cache: TaggingCache = None,
+        rate_limiter: RateLimiter = None,
+    ):
         self.model = model
-        load_dotenv(dotenv_path="_secrets/.env")
+        self.api_base = api_base
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        load_secrets()
 
-    def tagging_sentence(self, sentence: str, prompt: str, object_info):
-        # defining a program - OpenAIPydanticProgram, which takes output structure, LLM tpye and a prompt as an input.
-        # output_cls - output structure of tagged sentence
-        # llm - LLM type to be used for tagging sentence
-        # prompt_template_str - prompt to be given to LLM for tagging sentence
-        program = OpenAIPydanticProgram.from_defaults(
-            output_cls=object_info,
-            llm=OpenAI(
-                temperature=0, model=self.model, api_key=os.getenv("OPENAI_API_KEY")
-            ),
-            prompt_template_str=(prompt),
-            verbose=True,
+        # one pooled http client (sync & async) for every request, so connections & TLS sessions are reused
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        )
+        self.http_client = httpx.Client(limits=limits)
+        self.async_http_client = httpx.AsyncClient(
+            limits=limits, event_hooks={"response": [self._observe_response]}
+        )
+        self.llm = self.LLM_CLASS(
+            temperature=0,
+            model=self.model,
+            api_key=api_key or os.getenv(self.API_KEY_ENV),
+            api_base=api_base,
+            http_client=self.http_client,
+            async_http_client=self.async_http_client,
+            # the rate limiter retries with backoff, the client must not retry on its own as well
+            max_retries=0 if rate_limiter is not None else 3,
         )
 
-        # return response object of type output_cls
-        return program(
+        # programs are built once per (prompt, output_cls, model) and reused for the life of the tagger
+        self._programs = {}
+
+    async def _observe_response(self, response: httpx.Response) -> None:
+        # the rate limit headers of successful calls keep the limiter in step with the provider,
+        # error responses reach the limiter through the raised exception
+        if self.rate_limiter is not None and response.status_code < 400:
+            self.rate_limiter.observe_headers(response.headers)
+
+    def _get_program(self, prompt: str, object_info) -> OpenAIPydanticProgram:
+        key = (prompt, object_info, self.model)
+        if key not in self._programs:
+            # defining a program - OpenAIPydanticProgram, which takes output structure, LLM tpye and a prompt as an input.
+            # output_cls - output structure of tagged sentence
+            # llm - LLM type to be used for tagging sentence
+            # prompt_template_str - prompt to be given to LLM for tagging sentence
+            self._programs[key] = OpenAIPydanticProgram.from_defaults(
+                output_cls=object_info,
+                llm=self.llm,
+                prompt_template_str=(prompt),
+                verbose=True,
+            )
+        return self._programs[key]
+
+    def _cache_lookup(self, sentence: str, prompt: str, object_info):
+        # returns (cache key, cached response or None)
+        if self.cache is None:
+            return None, None
+        # responses of another endpoint (e.g. a local stand-in server) never mix with the real ones
+        model = self.model if self.api_base is None else f"{self.model}@{self.api_base}"
+        key = self.cache.make_key(model, prompt, object_info, sentence)
+        return key, self.cache.get(key, object_info)
+
+    def _cache_store(self, key: str, response) -> None:
+        if self.cache is not None:
+            self.cache.put(key, response)
+
+    def tagging_sentence(self, sentence: str, prompt: str, object_info):
+        key, response = self._cache_lookup(sentence, prompt, object_info)
+        if response is not None:
+            return response
+
+        program = self._get_program(prompt, object_info)
+        response = program(
             sentence=sentence,
-            description="extract user information from given sentence",
+            description=self.DESCRIPTION,
         )
+        self._cache_store(key, response)
+
+        # return response object of type output_cls
+        return response
+
+    async def _arun(self, text: str, prompt: str, object_info, **prompt_args):
+        # text - what the prompt is filled with, used as the cache key
+        key, response = self._cache_lookup(text, prompt, object_info)
+        if response is not None:
+            return response
+
+        program = self._get_program(prompt, object_info)
+
+        async def call():
+            return await program.acall(
+                description=self.DESCRIPTION,
+                **prompt_args,
+            )
+
+        if self.rate_limiter is not None:
+            response = await self.rate_limiter.run(
+                call, tokens=self.estimate_tokens(prompt, text)
+            )
+        else:
+            response = await call()
+        self._cache_store(key, response)
+
+        # return response object of type output_cls
+        return response
+
+    async def atagging_sentence(self, sentence: str, prompt: str, object_info):
+        # async variant of tagging_sentence, lets the ETLs keep many requests in flight
+        return await self._arun(sentence, prompt, object_info, sentence=sentence)
+
+    async def atagging_sentences(self, sentences: List[str], prompt: str, object_info):
+        # tags several sentences in one request, each one is prefixed with its index: "[i] sentence"
+        # object_info must hold one entry per index, mapping it back to the sentences is left to the caller
+        packed = self.pack_sentences(sentences)
+        return await self._arun(packed, prompt, object_info, sentences=packed)
+
+    @staticmethod
+    def pack_sentences(sentences: List[str]) -> str:
+        return "\n".join(f"    [{i}] {sentence}" for i, sentence in enumerate(sentences))
+
+    @staticmethod
+    def estimate_tokens(prompt: str, text: str, completion_tokens: int = 256) -> int:
+        # ~4 characters per token for english text, cheap enough to run for every request
+        return (len(prompt) + len(text)) // 4 + completion_tokens
+
+    def summary(self) -> dict:
+        # counters reported at the end of a tagging run
+        summary = {}
+        if self.cache is not None:
+            summary.update(self.cache.stats())
+        if self.rate_limiter is not None:
+            summary.update(self.rate_limiter.stats())
+        return summary
+
+    async def aclose(self):
+        # release the pooled connections once the tagging run is over
+        await self.async_http_client.aclose()
+        self.http_client.close()
+        if self.cache is not None:
+            self.cache.close()
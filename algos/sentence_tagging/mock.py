@@ -0,0 +1,165 @@
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+# Answers of a mock OpenAI-compatible chat completions endpoint, shared by scripts/mock_openai_server.py and
+# the LocalBatchBackend. Every tool call request is answered with arguments that validate against the tool's
+# json schema (UserInfo*):
+# - capitalized words & numbers of the sentence are spread over the list fields, so entities are found in the sentence
+# - a batch request ("[i] sentence" lines) gets one indexed entry per sentence
+
+# the sentence inside a single sentence prompt: ... sentence : "<text>" / clinical note : "<text>"
+SINGLE_SENTENCE = re.compile(r'(?:sentence|clinical note)\s*:\s*"(.*)"\s*$', re.DOTALL)
+INDEXED_SENTENCE = re.compile(r"^\s*\[(\d+)\]\s?(.*)$", re.MULTILINE)
+CANDIDATE = re.compile(r"[A-Z][\w.-]*(?: [A-Z][\w.-]*)*|\d[\d/:.-]*")
+# list fields a candidate goes to, by the first keyword found in the field name
+DIGIT_FIELDS = ("date", "age", "id", "phone", "contact")
+WORD_FIELDS = ("patient", "name", "doctor", "hospital", "location")
+
+
+class MockResponder:
+    """
+    Builds the chat completion answered to a request body, thread safe counters.
+    """
+
+    def __init__(
+        self,
+        latency_ms=200,
+        jitter_ms=100,
+        error_429=0.0,
+        error_500=0.0,
+        retry_after=1.0,
+        slow_rate=0.0,
+        slow_ms=5000,
+        seed=None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.error_429 = error_429
+        self.error_500 = error_500
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "ok": 0, "429": 0, "500": 0}
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def delay(self):
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms)
+            # a few answers are much slower than the others (long tail)
+            slow = self.slow_ms if self.random.random() < self.slow_rate else 0
+        time.sleep(max(0.0, self.latency_ms + jitter + slow) / 1000)
+
+    def pick_error(self):
+        # status code of an injected error, None for a normal answer
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.error_429:
+            return 429
+        if draw < self.error_429 + self.error_500:
+            return 500
+        return None
+
+    def completion(self, body):
+        messages = body.get("messages", [])
+        content = messages[-1].get("content", "") if messages else ""
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content)
+        message = {"role": "assistant", "content": "ok"}
+        finish_reason = "stop"
+        tools = body.get("tools") or []
+        if tools:
+            function = tools[0]["function"]
+            arguments = self.arguments(function.get("parameters", {}), content)
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": f"call_{uuid.uuid4().hex[:24]}",
+                        "type": "function",
+                        "function": {"name": function["name"], "arguments": json.dumps(arguments)},
+                    }
+                ],
+            }
+            finish_reason = "tool_calls"
+        prompt_tokens = len(json.dumps(body)) // 4
+        completion_tokens = len(json.dumps(message)) // 4
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def arguments(self, schema, content):
+        defs = schema.get("$defs", schema.get("definitions", {}))
+        indexed = INDEXED_SENTENCE.findall(content)
+        if indexed:
+            return self.value(schema, defs, indexed=indexed)
+        match = SINGLE_SENTENCE.search(content)
+        return self.value(schema, defs, text=match.group(1) if match else content)
+
+    def value(self, schema, defs, text="", indexed=None, index=0):
+        if "$ref" in schema:
+            schema = defs[schema["$ref"].split("/")[-1]]
+        if "allOf" in schema:
+            return self.value(schema["allOf"][0], defs, text, indexed, index)
+        kind = schema.get("type")
+        if kind == "object":
+            return self.object_value(schema, defs, text, indexed, index)
+        if kind == "array":
+            items = schema.get("items", {})
+            if indexed is not None and self.is_object(items, defs):
+                # one entry per "[i] sentence" line of a batch request
+                return [self.value(items, defs, sentence, None, int(i)) for i, sentence in indexed]
+            return []
+        if kind == "integer":
+            return index
+        if kind == "number":
+            return float(index)
+        if kind == "boolean":
+            return False
+        return ""
+
+    def object_value(self, schema, defs, text, indexed, index):
+        properties = schema.get("properties", {})
+        value = {name: self.value(prop, defs, text, indexed, index) for name, prop in properties.items()}
+        list_fields = [
+            name
+            for name, prop in properties.items()
+            if prop.get("type") == "array" and prop.get("items", {}).get("type") == "string"
+        ]
+        if list_fields and indexed is None:
+            for candidate in CANDIDATE.findall(text):
+                keywords = DIGIT_FIELDS if candidate[0].isdigit() else WORD_FIELDS
+                value[self.field_for(list_fields, keywords)].append(candidate)
+        return value
+
+    @staticmethod
+    def field_for(list_fields, keywords):
+        for keyword in keywords:
+            for name in list_fields:
+                if keyword in name:
+                    return name
+        return list_fields[0]
+
+    @staticmethod
+    def is_object(schema, defs):
+        if "$ref" in schema:
+            schema = defs[schema["$ref"].split("/")[-1]]
+        return schema.get("type") == "object"
@@ -0,0 +1,41 @@
+from llama_index.core.base.llms.types import LLMMetadata
+from llama_index.llms.openai import OpenAI
+import os
+from typing import ClassVar
+from algos.sentence_tagging.gpt import TaggingSentenceByGPT, load_secrets
+
+
+class OpenAICompatibleLLM(OpenAI):
+    # llama-index only knows the metadata of OpenAI's own models,
+    # any model behind an OpenAI-compatible endpoint is taken as a tool calling chat model
+    CONTEXT_WINDOW: ClassVar[int] = 32768
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(
+            context_window=self.CONTEXT_WINDOW,
+            num_output=self.max_tokens or -1,
+            is_chat_model=True,
+            is_function_calling_model=True,
+            model_name=self.model,
+        )
+
+
+class TaggingSentenceByOpenAICompatible(TaggingSentenceByGPT):
+    """
+    Tagging through any OpenAI-compatible chat completions endpoint (vLLM, a gateway,
+    scripts/mock_openai_server.py, ...), the model name is passed through as is.
+    The endpoint must support tool calling.
+    """
+
+    LLM_CLASS = OpenAICompatibleLLM
+    API_KEY_ENV = "OPENAI_COMPATIBLE_API_KEY"
+    # the openai client refuses an empty key, local servers usually ignore it
+    NO_API_KEY = "EMPTY"
+
+    def __init__(self, model, api_base=None, api_key=None, **kwargs):
+        if api_base is None:
+            raise ValueError("api-base is required by the openai_compatible tagging")
+        load_secrets()
+        api_key = api_key or os.getenv(self.API_KEY_ENV) or self.NO_API_KEY
+        super().__init__(model=model, api_base=api_base, api_key=api_key, **kwargs)
@@ -0,0 +1,61 @@
+import re
+
+# months & number words are the only PHI hints that can be written in lower case
+_MONTHS = (
+    "jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec|"
+    "january|february|march|april|june|july|august|september|october|november|december"
+)
+_NUMBER_WORDS = "ninety|hundred"
+
+
+class PHIPrefilter:
+    """
+    Cheap rule stage run before the model.
+
+    i2b2 PHI (names, hospitals, ids, dates, locations, phones, ages, contacts) needs at least one of:
+    a capitalized token, a digit, a month / number word or a contact-like pattern (email, url).
+    A sentence with none of them is "definitely no PHI" and can skip the model.
+    Everything is one precompiled regex, a search per sentence.
+    PHI_SHAPED is narrower: numbers that look like PHI (dates, phone numbers, ids, ages over 89) rather than
+    doses, vitals or counts, e.g. for the cascade to double check an answer without any entity.
+    """
+
+    NEEDS_MODEL = re.compile(
+        rf"[A-Z0-9@]|www\.|https?:|(?i:\b(?:{_MONTHS}|{_NUMBER_WORDS})\b)"
+    )
+
+    PHI_SHAPED = re.compile(
+        # dates: 12/03/2006, 12/03, 2006-12-03, Dec 3 / 3 Dec 2006
+        r"\b(?:0?[1-9]|1[0-2])[/-](?:0?[1-9]|[12]\d|3[01])(?:[/-](?:\d{4}|\d{2}))?\b"
+        r"|\b\d{4}-\d{2}-\d{2}\b"
+        rf"|(?i:\b(?:{_MONTHS})\.? \d{{1,2}}\b|\b\d{{1,2}} (?:{_MONTHS})\b)"
+        # phone numbers: (617) 555-1234, 617-555-1234
+        r"|\(?\b\d{3}\)?[-. ]\d{3}[-. ]\d{4}\b"
+        # ids & record numbers: long digit runs, letters followed by digits
+        r"|\b\d{5,}\b|\b[A-Z]{1,4}\d{4,}\b"
+        # ages over 89: 92 yo, 95 years old, 101-year-old, ninety
+        r"|\b(?:9\d|1[0-4]\d)[ -]?(?:y/?o|yrs?|years?|-year)\b|(?i:\bninety)"
+    )
+
+    def __init__(self):
+        self.checked = 0
+        self.skipped = 0
+
+    def needs_model(self, sentence: str) -> bool:
+        self.checked += 1
+        if self.NEEDS_MODEL.search(sentence):
+            return True
+        self.skipped += 1
+        return False
+
+    def has_phi_shape(self, sentence: str) -> bool:
+        return self.PHI_SHAPED.search(sentence) is not None
+
+    def stats(self) -> dict:
+        return {
+            "prefilter_checked": self.checked,
+            "prefilter_skipped": self.skipped,
+            "prefilter_skip_rate": round(self.skipped / self.checked, 4)
+            if self.checked
+            else 0.0,
+        }
@@ -0,0 +1,291 @@
+import asyncio
+from collections import deque
+import random
+import re
+import time
+from typing import Awaitable, Callable, Optional, Tuple, TypeVar
+import openai
+from loguru import logger
+
+T = TypeVar("T")
+
+# durations used by the x-ratelimit-reset-* headers, e.g. "1s", "6m0s", "20ms"
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: str) -> Optional[float]:
+    # "6m0s" -> 360.0, plain numbers are seconds (Retry-After)
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class TokenBucket:
+    """
+    A budget of `per_minute` units, refilled continuously.
+    """
+
+    def __init__(self, per_minute: float):
+        self.per_minute = float(per_minute)
+        self.tokens = self.per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, rate_scale: float) -> None:
+        now = time.monotonic()
+        rate = self.per_minute * rate_scale / 60
+        self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, rate_scale: float = 1.0) -> float:
+        # seconds until `amount` units are available, 0 if they already are
+        self._refill(rate_scale)
+        # a single request bigger than the whole budget only waits for a full bucket
+        amount = min(amount, self.per_minute)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / (self.per_minute * rate_scale / 60)
+
+    def consume(self, amount: float) -> None:
+        self.tokens -= min(amount, self.per_minute)
+
+
+class RateLimiter:
+    """
+    Rate limiter shared by all the concurrent tagging tasks of a process.
+
+    - Enforces requests-per-minute and tokens-per-minute budgets (None = no budget).
+    - Retries rate-limit (429), server (5xx), timeout & connection errors with exponential backoff and jitter,
+      at most `max_retries` times per call.
+    - Adapts its throughput: Retry-After and x-ratelimit-* headers pause every task until the reset,
+      a 429 halves the effective rate and every success wins back a little of it. The x-ratelimit-remaining-*
+      headers of successful responses (see `observe_headers`) also cap the local budgets, so an exhausted
+      provider budget is waited on before it turns into a 429.
+    - Bounds the tail latency: every call has a `request_timeout` deadline (a timeout is retried) and,
+      with `hedge` on, a call slower than the `hedge_quantile` latency seen so far is raced by a duplicate,
+      the first answer wins. Retries & hedges share the `max_retries` budget: a request never makes
+      more than max_retries + 1 calls.
+    """
+
+    MIN_RATE_SCALE = 0.1
+    RATE_SCALE_RECOVERY = 0.02
+    # latencies of the last LATENCY_WINDOW calls give the hedging threshold, once there are HEDGE_MIN_SAMPLES
+    LATENCY_WINDOW = 500
+    HEDGE_MIN_SAMPLES = 20
+
+    def __init__(
+        self,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        request_timeout: Optional[float] = None,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95,
+    ):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_retries = int(max_retries)
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+        self.request_timeout = float(request_timeout) if request_timeout else None
+        self.hedge = hedge
+        self.hedge_quantile = float(hedge_quantile)
+        self._latencies = deque(maxlen=self.LATENCY_WINDOW)
+        self._hedge_threshold = None
+        self._new_latencies = 0
+        self.rate_scale = 1.0
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+        # counters for the run summary
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.throttled_seconds = 0.0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    async def acquire(self, tokens: int = 0) -> None:
+        # waits (in FIFO order) until both budgets allow one more request of `tokens` tokens
+        async with self._lock:
+            while True:
+                wait = max(0.0, self._paused_until - time.monotonic())
+                if self.requests is not None:
+                    wait = max(wait, self.requests.wait_time(1, self.rate_scale))
+                if self.tokens is not None and tokens:
+                    wait = max(wait, self.tokens.wait_time(tokens, self.rate_scale))
+                if wait <= 0:
+                    break
+                self.throttled_seconds += wait
+                await asyncio.sleep(wait)
+            if self.requests is not None:
+                self.requests.consume(1)
+            if self.tokens is not None and tokens:
+                self.tokens.consume(tokens)
+
+    async def run(self, call: Callable[[], Awaitable[T]], tokens: int = 0) -> T:
+        # call - a coroutine function doing one request, called again on every retry (and hedge)
+        attempt = 0
+        # calls beyond the first one (retries & hedges) made for this request
+        extra_calls = 0
+        while True:
+            await self.acquire(tokens)
+            self.calls += 1
+            hedges = []
+            try:
+                result = await self._call_hedged(
+                    call, tokens, allow_hedge=extra_calls < self.max_retries, hedges=hedges
+                )
+            except Exception as e:
+                extra_calls += len(hedges)
+                retryable, pause = self._inspect_error(e)
+                if not retryable or extra_calls >= self.max_retries:
+                    raise
+                delay = min(self.max_delay, self.base_delay * 2**attempt)
+                # full jitter, so the retries of concurrent tasks do not fire together
+                delay = random.uniform(0, delay)
+                if pause is not None:
+                    delay = max(delay, pause)
+                attempt += 1
+                extra_calls += 1
+                self.retries += 1
+                logger.warning(
+                    f"Tagging request failed ({type(e).__name__}), retry {extra_calls}/{self.max_retries} in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+                continue
+            self.rate_scale = min(1.0, self.rate_scale + self.RATE_SCALE_RECOVERY)
+            return result
+
+    async def _call_with_deadline(self, call: Callable[[], Awaitable[T]]) -> T:
+        start = time.monotonic()
+        try:
+            if self.request_timeout is None:
+                result = await call()
+            else:
+                result = await asyncio.wait_for(call(), self.request_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        self._record_latency(time.monotonic() - start)
+        return result
+
+    async def _call_hedged(
+        self, call: Callable[[], Awaitable[T]], tokens: int, allow_hedge: bool, hedges: list
+    ) -> T:
+        # hedges - filled with the duplicate calls made, they count against the retry budget
+        threshold = self._hedge_threshold if self.hedge and allow_hedge else None
+        if threshold is None:
+            return await self._call_with_deadline(call)
+
+        primary = asyncio.ensure_future(self._call_with_deadline(call))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=threshold)
+            if done:
+                return primary.result()
+
+            # slower than most calls so far, a duplicate races it
+            await self.acquire(tokens)
+            self.calls += 1
+            self.hedges += 1
+            hedge = asyncio.ensure_future(self._call_with_deadline(call))
+            hedges.append(hedge)
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+            # both failed, the error of the first call is the one retried
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _record_latency(self, latency: float) -> None:
+        self._latencies.append(latency)
+        self._new_latencies += 1
+        # the quantile is recomputed every few calls, not on every call
+        if len(self._latencies) >= self.HEDGE_MIN_SAMPLES and self._new_latencies >= 10:
+            ordered = sorted(self._latencies)
+            self._hedge_threshold = ordered[int(self.hedge_quantile * (len(ordered) - 1))]
+            self._new_latencies = 0
+
+    def _inspect_error(self, e: Exception) -> Tuple[bool, Optional[float]]:
+        # returns (retryable, seconds every task should pause for)
+        if isinstance(
+            e, (openai.APITimeoutError, openai.APIConnectionError, asyncio.TimeoutError)
+        ):
+            return True, None
+        if not isinstance(e, openai.APIStatusError):
+            return False, None
+
+        if e.status_code == 429:
+            self.rate_limited += 1
+            self.rate_scale = max(self.MIN_RATE_SCALE, self.rate_scale / 2)
+        elif e.status_code >= 500:
+            self.server_errors += 1
+        else:
+            return False, None
+
+        pause = self._pause_from_headers(e.response.headers)
+        if pause is not None:
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+        return True, pause
+
+    def observe_headers(self, headers) -> None:
+        # headers of a successful response: the provider's remaining budget caps the local one,
+        # and an exhausted budget pauses every task until it resets
+        for budget, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+            remaining = headers.get(f"x-ratelimit-remaining-{budget}")
+            if bucket is None or remaining is None:
+                continue
+            try:
+                bucket.tokens = min(bucket.tokens, float(remaining))
+            except ValueError:
+                pass
+        pause = self._pause_from_headers(headers)
+        if pause is not None:
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+
+    @staticmethod
+    def _pause_from_headers(headers) -> Optional[float]:
+        pauses = [parse_duration(headers.get("retry-after"))]
+        # an exhausted provider budget pauses everyone until it resets
+        for budget in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{budget}")
+            if remaining is not None and remaining.strip() == "0":
+                pauses.append(parse_duration(headers.get(f"x-ratelimit-reset-{budget}")))
+        pauses = [pause for pause in pauses if pause is not None]
+        return max(pauses) if pauses else None
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.calls,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "server_errors": self.server_errors,
+            "throttled_seconds": round(self.throttled_seconds, 2),
+            "rate_scale": round(self.rate_scale, 2),
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_threshold_ms": round(self._hedge_threshold * 1000)
+            if self._hedge_threshold is not None
+            else None,
+        }
@@ -0,0 +1,80 @@
+# Multi-pattern string matching
+from collections import deque
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton over a list of patterns: every occurrence of every pattern is found
+    in one pass over the text, O(len(text) + #occurrences) after an O(total pattern length) build.
+    Matches are reported as (start, end, pattern index); empty patterns never match.
+    """
+
+    def __init__(self, patterns: Sequence[str]):
+        self.patterns = list(patterns)
+        # trie: goto[state][char] -> state; out[state] - indices of the patterns ending at state,
+        # including the ones reached through failure links
+        self.goto: List[Dict[str, int]] = [{}]
+        self.out: List[List[int]] = [[]]
+        self.fail: List[int] = []
+        for index, pattern in enumerate(self.patterns):
+            if pattern:
+                self._add(pattern, index)
+        self._link()
+
+    def _add(self, pattern: str, index: int) -> None:
+        goto = self.goto
+        state = 0
+        for char in pattern:
+            next_state = goto[state].get(char)
+            if next_state is None:
+                next_state = len(goto)
+                goto[state][char] = next_state
+                goto.append({})
+            state = next_state
+        self.out.extend([] for _ in range(len(goto) - len(self.out)))
+        self.out[state].append(index)
+
+    def _link(self) -> None:
+        # breadth first, a state's failure link is the longest proper suffix present in the trie
+        goto, out = self.goto, self.out
+        fail = self.fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                link = fail[next_state] = goto[fallback].get(char, 0)
+                if out[link]:
+                    out[next_state] = out[next_state] + out[link]
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        # every (start, end, pattern index) occurrence, overlapping ones included
+        goto, fail, out, patterns = self.goto, self.fail, self.out, self.patterns
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in out[state]:
+                yield position + 1 - len(patterns[index]), position + 1, index
+
+    def non_overlapping(self, text: str) -> List[Tuple[int, int, int]]:
+        """
+        Occurrences that do not overlap, sorted by start. Conflicts are resolved by priority:
+        a lower pattern index wins, then the leftmost occurrence of the same pattern;
+        i.e. taking patterns in order & each one's occurrences left to right.
+        """
+        matches = sorted(self.finditer(text), key=lambda match: (match[2], match[0]))
+        taken = bytearray(len(text))
+        selected = []
+        for start, end, index in matches:
+            if taken.find(1, start, end) != -1:
+                continue
+            taken[start:end] = b"\x01" * (end - start)
+            selected.append((start, end, index))
+        selected.sort()
+        return selected
@@ -1,8 +1,10 @@
 # Foundation level abstractions
 import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from functools import wraps
 import json
-from typing import Any, Dict, List
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List
 import pandas as pd
 
 
@@ -88,6 +90,122 @@ class AsyncUtils:
 
         return wrapper
 
+    @staticmethod
+    async def bounded_ordered_map(
+        async_func: Callable[[Any], Awaitable[Any]],
+        items: Iterable,
+        limit: int,
+        window: int = None,
+    ) -> AsyncIterator[Any]:
+        """
+        Applies async_func to every item with at most `limit` calls in flight.
+
+        Results are yielded in the order of `items`, as soon as a result & all the ones before it are done.
+        At most `window` (default: 4 x limit) tasks are scheduled ahead of the last yielded result,
+        so a slow call at the head does not stall the rest & memory stays bounded for long iterables.
+
+        If any call raises, the remaining tasks are cancelled and the exception is propagated.
+        """
+        limit = max(1, int(limit))
+        window = max(limit, window or 4 * limit)
+        semaphore = asyncio.Semaphore(limit)
+
+        async def bounded(item):
+            async with semaphore:
+                return await async_func(item)
+
+        iterator = iter(items)
+        pending = deque()
+
+        def schedule():
+            for item in iterator:
+                pending.append(asyncio.ensure_future(bounded(item)))
+                if len(pending) >= window:
+                    break
+
+        schedule()
+        try:
+            while pending:
+                result = await pending.popleft()
+                schedule()
+                yield result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @staticmethod
+    async def achunked(items: AsyncIterator, size: int) -> AsyncIterator[List]:
+        """Consecutive lists of `size` items of an async iterable (the last one may be shorter)."""
+        size = max(1, int(size))
+        chunk = []
+        async for item in items:
+            chunk.append(item)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+# object the tasks of a process pool worker run on, set once per worker by PoolUtils.ordered_process_map
+_pool_target = None
+
+
+def _init_pool_worker(target):
+    global _pool_target
+    _pool_target = target
+
+
+def _call_pool_worker(method: str, item):
+    return getattr(_pool_target, method)(item)
+
+
+class PoolUtils:
+    """Set of utils for fanning CPU bound work out to processes"""
+
+    @staticmethod
+    async def ordered_process_map(
+        target: Any, method: str, items: AsyncIterator, workers: int, window: int = None
+    ) -> AsyncIterator[Any]:
+        """
+        Calls target.<method>(item) for every item in a pool of `workers` processes.
+
+        `target` is sent once to each worker (by the pool initializer), not with every item, so it may hold
+        state that is costly to pickle; it & the items must be picklable.
+        Results are yielded in the order of `items` as they complete, with at most `window` (default: 2 x workers)
+        items in flight, so memory stays bounded for long iterables.
+        """
+        workers = max(1, int(workers))
+        window = max(workers, window or 2 * workers)
+        iterator = items.__aiter__()
+        pending = deque()
+        exhausted = False
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_pool_worker, initargs=(target,)
+        ) as executor:
+
+            async def schedule():
+                nonlocal exhausted
+                while not exhausted and len(pending) < window:
+                    try:
+                        item = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        return
+                    pending.append(
+                        asyncio.wrap_future(executor.submit(_call_pool_worker, method, item))
+                    )
+
+            await schedule()
+            try:
+                while pending:
+                    result = await pending.popleft()
+                    await schedule()
+                    yield result
+            finally:
+                for future in pending:
+                    future.cancel()
+
 
 class CollectionUtils:
     """TODO: Move out of this abstractions file if it gains more usage."""
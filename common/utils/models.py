@@ -0,0 +1,98 @@
+import threading
+import time
+from typing import Dict, Iterable, Tuple
+from loguru import logger
+from common.utils.base import singleton
+
+# text run through a freshly loaded pipeline, so the first real batch does not pay for lazy initialization
+WARM_UP_TEXT = "Patient was seen by Dr. Smith at Lake Hospital on 12/03/2006 . He is doing well."
+
+
+@singleton
+class ModelRegistry:
+    """
+    Process-wide cache of spaCy pipelines, each loaded once on first use.
+    A pipeline is keyed by the model name, its excluded & enabled components and the components added to it,
+    so e.g. every sentence extractor of a run shares one en_core_web_sm without its tagger / ner.
+    """
+
+    def __init__(self):
+        self._pipelines: Dict[tuple, object] = {}
+        self._load_seconds: Dict[tuple, float] = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def key(
+        model: str,
+        exclude: Iterable[str] = (),
+        enable: Iterable[str] = (),
+        add: Iterable[str] = (),
+        blank: bool = False,
+    ) -> tuple:
+        return (model, tuple(sorted(exclude)), tuple(sorted(enable)), tuple(add), blank)
+
+    def get(
+        self,
+        model: str,
+        exclude: Iterable[str] = (),
+        enable: Iterable[str] = (),
+        add: Iterable[str] = (),
+        blank: bool = False,
+        warm_up: bool = False,
+    ):
+        """
+        The pipeline of `model` without the `exclude` components, with the (disabled by default) `enable`
+        components turned on and the `add` factories appended. blank=True starts from spacy.blank(model),
+        model being a language code.
+        """
+        key = self.key(model, exclude, enable, add, blank)
+        with self._lock:
+            nlp = self._pipelines.get(key)
+            if nlp is None:
+                nlp = self._load(key)
+                if warm_up:
+                    self.warm_up(nlp, key)
+            else:
+                logger.debug(f"Reusing spaCy pipeline {self._describe(key)}")
+            return nlp
+
+    def warm_up(self, nlp, key: tuple = None, text: str = WARM_UP_TEXT):
+        # one pass over a short text, the first call of a pipeline initializes lazily loaded data
+        start = time.perf_counter()
+        nlp(text)
+        seconds = time.perf_counter() - start
+        logger.info(f"Warmed up spaCy pipeline {self._describe(key) if key else ''} in {seconds:.2f}s")
+
+    def loaded(self) -> Dict[tuple, float]:
+        # load time in seconds of every pipeline loaded so far
+        return dict(self._load_seconds)
+
+    def clear(self):
+        with self._lock:
+            self._pipelines.clear()
+            self._load_seconds.clear()
+
+    def _load(self, key: tuple):
+        import spacy
+
+        model, exclude, enable, add, blank = key
+        start = time.perf_counter()
+        if blank:
+            nlp = spacy.blank(model)
+        else:
+            nlp = spacy.load(model, exclude=list(exclude))
+        for name in enable:
+            nlp.enable_pipe(name)
+        for factory in add:
+            nlp.add_pipe(factory)
+        seconds = time.perf_counter() - start
+        self._pipelines[key] = nlp
+        self._load_seconds[key] = seconds
+        logger.info(f"Loaded spaCy pipeline {self._describe(key)} in {seconds:.2f}s, components: {nlp.pipe_names}")
+        return nlp
+
+    @staticmethod
+    def _describe(key: Tuple) -> str:
+        model, exclude, enable, add, blank = key
+        details = [f"{name}={list(value)}" for name, value in (("exclude", exclude), ("enable", enable), ("add", add)) if value]
+        return f"{'blank:' if blank else ''}{model}" + (f" ({', '.join(details)})" if details else "")
@@ -207,3 +207,12 @@ class ETLUtils:
                 i += 1
 
         return options, args
+
+    @staticmethod
+    def as_bool(value) -> bool:
+        """
+        Options passed via cli are strings: coerce `--flag-name true` (or a YAML bool) to a bool.
+        """
+        if isinstance(value, str):
+            return value.strip().lower() in ("true", "1", "yes")
+        return bool(value)
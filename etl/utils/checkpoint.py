@@ -0,0 +1,107 @@
+import json
+import os
+from typing import Any, Callable, Dict, Hashable, Set
+from loguru import logger
+from pydantic.json import pydantic_encoder
+from common.utils.dt import DT
+
+
+class NdjsonCheckpoint:
+    """
+    Append-only ndjson output with a small progress manifest next to it (<file>.manifest.json).
+
+    - Every record is appended exactly once, the file is flushed every `flush_every` records.
+    - `done_keys` reads back the keys of the records already in the file, so an interrupted run can resume.
+      Only a file whose manifest says its run was interrupted is resumed: a completed run, or a file without
+      manifest (not written by a checkpoint), is started over.
+    - A partially written last line (crash in the middle of a write) is dropped before appending again.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        key_fn: Callable[[Dict[str, Any]], Hashable],
+        flush_every: int = 100,
+    ):
+        self.file_path = file_path
+        self.manifest_path = f"{file_path}.manifest.json"
+        self.key_fn = key_fn
+        self.flush_every = max(1, int(flush_every))
+        self.written = 0
+        self.resumed = 0
+        self._pending = 0
+        self._file = None
+
+    def done_keys(self) -> Set[Hashable]:
+        # keys of the records already present in the output file, none if it is not an interrupted run's
+        if not self.resumable():
+            return set()
+        self._drop_partial_line()
+        keys = set()
+        with open(self.file_path, "r") as f:
+            for line in f:
+                if line.strip():
+                    keys.add(self.key_fn(json.loads(line)))
+        self.resumed = len(keys)
+        return keys
+
+    def resumable(self) -> bool:
+        # is the output file the one of an interrupted run, as recorded in its manifest
+        if not os.path.exists(self.file_path) or not os.path.exists(self.manifest_path):
+            return False
+        with open(self.manifest_path, "r") as f:
+            return not json.load(f).get("complete", False)
+
+    def open(self, resume: bool) -> None:
+        # resume=False, or an output that is not an interrupted run's, starts the output file from scratch
+        if resume and not self.resumable():
+            if os.path.exists(self.file_path):
+                logger.info(f"{self.file_path} is not the output of an interrupted run, starting it over")
+            resume = False
+        self._file = open(self.file_path, "a" if resume else "w")
+        if not resume:
+            self.resumed = 0
+        self._write_manifest(complete=False)
+
+    def append(self, record: Any) -> None:
+        self._file.write(json.dumps(record, default=pydantic_encoder) + "\n")
+        self.written += 1
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        self._file.flush()
+        self._pending = 0
+        self._write_manifest(complete=False)
+
+    def close(self, complete: bool = True) -> str:
+        if self._file is not None:
+            self._file.flush()
+            self._file.close()
+            self._file = None
+            self._write_manifest(complete=complete)
+        return self.file_path
+
+    def _drop_partial_line(self) -> None:
+        with open(self.file_path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                last_newline = data.rfind(b"\n")
+                f.truncate(last_newline + 1)
+                logger.warning(f"Dropped a partially written record from {self.file_path}")
+
+    def _write_manifest(self, complete: bool) -> None:
+        manifest = {
+            "file": self.file_path,
+            "records": self.resumed + self.written,
+            "written_in_this_run": self.written,
+            "resumed_from": self.resumed,
+            "complete": complete,
+            "updated_at": DT.to_dt_str(DT.now()),
+        }
+        # write & rename, so the manifest is never half written
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
@@ -0,0 +1,107 @@
+import hashlib
+import heapq
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class Sampler:
+    """
+    Deterministic sampling of a stream, without materializing it.
+
+    Every item gets a pseudo random rank in [0, 1): a hash of (seed, key_fn(item)),
+    so the same items are selected on every run and an item's fate does not depend on the others.
+    - fraction: keeps the items ranked below the fraction, O(1) memory.
+    - count: keeps the `count` lowest ranked items (bottom-k), O(count) memory.
+      With a stratum_fn the count is split between the strata in proportion to their sizes: a first pass
+      counts the items of each stratum, the second keeps the quota lowest ranked items of each stratum,
+      O(count) memory (plus a counter per stratum).
+    The items are given as a function returning a fresh iterable of them, called once per pass.
+    Selected items are returned in input order.
+    """
+
+    def __init__(
+        self,
+        key_fn: Callable[[Any], Hashable],
+        count: Optional[int] = None,
+        fraction: Optional[float] = None,
+        stratum_fn: Optional[Callable[[Any], Hashable]] = None,
+        seed: int = 0,
+    ):
+        if (count is None) == (fraction is None):
+            raise ValueError("Sampler needs exactly one of count & fraction")
+        self.key_fn = key_fn
+        self.count = count
+        self.fraction = fraction
+        self.stratum_fn = stratum_fn
+        self.seed = seed
+        self.seen = 0
+        self.selected = 0
+
+    def rank(self, item: Any) -> float:
+        digest = hashlib.blake2b(
+            f"{self.seed}:{self.key_fn(item)}".encode("utf-8"), digest_size=8
+        ).digest()
+        return int.from_bytes(digest, "big") / 2**64
+
+    def sample(self, read: Callable[[], Iterable[Any]]) -> List[Any]:
+        self.seen = 0
+        if self.fraction is not None:
+            selected = self._sample_fraction(read())
+        elif self.stratum_fn is None:
+            selected = self._sample_count(read(), {None: self.count})
+        else:
+            selected = self._sample_count(read(), self._allocate(self._stratum_sizes(read())))
+        self.selected = len(selected)
+        return selected
+
+    def _sample_fraction(self, items: Iterable[Any]) -> List[Any]:
+        # the rate is the same for every stratum, no stratification needed
+        selected = []
+        for item in items:
+            self.seen += 1
+            if self.rank(item) < self.fraction:
+                selected.append(item)
+        return selected
+
+    def _stratum_sizes(self, items: Iterable[Any]) -> Dict[Hashable, int]:
+        # counting pass, only the stratum of each item is kept
+        sizes: Dict[Hashable, int] = {}
+        for item in items:
+            stratum = self.stratum_fn(item)
+            sizes[stratum] = sizes.get(stratum, 0) + 1
+        return sizes
+
+    def _sample_count(self, items: Iterable[Any], quotas: Dict[Hashable, int]) -> List[Any]:
+        # one max-heap (negated ranks) of the `quota` lowest ranked items per stratum
+        heaps: Dict[Hashable, List[Tuple[float, int, Any]]] = {}
+        for position, item in enumerate(items):
+            self.seen += 1
+            stratum = self.stratum_fn(item) if self.stratum_fn else None
+            quota = quotas.get(stratum, 0)
+            if quota == 0:
+                continue
+            heap = heaps.setdefault(stratum, [])
+            entry = (-self.rank(item), position, item)
+            if len(heap) < quota:
+                heapq.heappush(heap, entry)
+            elif entry[0] > heap[0][0]:
+                heapq.heapreplace(heap, entry)
+
+        selected = [entry for heap in heaps.values() for entry in heap]
+        return [item for _, _, item in sorted(selected, key=lambda entry: entry[1])]
+
+    def _allocate(self, sizes: Dict[Hashable, int]) -> Dict[Hashable, int]:
+        # count split in proportion to the stratum sizes, largest remainders get the leftovers
+        total = sum(sizes.values())
+        count = min(self.count, total)
+        if total == 0:
+            return {}
+        shares = {stratum: count * size / total for stratum, size in sizes.items()}
+        quotas = {stratum: int(share) for stratum, share in shares.items()}
+        leftover = count - sum(quotas.values())
+        by_remainder = sorted(shares, key=lambda stratum: quotas[stratum] - shares[stratum])
+        for stratum in by_remainder[:leftover]:
+            quotas[stratum] += 1
+        return quotas
+
+    def stats(self) -> dict:
+        return {"sampled": self.selected, "sampled_from": self.seen}
@@ -1,8 +1,13 @@
-from abc import ABC
-from typing import Generic, TypeVar, List
+from abc import ABC, abstractmethod
+import inspect
+import json
+from typing import AsyncIterator, Dict, Generic, List, TypeVar
+from loguru import logger
 from pydantic import BaseModel
-from typing import Generic, List, TypeVar
+from pydantic.json import pydantic_encoder
+import tqdm
 
+from common.utils.base import AsyncUtils, PoolUtils
 from etl.ETL import ETL
 
 
@@ -21,3 +26,96 @@ class DSETL(
     """
 
     pass
+
+
+class StreamingDSETL(
+    ETL[AsyncIterator[T_EXTRACTED], AsyncIterator[T_TRANSFORMED]],
+    ABC,
+    Generic[T_EXTRACTED, T_TRANSFORMED],
+):
+    """
+    Streaming variant of DSETL: records flow through the ETL as they are read instead of as whole lists,
+    so memory stays bounded by a few chunks whatever the size of the input.
+    - extract() is an async generator of records.
+    - transform() groups them in chunks of `chunk-size` records & maps transform_chunk over the chunks.
+      With `workers` > 1 the chunks are transformed in a process pool (the ETL is sent once to each worker),
+      the transformed records keep the order of the input.
+      transform_chunk may also be a coroutine function (I/O bound work, e.g. requests), awaited in the event loop.
+    - load() consumes the transformed records as they arrive, e.g. with _write_ndjson.
+    Counters of transform_chunk go to self.stats, summed over the chunks transformed by the workers.
+    """
+
+    STREAMING_OPTIONS = {
+        "workers": 1,
+        "chunk-size": 256,
+    }
+
+    def __init__(self, cli_tokens=None, options=None, default_options=None):
+        super().__init__(cli_tokens, options, {**self.STREAMING_OPTIONS, **(default_options or {})})
+        self.workers = int(self.options["workers"])
+        self.chunk_size = int(self.options["chunk-size"])
+        self.stats: Dict[str, int] = {}
+
+    @abstractmethod
+    async def extract(self) -> AsyncIterator[T_EXTRACTED]:
+        """
+        Async generator of the extracted records.
+        """
+        pass
+
+    def transform_chunk(self, chunk: List[T_EXTRACTED]) -> List[T_TRANSFORMED]:
+        """
+        Default Transform Function of a chunk of records: Identity
+        """
+        return chunk
+
+    async def transform(self, data: AsyncIterator[T_EXTRACTED]) -> AsyncIterator[T_TRANSFORMED]:
+        chunks = AsyncUtils.achunked(data, self.chunk_size)
+        if self.workers > 1:
+            logger.info(f"Transforming with {self.workers} workers, {self.chunk_size} records per chunk")
+            results = PoolUtils.ordered_process_map(
+                self, "_transform_chunk_in_worker", chunks, self.workers
+            )
+            async for records, stats in results:
+                for key, count in stats.items():
+                    self.stats[key] = self.stats.get(key, 0) + count
+                for record in records:
+                    yield record
+        else:
+            async for chunk in chunks:
+                records = self.transform_chunk(chunk)
+                if inspect.isawaitable(records):
+                    records = await records
+                for record in records:
+                    yield record
+
+    def _transform_chunk_in_worker(self, chunk: List[T_EXTRACTED]):
+        # runs in a pool worker, on its own copy of the ETL: the records & counters of this chunk only
+        self.stats = {}
+        return self.transform_chunk(chunk), self.stats
+
+    @abstractmethod
+    async def load(self, data: AsyncIterator[T_TRANSFORMED]):
+        """
+        Consumes the transformed records as they arrive.
+        """
+        pass
+
+    async def run(self):
+        """
+        Method to orchestrate the streaming ETL process: extract, transform & load run interleaved, record by record.
+        """
+        logger.info("Running streaming ETL...")
+        await self.load(self.transform(self.extract()))
+        logger.success("Load Done.")
+
+    @staticmethod
+    async def _write_ndjson(records: AsyncIterator[BaseModel], file_path: str) -> int:
+        # write the records to an ndjson file as they arrive, returns the number of records written
+        count = 0
+        with open(file_path, "w") as f, tqdm.tqdm(desc=f"Writing {file_path}") as progress:
+            async for record in records:
+                f.write(json.dumps(record, default=pydantic_encoder) + "\n")
+                count += 1
+                progress.update(1)
+        return count
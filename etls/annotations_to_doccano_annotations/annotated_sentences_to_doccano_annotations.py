@@ -7,8 +7,8 @@ from models.model import (
     Annotations,
     AnnotatedSentence,
 )
-from etls.DSETL import DSETL
-from typing import List
+from etls.DSETL import StreamingDSETL
+from typing import AsyncIterator, Iterator, List
 from common.utils.log import ConfigureLogging
 from pydantic.json import pydantic_encoder
 from loguru import logger
@@ -17,11 +17,10 @@ import tqdm
 from scripts.post_processing_of_tagged_sentences import (
     convert_human_readable_to_doccano_annotations_in_ndjson, 
     convert_machine_readable_to_human_readable_annotations, 
-    write_doccano_tagged_sentences
 )
 
 
-class AnnotatedSnetencesToDoccano(DSETL[AnnotatedSentence, AnnotatedSentence]):
+class AnnotatedSnetencesToDoccano(StreamingDSETL[AnnotatedSentence, AnnotatedSentence]):
     # Default output directories for human-readable and Doccano formats
     DEFAULT_OPTIONS = {
         "out-dir-human": DataConstants.TAGGED_SENTENCES_HUMAN_DIR,
@@ -47,56 +46,33 @@ class AnnotatedSnetencesToDoccano(DSETL[AnnotatedSentence, AnnotatedSentence]):
         os.makedirs(self.out_dir_human, exist_ok=True)
         os.makedirs(self.out_dir_doccano, exist_ok=True)
 
-    async def extract(self) -> List[AnnotatedSentence]:
-        # Step 1: Read NDJSON file and return sentences
-        ts = self._read_ndjson_file_and_return_sentences(self.inp_file_path)
+    async def extract(self) -> AsyncIterator[AnnotatedSentence]:
+        # Step 1: Read the sentences of the NDJSON file, one at a time
+        for sentence in self._read_ndjson_file_and_yield_sentences(self.inp_file_path):
+            yield sentence
         logger.success(f"Reading Done...  from file {self.inp_file_path}")
-        return ts
 
-    async def transform(self, data: List[AnnotatedSentence]) -> List[AnnotatedSentence]:
-        # Transform clinical notes to sentences
-        ts = self._transform_tagged_sentences_to_humman_readable_tagged_sentences(data)
-        logger.success(f"Sentences Tagging Done...  from file {self.inp_file_path}")
-        return ts
-
-    async def load(self, data: List[AnnotatedSentence]):
-        # Dump in outfile.ndjson format
-        file_saved = self._write_tagged_sentences(data, self.out_file_name)
-        logger.success(f"Loaded {len(data)} to file {file_saved}")
-        return
-
-    def _write_tagged_sentences(
-        self,
-        sentences: List[AnnotatedSentence],
-        file_name: str,
-        _type="ndjson",
-    ) -> None:
-        # Write sentences to an NDJSON file
-        if (_type != "ndjson"):
-            raise ValueError("Only 'ndjson' type is supported")
-        with open(f"{self.out_db.db}/{file_name}.{_type}", "w") as f:
-            for sentence in tqdm.tqdm(sentences):
+    async def load(self, data: AsyncIterator[AnnotatedSentence]):
+        # Dump the human readable sentences in outfile.ndjson format, and their doccano annotations alongside
+        file_saved = f"{self.out_db.db}/{self.out_file_name}.ndjson"
+        doccano_file_saved = f"{self.out_dir_doccano}/{self.out_file_name}.ndjson"
+        count = 0
+        with open(file_saved, "w") as f, open(doccano_file_saved, "w") as doccano_f:
+            async for sentence in data:
                 f.write(json.dumps(sentence, default=pydantic_encoder) + "\n")
-        return f"{self.out_db.db}/{file_name}.{_type}"
+                doccano_f.write(json.dumps(self._to_doccano(sentence)) + "\n")
+                count += 1
+        logger.success(f"Loaded {count} to file {doccano_file_saved}")
+        logger.success(f"Loaded {count} to file {file_saved}")
+        return
 
-    def _transform_tagged_sentences_to_humman_readable_tagged_sentences(
-        self, sentences: List[AnnotatedSentence]
-    ) -> List[AnnotatedSentence]:
-        # Convert machine-readable annotations to human-readable format and save
+    def transform_chunk(self, sentences: List[AnnotatedSentence]) -> List[AnnotatedSentence]:
+        # Convert machine-readable annotations to human-readable format
         human_annotated_snetences = []
-        doccano_annotated_sentences = []
-        for sentence in tqdm.tqdm(sentences):
+        for sentence in sentences:
             annotations = convert_machine_readable_to_human_readable_annotations(
                 sentence=sentence.text, tags=sentence.annotations.annotations
             )
-            doccano_annotated_sentences.append(
-                convert_human_readable_to_doccano_annotations_in_ndjson(
-                    sentence=sentence.text,
-                    tags=annotations,
-                    _tag_source=sentence.annotations.annotation_source,
-                    id=sentence.sentence_id_in_note,
-                )
-            )
             human_annotated_snetences.append(
                 AnnotatedSentence(
                     text=sentence.text,
@@ -113,24 +89,25 @@ class AnnotatedSnetencesToDoccano(DSETL[AnnotatedSentence, AnnotatedSentence]):
                     ),
                 )
             )
-        write_doccano_tagged_sentences(
-            sentences1=doccano_annotated_sentences,
-            file_path=self.out_dir_doccano,
-            file_name=self.out_file_name,
-            _type="ndjson",
-        )
         return human_annotated_snetences
 
-    def _read_ndjson_file_and_return_sentences(
+    @staticmethod
+    def _to_doccano(sentence: AnnotatedSentence) -> dict:
+        # Doccano line of a human readable sentence
+        return convert_human_readable_to_doccano_annotations_in_ndjson(
+            sentence=sentence.text,
+            tags=sentence.annotations.annotations,
+            _tag_source=sentence.annotations.annotation_source,
+            id=sentence.sentence_id_in_note,
+        )
+
+    def _read_ndjson_file_and_yield_sentences(
         self, file_path: str
-    ) -> List[AnnotatedSentence]:
-        # Read NDJSON file and return list of sentences
-        sentences = []
+    ) -> Iterator[AnnotatedSentence]:
+        # Read NDJSON file and yield its sentences
         with open(file_path, "r") as f:
             for line in tqdm.tqdm(f, desc="Processing lines"):
-                sentence = AnnotatedSentence.model_validate_json(line)
-                sentences.append(sentence)
-        return sentences
+                yield AnnotatedSentence.model_validate_json(line)
 
 
 if __name__ == "__main__":
@@ -1,26 +1,26 @@
 import asyncio
+import bisect
 import sys
-import json
 from etl.utils.dfutils import LakeDB
 from utils.constants import DataConstants
 from models.model import (
     AnnotatedClinicalNote,
     AnnotatedSentence,
     Annotations,
+    SingleAnnotation,
 )
 from scripts.post_processing_of_tagged_sentences import (
     convert_human_readable_to_machine_readable_annotations,
 )
-from etls.DSETL import DSETL
-from typing import List
+from etls.DSETL import StreamingDSETL
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 from common.utils.log import ConfigureLogging
-from pydantic.json import pydantic_encoder
 from loguru import logger
 import os
 import tqdm
 
 class AnnotatedClinicalNotesToSnetences(
-    DSETL[AnnotatedClinicalNote, AnnotatedSentence]
+    StreamingDSETL[AnnotatedClinicalNote, AnnotatedSentence]
 ):
 
     # Default options for output directory
@@ -28,6 +28,8 @@ class AnnotatedClinicalNotesToSnetences(
         "out-dir": DataConstants.PROCESSED_SENTENCES_DIR,
         "inp-dir": DataConstants.DEID_PROCESSED_DIR
     }
+    # counters of the annotation alignment
+    ALIGNMENT_STATS = ("reanchored", "unaligned", "split")
 
     def __init__(self, cli_tokens=None, options=None):
         # Initialize with default options and create necessary directories
@@ -46,53 +48,42 @@ class AnnotatedClinicalNotesToSnetences(
         # Set algorithm for sentence extraction
         self.sentence_extractor = algo
 
-    async def extract(self) -> List[AnnotatedClinicalNote]:
-        # Step 1: Read ndjson file from input
-        cn = self._read_ndjson_file_and_return_clinicalnotes(self.inp_file_path)
+    async def extract(self) -> AsyncIterator[AnnotatedClinicalNote]:
+        # Step 1: Read the clinical notes of the ndjson file, one at a time
+        for note in self._read_ndjson_file_and_yield_clinicalnotes(self.inp_file_path):
+            yield note
         logger.success(f"Reading Done...  from file {self.inp_file_path}")
-        return cn
 
-    async def transform(self, data: List[AnnotatedClinicalNote]) -> List[AnnotatedSentence]:
-        # Step 2: Transform clinical notes to sentences
-        cs = self._transform_clinical_notes_to_sentences(data)
+    async def transform(self, data: AsyncIterator[AnnotatedClinicalNote]) -> AsyncIterator[AnnotatedSentence]:
+        # Step 2: Transform clinical notes to sentences, chunk by chunk (see transform_chunk)
+        maxlen = 0
+        async for sentence in super().transform(data):
+            maxlen = max(maxlen, len(sentence.text.split(" ")))
+            yield sentence
         logger.success(f"Clinical Notes to Sentences Transformation Done...  from file {self.inp_file_path}")
-        return cs
+        logger.info(f"Max length of sentence: {maxlen}")
+        logger.info(f"Annotation alignment: {self.stats}")
 
-    async def load(self, data: List[AnnotatedSentence]):
-        # Step 3: Load transformed sentences to output file
-        file_saved = self._write_clinical_sentences(data, self.out_file_name)
-        logger.success(f"Loaded {len(data)} to file {file_saved}")
+    async def load(self, data: AsyncIterator[AnnotatedSentence]):
+        # Step 3: Load sentences to output file as they are transformed
+        file_saved = f"{self.out_db.db}/{self.out_file_name}.ndjson"
+        count = await self._write_ndjson(data, file_saved)
+        logger.success(f"Loaded {count} to file {file_saved}")
         return
 
-    def _write_clinical_sentences(self, sentences: List[AnnotatedSentence], file_name: str, _type="ndjson") -> None:
-        # Write sentences to ndjson file
-        if _type != "ndjson":
-            raise ValueError("Only 'ndjson' type is supported")
-        with open(f"{self.out_db.db}/{file_name}.{_type}", "w") as f:
-            for sentence in tqdm.tqdm(sentences):
-                f.write(json.dumps(sentence, default=pydantic_encoder) + "\n")
-        return f"{self.out_db.db}/{file_name}.{_type}"
-
-    def _transform_clinical_notes_to_sentences(self, notes: List[AnnotatedClinicalNote]) -> List[AnnotatedSentence]:
-        # Transform clinical notes into sentences with annotations
+    def transform_chunk(self, notes: List[AnnotatedClinicalNote]) -> List[AnnotatedSentence]:
+        # Transform a chunk of clinical notes into sentences with annotations
         sentences = []
-        maxlen = 0
-        for note in tqdm.tqdm(notes):
-            sentences_ = self.sentence_extractor.extract_sentences(note.text)
-            id = 0
-            tags = note.annotations
-            for sentence in sentences_:
-                sent = sentence
-                presented_tags = []
-                for i in range(len(tags)):
-                    if tags[i].token in sent:
-                        presented_tags.append(tags[i])
-                        sent = sent.replace(tags[i].token, "{" * len(tags[i].token), 1)
-                    else:
-                        tags = tags[i:]
-                        break
+        for key in self.ALIGNMENT_STATS:
+            self.stats.setdefault(key, 0)
+        # the extractor gets the notes of the chunk at once, so batched extractors (spaCy) can pipe them
+        all_spans = self.sentence_extractor.extract_spans_many(note.text for note in notes)
+        for note, spans in zip(notes, all_spans):
+            tags_per_sentence = self._align_annotations(note, spans, self.stats)
+            for id, ((start, end), tags) in enumerate(zip(spans, tags_per_sentence)):
+                sentence = note.text[start:end]
                 annotations = convert_human_readable_to_machine_readable_annotations(
-                    sentence=sentence, tags=presented_tags
+                    sentence=sentence, tags=tags
                 )
                 sentences.append(
                     AnnotatedSentence(
@@ -110,21 +101,71 @@ class AnnotatedClinicalNotesToSnetences(
                         ),
                     )
                 )
-                id += 1
-                maxlen = max(maxlen, len(sentence.split(" ")))
-        logger.info(f"Max length of sentence: {maxlen}")
         return sentences
 
-    def _read_ndjson_file_and_return_clinicalnotes(self, file_path: str) -> List[AnnotatedClinicalNote]:
-        # Read ndjson file and return list of clinical notes
+    def _align_annotations(
+        self, note: AnnotatedClinicalNote, spans: List[Tuple[int, int]], stats: Dict[str, int]
+    ) -> List[List[SingleAnnotation]]:
+        # Note annotations assigned to the sentences by offset, with sentence relative offsets.
+        # The sentence holding a tag is found by bisecting the sorted sentence starts; a tag crossing
+        # sentences is split between them. Once a tag's offsets do not match its token (offsets of the
+        # raw text before whitespace normalization), the offsets of the note are not trusted anymore and
+        # every following tag is re-anchored on its next occurrence after the previous tag.
+        starts = [start for start, _ in spans]
+        tags_per_sentence = [[] for _ in spans]
+        cursor = 0
+        trusted = True
+        for tag in sorted(note.annotations, key=lambda x: x.start_index):
+            if not tag.token or not tag.token.strip():
+                continue
+            start = tag.start_index
+            trusted = trusted and note.text[start : start + len(tag.token)] == tag.token
+            if not trusted:
+                start = note.text.find(tag.token, cursor)
+                if start == -1:
+                    stats["unaligned"] += 1
+                    continue
+                stats["reanchored"] += 1
+            end = start + len(tag.token)
+            cursor = end
+            i = max(bisect.bisect_right(starts, start) - 1, 0)
+            pieces = 0
+            while i < len(spans) and spans[i][0] < end:
+                sentence_start, sentence_end = spans[i]
+                piece = self._clip(note.text, max(start, sentence_start), min(end, sentence_end))
+                if piece is not None:
+                    tags_per_sentence[i].append(
+                        SingleAnnotation(
+                            token=note.text[piece[0] : piece[1]],
+                            start_index=piece[0] - sentence_start,
+                            end_index=piece[1] - sentence_start,
+                            type=tag.type,
+                        )
+                    )
+                    pieces += 1
+                i += 1
+            if pieces == 0:
+                stats["unaligned"] += 1
+            elif pieces > 1:
+                stats["split"] += 1
+        return tags_per_sentence
+
+    @staticmethod
+    def _clip(text: str, start: int, end: int) -> Optional[Tuple[int, int]]:
+        # [start, end) without surrounding whitespace, None if nothing is left
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return (start, end) if start < end else None
+
+    def _read_ndjson_file_and_yield_clinicalnotes(self, file_path: str) -> Iterator[AnnotatedClinicalNote]:
+        # Read ndjson file and yield its clinical notes
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File {file_path} not found")
-        notes = []
         with open(file_path, "r") as f:
             for line in tqdm.tqdm(f, desc="Processing lines"):
-                note = AnnotatedClinicalNote.model_validate_json(line)
-                notes.append(note)
-        return notes
+                yield AnnotatedClinicalNote.model_validate_json(line)
 
 if __name__ == "__main__":
     # Run the ETL process
@@ -1,19 +1,17 @@
 import asyncio
 import sys
-import json
 from etl.utils.dfutils import LakeDB
 from utils.constants import DataConstants
 from models.model import ClinicalNote, Sentence
-from etls.DSETL import DSETL
-from typing import List
+from etls.DSETL import StreamingDSETL
+from typing import AsyncIterator, Iterator, List
 from common.utils.log import ConfigureLogging
-from pydantic.json import pydantic_encoder
 from loguru import logger
 import os
 import tqdm
 
 
-class UnannotatedClinicalNotesToSnetences(DSETL[ClinicalNote, Sentence]):
+class UnannotatedClinicalNotesToSnetences(StreamingDSETL[ClinicalNote, Sentence]):
     
     # Default options for output directory
     DEFAULT_OPTIONS = {
@@ -42,52 +40,23 @@ class UnannotatedClinicalNotesToSnetences(DSETL[ClinicalNote, Sentence]):
         # Set algorithm for sentence extraction
         self.sentence_extractor = algo
 
-    async def extract(self) -> List[ClinicalNote]:
-        # step1: Read ndjson file from inp_db
-        cn = self._read_ndjson_file_and_return_clinicalnotes(self.inp_file_path)
+    async def extract(self) -> AsyncIterator[ClinicalNote]:
+        # step1: Read the clinical notes of the ndjson file from inp_db, one at a time
+        for note in self._read_ndjson_file_and_yield_clinicalnotes(self.inp_file_path):
+            yield note
         logger.success(f"Reading Done...  from file {self.inp_file_path}")
 
-        # step2: for all clinical notes make a List[ClinicalNote]
-        return cn
-
-    async def transform(self, data: List[ClinicalNote]) -> List[Sentence]:
-        # Transform clinical notes to sentences
-        cs = self._transform_clinical_notes_to_sentences(data)
-        logger.success(
-            f"Clinical Notes to Sentences Tranformation Done...  from file {self.inp_file_path}"
-        )
-        return cs
-
-    async def load(self, data: List[Sentence]):
-        # dump in outfile.ndjson format
-        file_saved = self._write_clinical_sentences(data, self.out_file_name)
-        logger.success(f"Loaded {len(data)} to file {file_saved}")
-        return
-
-    def _write_clinical_sentences(
-        self, sentences: List[Sentence], file_name: str, _type="ndjson"
-    ) -> None:
-        # Write sentences to ndjson file
-        if _type != "ndjson":
-            raise ValueError("Only 'ndjson' type is supported")
-        with open(f"{self.out_db.db}/{file_name}.{_type}", "w") as f:
-            for sentence in tqdm.tqdm(sentences):
-                f.write(json.dumps(sentence, default=pydantic_encoder) + "\n")
-        return f"{self.out_db.db}/{file_name}.{_type}"
-
-    def _transform_clinical_notes_to_sentences(
-        self, notes: List[ClinicalNote]
-    ) -> List[Sentence]:
-        # Transform clinical notes into sentences with annotations
+    def transform_chunk(self, notes: List[ClinicalNote]) -> List[Sentence]:
+        # step2: Transform a chunk of clinical notes into sentences
         snetences = []
-
-        for note in tqdm.tqdm(notes):
-            sentences_ = self.sentence_extractor.extract_sentences(note.text)
+        # the extractor gets the notes of the chunk at once, so batched extractors (spaCy) can pipe them
+        all_spans = self.sentence_extractor.extract_spans_many(note.text for note in notes)
+        for note, spans in zip(notes, all_spans):
             id = 0
-            for sentence in sentences_:
+            for start, end in spans:
                 snetences.append(
                     Sentence(
-                        text=sentence,
+                        text=note.text[start:end],
                         sentence_id_in_note=id,
                         major_section="",
                         associated_note_id=note.note_id,
@@ -101,18 +70,22 @@ class UnannotatedClinicalNotesToSnetences(DSETL[ClinicalNote, Sentence]):
 
         return snetences
 
-    def _read_ndjson_file_and_return_clinicalnotes(
+    async def load(self, data: AsyncIterator[Sentence]):
+        # dump in outfile.ndjson format, as the sentences are transformed
+        file_saved = f"{self.out_db.db}/{self.out_file_name}.ndjson"
+        count = await self._write_ndjson(data, file_saved)
+        logger.success(f"Loaded {count} to file {file_saved}")
+        return
+
+    def _read_ndjson_file_and_yield_clinicalnotes(
         self, file_path: str
-    ) -> List[ClinicalNote]:
-        # Read ndjson file and return list of clinical notes
-        notes = []
+    ) -> Iterator[ClinicalNote]:
+        # Read ndjson file and yield its clinical notes
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File {file_path} not found")
         with open(file_path, "r") as f:
             for line in tqdm.tqdm(f, desc="Processing lines"):
-                note = ClinicalNote.model_validate_json(line)
-                notes.append(note)
-        return notes
+                yield ClinicalNote.model_validate_json(line)
 
 
 if __name__ == "__main__":
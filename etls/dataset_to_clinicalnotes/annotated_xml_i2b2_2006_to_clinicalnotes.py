@@ -1,19 +1,17 @@
 import asyncio
 import sys
-import json
 from etl.utils.dfutils import LakeDB
 from utils.constants import DataConstants
 from models.model import AnnotatedClinicalNote, SingleAnnotation
-from etls.DSETL import DSETL
-from typing import List
+from etls.DSETL import StreamingDSETL
+from typing import AsyncIterator, Iterator
 from common.utils.log import ConfigureLogging
 import xml.etree.ElementTree as ET
-from pydantic.json import pydantic_encoder
 from loguru import logger
 import os
 import tqdm
 
-class AnnotatedI2B2ToClinicalNotes(DSETL[AnnotatedClinicalNote, AnnotatedClinicalNote]):
+class AnnotatedI2B2ToClinicalNotes(StreamingDSETL[AnnotatedClinicalNote, AnnotatedClinicalNote]):
 
     # Default options for the output directory
     DEFAULT_OPTIONS = {
@@ -33,36 +31,27 @@ class AnnotatedI2B2ToClinicalNotes(DSETL[AnnotatedClinicalNote, AnnotatedClinica
         self.out_db = LakeDB(self.out_dir)
         os.makedirs(self.out_dir, exist_ok=True)
 
-    async def extract(self) -> List[AnnotatedClinicalNote]:
-        # Step 1: Read XML file and convert to clinical notes
-        cn = self._read_xml_file_and_return_clinicalnotes(self.inp_file_path)
+    async def extract(self) -> AsyncIterator[AnnotatedClinicalNote]:
+        # Step 1: Read XML file and convert to clinical notes, one record at a time
+        for note in tqdm.tqdm(self._read_xml_file_and_yield_clinicalnotes(self.inp_file_path), desc="Reading records"):
+            yield note
         logger.success(f"Reading Done... from file {self.inp_file_path}")
-        return cn
 
-    async def transform(self, data: List[AnnotatedClinicalNote]) -> List[AnnotatedClinicalNote]:
-        # Example transformation logic (currently no transformation)
-        return data
-
-    async def load(self, data: List[AnnotatedClinicalNote]):
+    async def load(self, data: AsyncIterator[AnnotatedClinicalNote]):
         # Step 3: Write clinical notes to an NDJSON file
-        file_saved = self._write_clinical_notes(data, self.out_file_name)
-        logger.success(f"Loaded {len(data)} to file {file_saved}")
-
-    def _write_clinical_notes(self, notes: List[AnnotatedClinicalNote], file_name: str, _type="ndjson") -> str:
-        # Write clinical notes to an NDJSON file
-        if _type != "ndjson":
-            raise ValueError("Only 'ndjson' type is supported")
-        with open(f"{self.out_db.db}/{file_name}.{_type}", "w") as f:
-            for note in tqdm.tqdm(notes):
-                f.write(json.dumps(note, default=pydantic_encoder) + "\n")
-        return f"{self.out_db.db}/{file_name}.{_type}"
+        file_saved = f"{self.out_db.db}/{self.out_file_name}.ndjson"
+        count = await self._write_ndjson(data, file_saved)
+        logger.success(f"Loaded {count} to file {file_saved}")
 
-    def _read_xml_file_and_return_clinicalnotes(self, file_path: str) -> List[AnnotatedClinicalNote]:
-        # Parse XML file and convert to a list of clinical notes with annotations
-        tree = ET.parse(file_path)
-        root = tree.getroot()
-        notes = []
-        for record in tqdm.tqdm(root.findall("RECORD")):
+    def _read_xml_file_and_yield_clinicalnotes(self, file_path: str) -> Iterator[AnnotatedClinicalNote]:
+        # Parse XML file incrementally and yield a clinical note with annotations per record,
+        # records are dropped once read
+        root = None
+        for event, record in ET.iterparse(file_path, events=("start", "end")):
+            if root is None:
+                root = record
+            if event != "end" or record.tag != "RECORD":
+                continue
             text = ""
             tags = []
             start_index = 0
@@ -83,18 +72,16 @@ class AnnotatedI2B2ToClinicalNotes(DSETL[AnnotatedClinicalNote, AnnotatedClinica
                 else:
                     text += elem.text if elem.text else ""
             text = text.replace("\n", " ")
-            notes.append(
-                AnnotatedClinicalNote(
-                    text=text,
-                    note_type=str(type(text)),
-                    date="",
-                    patient_id="",
-                    note_id=str(record.attrib["ID"]),
-                    metadata={},
-                    annotations=tags,
-                )
+            yield AnnotatedClinicalNote(
+                text=text,
+                note_type=str(type(text)),
+                date="",
+                patient_id="",
+                note_id=str(record.attrib["ID"]),
+                metadata={},
+                annotations=tags,
             )
-        return notes
+            root.clear()
 
 if __name__ == "__main__":
     # Run the ETL process
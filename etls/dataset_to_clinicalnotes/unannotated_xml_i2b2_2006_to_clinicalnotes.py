@@ -1,20 +1,18 @@
 import asyncio
 import sys
-import json
 from etl.utils.dfutils import LakeDB
 from utils.constants import DataConstants
 from models.model import ClinicalNote
-from etls.DSETL import DSETL
-from typing import List
+from etls.DSETL import StreamingDSETL
+from typing import AsyncIterator, Iterator
 from common.utils.log import ConfigureLogging
 import xml.etree.ElementTree as ET
-from pydantic.json import pydantic_encoder
 from loguru import logger
 import os
 import tqdm
 
 
-class UnannotatedI2B2ToClinicalNotes(DSETL[ClinicalNote, ClinicalNote]):
+class UnannotatedI2B2ToClinicalNotes(StreamingDSETL[ClinicalNote, ClinicalNote]):
 
     # Default options for the output directory
     DEFAULT_OPTIONS = {
@@ -38,55 +36,40 @@ class UnannotatedI2B2ToClinicalNotes(DSETL[ClinicalNote, ClinicalNote]):
         self.out_db = LakeDB(self.out_dir)
         os.makedirs(self.out_dir, exist_ok=True)
 
-    async def extract(self) -> List[ClinicalNote]:
-        # step1: Read xml file from inp_db
-        cn = self._read_xml_file_and_return_clinicalnotes(self.inp_file_path)
+    async def extract(self) -> AsyncIterator[ClinicalNote]:
+        # step1: Read xml file from inp_db, one record at a time
+        for note in tqdm.tqdm(self._read_xml_file_and_yield_clinicalnotes(self.inp_file_path), desc="Reading records"):
+            yield note
         logger.success(f"Reading Done...  from file {self.inp_file_path}")
 
-        # step2: for all clinical notes make a List[ClinicalNote]
-        return cn
-
-    async def transform(self, data: List[ClinicalNote]) -> List[ClinicalNote]:
-        # Example transformation logic
-        return data
-
-    async def load(self, data: List[ClinicalNote]):
+    async def load(self, data: AsyncIterator[ClinicalNote]):
         # dump in outfile.ndjson format
-        file_saved = self._write_clinical_notes(data, self.out_file_name)
-        logger.success(f"Loaded {len(data)} to file {file_saved}")
+        file_saved = f"{self.out_db.db}/{self.out_file_name}.ndjson"
+        count = await self._write_ndjson(data, file_saved)
+        logger.success(f"Loaded {count} to file {file_saved}")
         return
 
-    def _write_clinical_notes(
-        self, notes: List[ClinicalNote], file_name: str, _type="ndjson"
-    ) -> None:
-        # Write clinical notes to an NDJSON file
-        if _type != "ndjson":
-            raise ValueError("Only 'ndjson' type is supported")
-        with open(f"{self.out_db.db}/{file_name}.{_type}", "w") as f:
-            for note in tqdm.tqdm(notes):
-                f.write(json.dumps(note, default=pydantic_encoder) + "\n")
-        return f"{self.out_db.db}/{file_name}.{_type}"
-
-    def _read_xml_file_and_return_clinicalnotes(
+    def _read_xml_file_and_yield_clinicalnotes(
         self, file_path: str
-    ) -> List[ClinicalNote]:
-        # Parse XML file and convert to a list of clinical notes
-        notes = []
-        root = ET.parse(f"{file_path}").getroot()
-        for record in tqdm.tqdm(root.findall("RECORD")):
+    ) -> Iterator[ClinicalNote]:
+        # Parse XML file incrementally and yield a clinical note per record, records are dropped once read
+        root = None
+        for event, record in ET.iterparse(file_path, events=("start", "end")):
+            if root is None:
+                root = record
+            if event != "end" or record.tag != "RECORD":
+                continue
             note = record.find("TEXT").text
             note = note.replace("\n", " ")
-            notes.append(
-                ClinicalNote(
-                    text=note,
-                    note_type=str(type(note)),
-                    date="",
-                    patient_id="",
-                    note_id=str(record.attrib["ID"]),
-                    metadata={},
-                )
+            yield ClinicalNote(
+                text=note,
+                note_type=str(type(note)),
+                date="",
+                patient_id="",
+                note_id=str(record.attrib["ID"]),
+                metadata={},
             )
-        return notes
+            root.clear()
 
 
 if __name__ == "__main__":
@@ -1,20 +1,17 @@
 import asyncio
 import sys
-import json
 from etl.utils.dfutils import LakeDB
 from utils.constants import DataConstants
 from models.model import AnnotatedClinicalNote, SingleAnnotation
-from etls.DSETL import DSETL
-from typing import List
+from etls.DSETL import StreamingDSETL
+from typing import AsyncIterator
 from common.utils.log import ConfigureLogging
 import xml.etree.ElementTree as ET
-from pydantic.json import pydantic_encoder
 from loguru import logger
 import os
-import tqdm
 
 
-class I2B22014ToClinicalNotes(DSETL[AnnotatedClinicalNote, AnnotatedClinicalNote]):
+class I2B22014ToClinicalNotes(StreamingDSETL[AnnotatedClinicalNote, AnnotatedClinicalNote]):
 
     # Default options for the output directory
     DEFAULT_OPTIONS = {
@@ -39,42 +36,22 @@ class I2B22014ToClinicalNotes(DSETL[AnnotatedClinicalNote, AnnotatedClinicalNote
         self.out_db = LakeDB(self.out_dir)
         os.makedirs(self.out_dir, exist_ok=True)
 
-    async def extract(self) -> List[AnnotatedClinicalNote]:
-        # step1: Read xml file from inp_db
-        cn = self._read_xml_file_and_return_clinicalnotes(self.inp_file_path)
+    async def extract(self) -> AsyncIterator[AnnotatedClinicalNote]:
+        # step1: Read xml file from inp_db, a file holds a single note
+        yield self._read_xml_file_and_return_clinicalnote(self.inp_file_path)
         logger.success(f"Reading Done... from file {self.inp_file_path}")
-        return cn
 
-    async def transform(
-        self, data: List[AnnotatedClinicalNote]
-    ) -> List[AnnotatedClinicalNote]:
-        # Example transformation logic
-        return data
-
-    async def load(self, data: List[AnnotatedClinicalNote]):
+    async def load(self, data: AsyncIterator[AnnotatedClinicalNote]):
         # dump in outfile.ndjson format
-        file_saved = self._write_clinical_notes(
-            data, file_name=self.out_file_name
-        )
-        logger.success(f"Loaded {len(data)} to file {file_saved}")
+        file_saved = f"{self.out_db.db}/{self.out_file_name}.ndjson"
+        count = await self._write_ndjson(data, file_saved)
+        logger.success(f"Loaded {count} to file {file_saved}")
         return
 
-    def _write_clinical_notes(
-        self, notes: List[AnnotatedClinicalNote], file_name: str, _type="ndjson"
-    ) -> None:
-        # Write clinical notes to an NDJSON file
-        if _type != "ndjson":
-            raise ValueError("Only 'ndjson' type is supported")
-        with open(f"{self.out_db.db}/{file_name}.{_type}", "w") as f:
-            for note in tqdm.tqdm(notes):
-                f.write(json.dumps(note, default=pydantic_encoder) + "\n")
-        return f"{self.out_db.db}/{file_name}.{_type}"
-
-    def _read_xml_file_and_return_clinicalnotes(
+    def _read_xml_file_and_return_clinicalnote(
         self, file_path: str
     ) -> AnnotatedClinicalNote:
-        # Parse XML file and convert to a list of clinical notes
-        notes = []
+        # Parse XML file and convert to a clinical note
         tree = ET.parse(file_path)
         root = tree.getroot()
         note = root.find("TEXT").text.strip()
@@ -96,18 +73,15 @@ class I2B22014ToClinicalNotes(DSETL[AnnotatedClinicalNote, AnnotatedClinicalNote
                             type=child.tag,
                         )
                     )     
-        notes.append(
-                AnnotatedClinicalNote(
-                text=note,
-                note_type=str(type(note)),
-                date="",
-                patient_id="",
-                note_id="",
-                metadata={},
-                annotations=annotations,
-            )
+        return AnnotatedClinicalNote(
+            text=note,
+            note_type=str(type(note)),
+            date="",
+            patient_id="",
+            note_id="",
+            metadata={},
+            annotations=annotations,
         )
-        return notes
 
 
 if __name__ == "__main__":
@@ -0,0 +1,694 @@
+from abc import abstractmethod
+import asyncio
+from functools import partial
+import hashlib
+import json
+import os
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Tuple, Type
+from pydantic import BaseModel
+from loguru import logger
+import tqdm
+from common.utils.base import AsyncUtils
+from algos.sentence_tagging.batch import (
+    TERMINAL_STATUSES,
+    BatchBackend,
+    build_batch_request,
+    parse_batch_result,
+)
+from algos.sentence_tagging.prefilter import PHIPrefilter
+from etl.ETL import ETLUtils
+from etl.utils.checkpoint import NdjsonCheckpoint
+from etl.utils.sampler import Sampler
+from etl.utils.dfutils import LakeDB
+from etls.DSETL import StreamingDSETL, T_EXTRACTED, T_TRANSFORMED
+from models.model import SingleAnnotation, Sentence
+from scripts.post_processing_of_tagged_sentences import (
+    convert_human_readable_to_machine_readable_annotations,
+)
+from utils.constants import DataConstants
+
+
+class TaggingDSETL(StreamingDSETL[T_EXTRACTED, T_TRANSFORMED]):
+    """
+    Shared plumbing of the sentences_to_annotations ETLs.
+
+    Sentences are tagged concurrently (at most `max-concurrency` requests in flight)
+    and the tagged sentences are written in the order of the input file.
+    Without dedup, windows & batch job the sentences stream through the ETL, `chunk-size` sentences at a time;
+    those three modes look at the whole input (held in memory) before tagging.
+    With `batch-size` > 1, consecutive sentences are packed into one request when the ETL has a batch prompt.
+    Tagged sentences are appended to the output file as they come (flushed every `flush-every` records);
+    with `resume` on, sentences already present in the output file of an interrupted run are not tagged again
+    (the output of a completed run is started over).
+    With `dedup` on, sentences sharing the same (whitespace normalized) text are tagged once
+    and the response is fanned back out to every occurrence.
+    With `prefilter` on, sentences the PHIPrefilter rules out get all NO_TYPE annotations without a request.
+    With `window-chars` > 0, consecutive sentences of a note are sent together in windows of at most that many
+    characters (repeating the last `window-overlap` sentences of the previous window), the entities found
+    in a window are projected back on each of its sentences. Windows are cut from the whole input file, before
+    sampling, resume & prefilter drop any sentence, and only from runs of consecutive `sentence_id_in_note`.
+    With `batch-job` on, the requests are run as one offline batch job (prepare -> submit -> poll -> ingest),
+    the state of the job is kept in `batch-job-dir` so an interrupted run picks up where it stopped.
+    With `sample-count` or `sample-fraction`, only a deterministic sample (`sample-seed`) of the input is tagged,
+    optionally stratified by note or by the ground truth PHI types (`sample-stratify`).
+    Subclasses choose the prompt, the response structure and how a tagged sentence is built.
+    """
+
+    # Default options for the input & output directories
+    DEFAULT_OPTIONS = {
+        "out-dir": DataConstants.TAGGED_SENTENCES_MACHINE_DIR,
+        "inp-dir": DataConstants.PROCESSED_SENTENCES_DIR,
+        "max-concurrency": 8,
+        "batch-size": 1,
+        "flush-every": 100,
+        "resume": True,
+        "dedup": True,
+        "prefilter": False,
+        "window-chars": 0,
+        "window-overlap": 0,
+        "batch-job": False,
+        "batch-job-dir": DataConstants.BATCH_JOBS_DIR,
+        "batch-job-poll-seconds": 60,
+        "sample-count": None,
+        "sample-fraction": None,
+        "sample-stratify": None,
+        "sample-seed": 0,
+    }
+
+    # prompt & response structure given to the tagging algorithm
+    PROMPT: str = None
+    OUTPUT_CLS: Type[BaseModel] = None
+    # optional multi-sentence prompt, its response holds a list of indexed OUTPUT_CLS under `sentences`
+    BATCH_PROMPT: str = None
+    BATCH_OUTPUT_CLS: Type[BaseModel] = None
+    # dedup key of the sentences ruled out by the prefilter
+    NO_PHI_KEY = ("NO_PHI",)
+    # sentences of a window are joined with
+    WINDOW_SEPARATOR = "\n"
+
+    def __init__(self, cli_tokens=None, options=None):
+        # Initialize with default options and create necessary directories
+        super().__init__(cli_tokens, options, self.DEFAULT_OPTIONS)
+        self.root = self.options["root"]
+        self.inp_dir = self.options["inp-dir"].format(root_dir=self.root)
+        self.inp_file_name = self.options["inp-file"]
+        self.inp_file_path = self.inp_dir + "/" + self.inp_file_name
+        self.out_dir = self.options["out-dir"].format(root_dir=self.root)
+        self.out_file_name = self.options["out-file"].split(".")[0]
+        self.out_db = LakeDB(self.out_dir)
+        self.max_concurrency = int(self.options["max-concurrency"])
+        self.batch_size = int(self.options["batch-size"])
+        if self.batch_size > 1 and self.BATCH_PROMPT is None:
+            logger.warning(
+                f"{self.__class__.__name__} has no batch prompt, tagging one sentence per request"
+            )
+            self.batch_size = 1
+        self.window_chars = int(self.options["window-chars"])
+        self.window_overlap = int(self.options["window-overlap"])
+        self.resume = ETLUtils.as_bool(self.options["resume"])
+        self.dedup = ETLUtils.as_bool(self.options["dedup"])
+        if self.window_chars > 0:
+            # a sentence is tagged in the context of its note, the same text may get different entities
+            if self.batch_size > 1:
+                logger.warning("window-chars is set, batch-size is ignored")
+            self.batch_size = 1
+            self.dedup = False
+        self.batch_job = ETLUtils.as_bool(self.options["batch-job"])
+        self.batch_job_dir = self.options["batch-job-dir"].format(root_dir=self.root)
+        self.batch_job_poll_seconds = float(self.options["batch-job-poll-seconds"])
+        if self.batch_job:
+            # a batch job holds one request per (unique) sentence
+            if self.batch_size > 1 or self.window_chars > 0:
+                logger.warning("batch-job is on, batch-size & window-chars are ignored")
+            self.batch_size = 1
+            self.window_chars = 0
+            os.makedirs(self.batch_job_dir, exist_ok=True)
+        self.batch_backend = None
+        self.sampler = self._build_sampler()
+        self.prefilter = (
+            PHIPrefilter() if ETLUtils.as_bool(self.options["prefilter"]) else None
+        )
+        # dedup, windows & batch jobs need the whole input, anything else is tagged chunk by chunk
+        self.streaming = not (self.dedup or self.window_chars > 0 or self.batch_job)
+        if self.workers > 1:
+            # the requests share the rate limiter & cache of the tagger, they are made from this process
+            logger.warning("workers is ignored by the tagging ETLs, use max-concurrency")
+            self.workers = 1
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.checkpoint = NdjsonCheckpoint(
+            f"{self.out_db.db}/{self.out_file_name}.ndjson",
+            key_fn=lambda record: (
+                record["associated_note_id"],
+                record["sentence_id_in_note"],
+            ),
+            flush_every=self.options["flush-every"],
+        )
+        self.sentence_tgging = None
+
+    def set_algo(self, algo):
+        # Set algorithm for sentence tagging
+        self.sentence_tgging = algo
+
+    def set_batch_backend(self, backend: BatchBackend):
+        # Set the endpoint running the batch jobs (batch-job mode)
+        self.batch_backend = backend
+
+    def _build_sampler(self) -> Sampler:
+        count, fraction = self.options["sample-count"], self.options["sample-fraction"]
+        if count is None and fraction is None:
+            return None
+        stratify = self.options["sample-stratify"]
+        stratum_fns = {
+            None: None,
+            "none": None,
+            "note": lambda sentence: sentence.associated_note_id,
+            "phi": self._phi_stratum,
+        }
+        if stratify not in stratum_fns:
+            raise ValueError(f"sample-stratify must be one of note, phi, got {stratify}")
+        return Sampler(
+            key_fn=lambda sentence: (sentence.associated_note_id, sentence.sentence_id_in_note),
+            count=int(count) if count is not None else None,
+            fraction=float(fraction) if fraction is not None else None,
+            stratum_fn=stratum_fns[stratify],
+            seed=int(self.options["sample-seed"]),
+        )
+
+    @staticmethod
+    def _phi_stratum(sentence: Sentence) -> tuple:
+        # the ground truth PHI types present in the sentence, () for none (or no ground truth)
+        annotations = getattr(sentence, "annotations", None)
+        if annotations is None:
+            return ()
+        return tuple(
+            sorted(
+                {
+                    annotation.type[2:]
+                    for annotation in annotations.annotations
+                    if annotation.type != "NO_TYPE"
+                }
+            )
+        )
+
+    def _sample_sentences(self, read_sentences: Callable[[], Iterable[Sentence]]) -> Iterable[Sentence]:
+        # consumes the sentences as a stream (read_sentences returns a fresh one), only the sampled ones are kept
+        if self.sampler is None:
+            return read_sentences()
+        sampled = self.sampler.sample(read_sentences)
+        self.stats.update(self.sampler.stats())
+        logger.info(f"Sampled {self.sampler.selected} out of {self.sampler.seen} sentences")
+        return sampled
+
+    @abstractmethod
+    def _get_human_readable_annotations(
+        self, sentence: str, response_obj: BaseModel
+    ) -> List[SingleAnnotation]:
+        # map the structured response of the model to spans of the sentence
+        pass
+
+    @abstractmethod
+    def _read_ndjson_file_and_yield_sentences(self, file_path: str) -> Iterator[T_EXTRACTED]:
+        # every sentence of the input file, in order (the windows are cut from them)
+        pass
+
+    @abstractmethod
+    def _build_tagged_sentence(
+        self, sentence: Sentence, annotations: List[SingleAnnotation]
+    ) -> T_TRANSFORMED:
+        # wrap the machine readable annotations into the output record
+        pass
+
+    async def _append_tagged_sentences(self, tagged_sentences: AsyncIterator[T_TRANSFORMED]) -> int:
+        # append the tagged sentences to the output file as they come, returns how many were appended
+        count = 0
+        try:
+            async for tagged_sentence in tagged_sentences:
+                self.checkpoint.append(tagged_sentence)
+                count += 1
+        except BaseException:
+            # keep whatever was tagged, the next run resumes from it
+            self.checkpoint.close(complete=False)
+            raise
+        return count
+
+    def _complete_tagged_sentences(self) -> str:
+        # tagged sentences are appended while tagging, mark the output file as complete
+        return self.checkpoint.close(complete=True)
+
+    def _count_sentences(self, sentences: int, unique_sentences: int) -> None:
+        # summed over the chunks when streaming
+        self.stats["sentences"] = self.stats.get("sentences", 0) + sentences
+        self.stats["unique_sentences"] = self.stats.get("unique_sentences", 0) + unique_sentences
+        total = self.stats["sentences"]
+        self.stats["dedup_ratio"] = (
+            round(1 - self.stats["unique_sentences"] / total, 4) if total else 0.0
+        )
+
+    def _log_summary(self) -> None:
+        # counters of the tagging run (cache hits, ...)
+        summary = dict(self.stats)
+        if self.prefilter is not None:
+            summary.update(self.prefilter.stats())
+        if hasattr(self.sentence_tgging, "summary"):
+            summary.update(self.sentence_tgging.summary())
+        logger.info(f"Tagging summary for {self.inp_file_name}: {summary}")
+
+    async def _tag_batch_of_sentences(self, sentences: List[Sentence]) -> List[BaseModel]:
+        # one request for all the sentences, responses are mapped back by their index
+        batch = await self.sentence_tgging.atagging_sentences(
+            [sentence.text for sentence in sentences],
+            self.BATCH_PROMPT,
+            self.BATCH_OUTPUT_CLS,
+        )
+        by_index = {}
+        for userinfo in batch.sentences:
+            by_index.setdefault(userinfo.index, userinfo)
+
+        userinfos = []
+        for i, sentence in enumerate(sentences):
+            if i in by_index:
+                userinfos.append(by_index[i])
+            else:
+                # the model skipped this sentence, ask for it alone
+                logger.warning(
+                    f"No response for sentence {i} of the batch, tagging it separately"
+                )
+                userinfos.append(
+                    await self.sentence_tgging.atagging_sentence(
+                        sentence.text, self.PROMPT, self.OUTPUT_CLS
+                    )
+                )
+        return userinfos
+
+    async def _tag_sentences(self, sentences: List[Sentence]) -> List[BaseModel]:
+        # Tagging sentences with model, one response per sentence
+        if len(sentences) == 1:
+            return [
+                await self.sentence_tgging.atagging_sentence(
+                    sentences[0].text, self.PROMPT, self.OUTPUT_CLS
+                )
+            ]
+        return await self._tag_batch_of_sentences(sentences)
+
+    async def _tag_window(self, window: List[Sentence], sentences: List[Sentence]) -> List[BaseModel]:
+        # one request for consecutive sentences of a note, the response is projected on each sentence to tag
+        # the other sentences of the window (sampled, resumed or prefiltered out) are only context
+        response = await self.sentence_tgging.atagging_sentence(
+            self.WINDOW_SEPARATOR.join(sentence.text for sentence in window),
+            self.PROMPT,
+            self.OUTPUT_CLS,
+        )
+        return [self._project_response(response, sentence.text) for sentence in sentences]
+
+    @staticmethod
+    def _project_response(response: BaseModel, text: str) -> BaseModel:
+        # keep the entities found in the text of one sentence
+        fields = {}
+        for name, value in response:
+            if isinstance(value, list):
+                value = [entity for entity in value if entity and entity in text]
+            fields[name] = value
+        return response.__class__(**fields)
+
+    @staticmethod
+    def _merge_responses(first: BaseModel, second: BaseModel) -> BaseModel:
+        # union of the entities of two responses for the same sentence (overlapping windows)
+        fields = {}
+        for name, value in first:
+            other = getattr(second, name)
+            if isinstance(value, list):
+                value = value + [entity for entity in other if entity not in value]
+            fields[name] = value
+        return first.__class__(**fields)
+
+    def _build_windows(self, sentences: List[Sentence]) -> List[Tuple[List[Sentence], List[int]]]:
+        # (window, indices in `sentences` of the sentences it tags), windows without any sentence to tag are left out
+        # the input file is read again: a window holds the sentences next to each other in the note,
+        # whether or not they are tagged themselves
+        positions = {
+            (sentence.associated_note_id, sentence.sentence_id_in_note): i
+            for i, sentence in enumerate(sentences)
+        }
+        windows = []
+        for run in self._consecutive_runs(self._read_ndjson_file_and_yield_sentences(self.inp_file_path)):
+            for window in self._pack_windows(run):
+                batch = [
+                    positions[key]
+                    for key in (
+                        (sentence.associated_note_id, sentence.sentence_id_in_note)
+                        for sentence in window
+                    )
+                    if key in positions
+                ]
+                if batch:
+                    windows.append((window, batch))
+        return windows
+
+    @staticmethod
+    def _consecutive_runs(sentences: Iterable[Sentence]) -> Iterator[List[Sentence]]:
+        # sentences of the same note whose sentence_id_in_note follow each other
+        run = []
+        for sentence in sentences:
+            if run and (
+                sentence.associated_note_id != run[-1].associated_note_id
+                or sentence.sentence_id_in_note != run[-1].sentence_id_in_note + 1
+            ):
+                yield run
+                run = []
+            run.append(sentence)
+        if run:
+            yield run
+
+    def _pack_windows(self, run: List[Sentence]) -> List[List[Sentence]]:
+        # at most window-chars characters per window
+        windows = []
+        start = 0
+        while start < len(run):
+            end = start + 1
+            size = len(run[start].text)
+            while (
+                end < len(run)
+                and size + len(self.WINDOW_SEPARATOR) + len(run[end].text) <= self.window_chars
+            ):
+                size += len(self.WINDOW_SEPARATOR) + len(run[end].text)
+                end += 1
+            windows.append(run[start:end])
+            if end == len(run):
+                break
+            # the next window repeats the last sentences of this one, always moving forward
+            start = max(start + 1, end - self.window_overlap)
+        return windows
+
+    def _batch_job_path(self, suffix: str) -> str:
+        return f"{self.batch_job_dir}/{self.out_file_name}.{suffix}"
+
+    def _batch_custom_id(self, sentence: Sentence) -> str:
+        # stable across runs: the text when deduplicating, the sentence otherwise
+        if self.dedup:
+            return hashlib.sha1(self._dedup_key(sentence.text).encode("utf-8")).hexdigest()
+        return f"{sentence.associated_note_id}-{sentence.sentence_id_in_note}"
+
+    def _load_batch_state(self) -> dict:
+        path = self._batch_job_path("batchjob.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _save_batch_state(self, state: dict) -> None:
+        # write & rename, so the state is never half written
+        path = self._batch_job_path("batchjob.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(f"{path}.tmp", path)
+
+    def _clear_batch_state(self) -> None:
+        path = self._batch_job_path("batchjob.json")
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _write_batch_requests(self, sentences: List[Sentence]) -> str:
+        path = self._batch_job_path("requests.jsonl")
+        with open(f"{path}.tmp", "w") as f:
+            for sentence in sentences:
+                request = build_batch_request(
+                    self._batch_custom_id(sentence),
+                    self.sentence_tgging.model,
+                    self.PROMPT,
+                    self.OUTPUT_CLS,
+                    sentence=sentence.text,
+                )
+                f.write(json.dumps(request) + "\n")
+        os.replace(f"{path}.tmp", path)
+        return path
+
+    async def _run_batch_job(self, sentences: List[Sentence]) -> Dict[str, BaseModel]:
+        # prepare -> submit -> poll -> download, every phase is recorded so an interrupted run resumes after it
+        # returns the responses by custom id
+        if self.batch_backend is None:
+            raise ValueError("batch-job is on but no batch backend is set")
+        state = self._load_batch_state() if self.resume else {}
+        if state.get("phase") == "done":
+            # the previous job was fully ingested, a new one covers the sentences left
+            state = {}
+
+        if not state:
+            requests_path = self._write_batch_requests(sentences)
+            state = {"phase": "prepared", "requests_file": requests_path, "requests": len(sentences)}
+            self._save_batch_state(state)
+            logger.info(f"Batch job: {len(sentences)} requests written to {requests_path}")
+
+        if state["phase"] == "prepared":
+            state["batch_id"] = await asyncio.to_thread(
+                self.batch_backend.submit, state["requests_file"]
+            )
+            state["phase"] = "submitted"
+            self._save_batch_state(state)
+            logger.info(f"Batch job: submitted as {state['batch_id']}")
+
+        if state["phase"] == "submitted":
+            while True:
+                status = await asyncio.to_thread(self.batch_backend.status, state["batch_id"])
+                logger.info(
+                    f"Batch job {state['batch_id']}: {status['status']} {status['request_counts']}"
+                )
+                if status["status"] in TERMINAL_STATUSES:
+                    break
+                await asyncio.sleep(self.batch_job_poll_seconds)
+            # an expired or cancelled job still has the results of the requests it completed,
+            # a job whose requests all failed has none: its sentences are all tagged online
+            if status["output_file_id"] is not None:
+                state["results_file"] = self._batch_job_path("results.jsonl")
+                await asyncio.to_thread(
+                    self.batch_backend.download, status["output_file_id"], state["results_file"]
+                )
+            if status["error_file_id"] is not None:
+                state["errors_file"] = self._batch_job_path("errors.jsonl")
+                await asyncio.to_thread(
+                    self.batch_backend.download, status["error_file_id"], state["errors_file"]
+                )
+            state["status"] = status["status"]
+            state["phase"] = "downloaded"
+            self._save_batch_state(state)
+
+        results = {}
+        if state.get("results_file"):
+            with open(state["results_file"], "r") as f:
+                for line in f:
+                    custom_id, response = parse_batch_result(line, self.OUTPUT_CLS)
+                    if response is not None:
+                        results[custom_id] = response
+        if state.get("errors_file"):
+            self._log_batch_errors(state["errors_file"])
+        if not results:
+            # nothing to ingest from the dead job, the next run must not pick it up again
+            logger.warning(
+                f"Batch job {state['batch_id']} ended as {state['status']} without results,"
+                f" tagging its {state['requests']} sentences online"
+            )
+            self._clear_batch_state()
+        self.stats["batch_job_results"] = len(results)
+        self.stats["batch_job_fallbacks"] = 0
+        return results
+
+    def _log_batch_errors(self, errors_file: str) -> None:
+        # failed requests of the batch job, the first error message tells why
+        failed = 0
+        message = None
+        with open(errors_file, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                failed += 1
+                if message is None:
+                    error = result.get("error") or (result.get("response") or {}).get("body", {}).get("error") or {}
+                    message = error.get("message")
+        self.stats["batch_job_errors"] = failed
+        if failed:
+            logger.warning(f"Batch job: {failed} requests failed ({message}), tagged online")
+
+    async def _tag_from_batch_job(
+        self, results: Dict[str, BaseModel], sentences: List[Sentence]
+    ) -> List[BaseModel]:
+        # responses of the batch job, sentences it failed (or did not cover) are tagged online
+        userinfos = []
+        for sentence in sentences:
+            response = results.get(self._batch_custom_id(sentence))
+            if response is None:
+                self.stats["batch_job_fallbacks"] += 1
+                response = (await self._tag_sentences([sentence]))[0]
+            userinfos.append(response)
+        return userinfos
+
+    def _to_tagged_sentence(self, sentence: Sentence, userinfo: BaseModel) -> T_TRANSFORMED:
+        # converting the response of the model to machine readable annotations
+        # userinfo is None for sentences the prefilter ruled out, every token is NO_TYPE
+        annotations = []
+        if userinfo is not None:
+            annotations = self._get_human_readable_annotations(
+                sentence=sentence.text, response_obj=userinfo
+            )
+        annotations = convert_human_readable_to_machine_readable_annotations(
+            sentence=sentence.text, tags=annotations
+        )
+        return self._build_tagged_sentence(sentence, annotations)
+
+    @staticmethod
+    def _dedup_key(text: str) -> str:
+        # boilerplate differs mostly by spacing, the response is mapped back on each occurrence's own text
+        return " ".join(text.split())
+
+    async def transform(self, data: AsyncIterator[T_EXTRACTED]) -> AsyncIterator[T_TRANSFORMED]:
+        done_keys = self.checkpoint.done_keys() if self.resume else set()
+        if done_keys:
+            data = self._skip_done_sentences(data, done_keys)
+            logger.info(
+                f"Resuming: {len(done_keys)} sentences already in {self.checkpoint.file_path}"
+            )
+        self.checkpoint.open(resume=self.resume)
+
+        if self.streaming:
+            logger.info(
+                f"Tagging {self.chunk_size} sentences at a time"
+                f" with max-concurrency {self.max_concurrency} and batch-size {self.batch_size}"
+            )
+            async for tagged_sentence in super().transform(data):
+                yield tagged_sentence
+        else:
+            sentences = [sentence async for sentence in data]
+            async for tagged_sentence in self._transform_sentences_to_tagged_sentences(sentences):
+                yield tagged_sentence
+        self._log_summary()
+        logger.success(f"Sentences Tagging Done...  from file {self.inp_file_path}")
+
+        # release the pooled connections of the tagger
+        if hasattr(self.sentence_tgging, "aclose"):
+            await self.sentence_tgging.aclose()
+
+    @staticmethod
+    async def _skip_done_sentences(
+        sentences: AsyncIterator[T_EXTRACTED], done_keys: set
+    ) -> AsyncIterator[T_EXTRACTED]:
+        async for sentence in sentences:
+            if (sentence.associated_note_id, sentence.sentence_id_in_note) not in done_keys:
+                yield sentence
+
+    async def transform_chunk(self, chunk: List[T_EXTRACTED]) -> List[T_TRANSFORMED]:
+        # streaming mode: the sentences of the chunk are tagged batch-size at a time, in order
+        # sentences the prefilter rules out get all NO_TYPE annotations without a request
+        to_tag = [
+            i
+            for i, sentence in enumerate(chunk)
+            if self.prefilter is None or self.prefilter.needs_model(sentence.text)
+        ]
+        self._count_sentences(len(chunk), len(to_tag))
+        batches = [
+            to_tag[i : i + self.batch_size] for i in range(0, len(to_tag), self.batch_size)
+        ]
+
+        async def tag_batch(batch: List[int]):
+            return batch, await self._tag_sentences([chunk[i] for i in batch])
+
+        userinfos = [None] * len(chunk)
+        async for batch, batch_userinfos in AsyncUtils.bounded_ordered_map(
+            tag_batch, batches, self.max_concurrency
+        ):
+            for i, userinfo in zip(batch, batch_userinfos):
+                userinfos[i] = userinfo
+        return [
+            self._to_tagged_sentence(sentence, userinfo)
+            for sentence, userinfo in zip(chunk, userinfos)
+        ]
+
+    async def _transform_sentences_to_tagged_sentences(
+        self, sentences: List[Sentence]
+    ) -> AsyncIterator[T_TRANSFORMED]:
+        # dedup, windows & batch job: the whole input is grouped before tagging,
+        # the tagged sentences are yielded in input order as soon as their response is known
+
+        # group the sentences by text, only the first occurrence of each text is sent to the model
+        # sentences without any PHI candidate share the NO_PHI key, answered without a request
+        keys = []
+        for i, sentence in enumerate(sentences):
+            if self.prefilter is not None and not self.prefilter.needs_model(sentence.text):
+                keys.append(self.NO_PHI_KEY)
+            else:
+                keys.append(self._dedup_key(sentence.text) if self.dedup else i)
+        representatives = {}
+        last_occurrence = {}
+        for i, (key, sentence) in enumerate(zip(keys, sentences)):
+            if key != self.NO_PHI_KEY:
+                representatives.setdefault(key, sentence)
+            last_occurrence[key] = i
+        unique_keys = list(representatives.keys())
+        unique_sentences = list(representatives.values())
+        self._count_sentences(len(sentences), len(unique_sentences))
+
+        logger.info(
+            f"Tagging {len(unique_sentences)} unique out of {len(sentences)} sentences"
+            f" with max-concurrency {self.max_concurrency} and batch-size {self.batch_size}"
+        )
+        windows = None
+        if self.batch_job and unique_sentences:
+            batches = [range(i, i + 1) for i in range(len(unique_sentences))]
+            tag = partial(self._tag_from_batch_job, await self._run_batch_job(unique_sentences))
+        elif self.window_chars > 0:
+            windows = self._build_windows(unique_sentences)
+            batches = [batch for _, batch in windows]
+            self.stats["windows"] = len(batches)
+            logger.info(
+                f"Packed into {len(batches)} windows of at most {self.window_chars} characters"
+            )
+        else:
+            batches = [
+                range(i, min(i + self.batch_size, len(unique_sentences)))
+                for i in range(0, len(unique_sentences), self.batch_size)
+            ]
+            tag = self._tag_sentences
+        # number of requests (windows) whose response a sentence still waits for
+        coverage = [0] * len(unique_sentences)
+        for batch in batches:
+            for i in batch:
+                coverage[i] += 1
+
+        async def tag_batch(n: int):
+            batch = batches[n]
+            if windows is not None:
+                return batch, await self._tag_window(
+                    windows[n][0], [unique_sentences[i] for i in batch]
+                )
+            return batch, await tag([unique_sentences[i] for i in batch])
+
+        responses = {self.NO_PHI_KEY: None}
+        partial_responses = {}
+        next_sentence = 0
+        progress = tqdm.tqdm(total=len(sentences))
+        async for batch, userinfos in AsyncUtils.bounded_ordered_map(
+            tag_batch, range(len(batches)), self.max_concurrency
+        ):
+            for i, userinfo in zip(batch, userinfos):
+                key = unique_keys[i]
+                if key in partial_responses:
+                    userinfo = self._merge_responses(partial_responses[key], userinfo)
+                coverage[i] -= 1
+                if coverage[i] == 0:
+                    partial_responses.pop(key, None)
+                    responses[key] = userinfo
+                else:
+                    partial_responses[key] = userinfo
+
+            # fan out: every sentence (in input order) whose response is known
+            while next_sentence < len(sentences) and keys[next_sentence] in responses:
+                key = keys[next_sentence]
+                tagged_sentence = self._to_tagged_sentence(
+                    sentences[next_sentence], responses[key]
+                )
+                if last_occurrence[key] == next_sentence and key != self.NO_PHI_KEY:
+                    del responses[key]
+                next_sentence += 1
+                progress.update(1)
+                yield tagged_sentence
+        progress.close()
+        if self.batch_job and unique_sentences and self._load_batch_state():
+            self._save_batch_state({**self._load_batch_state(), "phase": "done"})
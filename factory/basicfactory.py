@@ -1,4 +1,9 @@
 from factory.classmaps import ClassMappings
+from algos.sentence_tagging.cache import TaggingCache
+from algos.sentence_tagging.cascade import CascadeTagging
+from algos.sentence_tagging.ratelimit import RateLimiter
+from utils.constants import DataConstants
+from etl.ETL import ETLUtils
 from abc import ABC, abstractmethod
 from loguru import logger
 
@@ -19,6 +24,17 @@ class DatasetToClinicalNotes(BaseFactory):
 
 # create a class named ClinicalNotesToSentences that inherits from the BaseFactory class
 class ClinicalNotesToSentences(BaseFactory):
+    # config key -> keyword of the spaCy sentence extractors
+    SPACY_OPTIONS = {
+        "spacy-model": "model",
+        "spacy-mode": "mode",
+        "batch-size": "batch_size",
+        "n-process": "n_process",
+        "warm-up": "warm_up",
+    }
+    # extractors taking the SPACY_OPTIONS, the others are built without arguments
+    SPACY_EXTRACTORS = ("spacy", "spacy_with_basic")
+
     def create(self, config, *args, **kwargs):
         # create an object of etl
         etl_args = FactoryGenerator.get_etl_args(config)
@@ -30,7 +46,18 @@ class ClinicalNotesToSentences(BaseFactory):
         logger.info(f"Using Sentence Extractor: {algo}")
 
         algo_class = ClassMappings.algo_sentence_extractor_map[algo]
-        etl.set_algo(algo_class())
+        # spaCy based extractors: model, segmentation mode & batching of nlp.pipe, when given in the config
+        algo_kwargs = {
+            name: config[key]
+            for key, name in self.SPACY_OPTIONS.items()
+            if key in config
+        }
+        if algo_kwargs and algo not in self.SPACY_EXTRACTORS:
+            logger.info(f"Ignoring spaCy options {sorted(algo_kwargs)} for Sentence Extractor: {algo}")
+            algo_kwargs = {}
+        if algo_kwargs:
+            logger.info(f"Using Sentence Extractor Options: {algo_kwargs}")
+        etl.set_algo(algo_class(**algo_kwargs))
 
         return etl
 
@@ -47,13 +74,73 @@ class SentencesToAnnotations(BaseFactory):
         model = config["model"]
 
         logger.info(f"Using Sentence Tagging: {algo}")
+        if config.get("api-base"):
+            logger.info(f"Using Tagging Endpoint: {config['api-base']}")
 
         algo_class = ClassMappings.algo_sentence_tagging_map[algo]
-        algo_model = ClassMappings.models_map[model]
-        etl.set_algo(algo_class(model=algo_model))
+        # models served by an OpenAI-compatible endpoint are passed through as named in the config
+        algo_model = ClassMappings.models_map.get(model, model)
+
+        # optional on-disk response cache, shared by every stage with the same root
+        cache = None
+        if config.get("cache", False):
+            cache_dir = DataConstants.TAGGING_CACHE_DIR.format(root_dir=config["root"])
+            cache = TaggingCache(cache_dir, max_size_mb=config.get("cache-max-mb", 512))
+            logger.info(f"Using Tagging Cache: {cache.path}")
+
+        tagger = self._create_tagger(algo_class, algo_model, config, cache)
+
+        # optional cascade: the model above tags every sentence, doubtful answers are asked again to a bigger model
+        if config.get("escalation-model"):
+            escalation_model = ClassMappings.models_map.get(
+                config["escalation-model"], config["escalation-model"]
+            )
+            escalate_on = config.get("escalate-on", "unmatched")
+            if isinstance(escalate_on, str):
+                escalate_on = [criterion.strip() for criterion in escalate_on.split(",")]
+            logger.info(f"Using Escalation Model: {escalation_model} on {escalate_on}")
+            tagger = CascadeTagging(
+                cheap=tagger,
+                expensive=self._create_tagger(algo_class, escalation_model, config, cache),
+                escalate_on=escalate_on,
+                min_chars=config.get("escalation-min-chars", 400),
+                # windows join several sentences, the length criterion applies to each of them
+                separator=etl.WINDOW_SEPARATOR if etl.window_chars > 0 else None,
+            )
+
+        etl.set_algo(tagger)
+
+        # offline batch jobs, the ETL runs them with the tagging algo as the fallback for failed requests
+        if etl.batch_job:
+            backend = config.get("batch-job-backend", "openai")
+            logger.info(f"Using Batch Job Backend: {backend}")
+            etl.set_batch_backend(
+                ClassMappings.batch_backend_map[backend](
+                    etl.batch_job_dir, api_base=config.get("api-base")
+                )
+            )
 
         return etl
 
+    @staticmethod
+    def _create_tagger(algo_class, model, config, cache):
+        # requests/tokens per minute budgets, retries with backoff, deadlines & hedging,
+        # shared by all the concurrent requests to this model (rate limits are per model)
+        rate_limiter = RateLimiter(
+            rpm=config.get("rpm"),
+            tpm=config.get("tpm"),
+            max_retries=config.get("max-retries", 6),
+            request_timeout=config.get("request-timeout"),
+            hedge=ETLUtils.as_bool(config.get("hedge", False)),
+            hedge_quantile=config.get("hedge-quantile", 0.95),
+        )
+        return algo_class(
+            model=model,
+            api_base=config.get("api-base"),
+            cache=cache,
+            rate_limiter=rate_limiter,
+        )
+
 
 # create a class named AnnotationsToDoccano that inherits from the BaseFactory class
 class AnnotationsToDoccano(BaseFactory):
@@ -35,9 +35,12 @@ from algos.sentence_extractor.spacy_with_basic import (
     SpacyWithBasicSentenceExtractor,
 )
 from algos.sentence_extractor.spacy import SpacySentenceExtractor
+from algos.sentence_extractor.rule_based import RuleBasedSentenceExtractor
 
 # import the sentence tagging
 from algos.sentence_tagging.gpt import TaggingSentenceByGPT
+from algos.sentence_tagging.openai_compatible import TaggingSentenceByOpenAICompatible
+from algos.sentence_tagging.batch import LocalBatchBackend, OpenAIBatchBackend
 
 
 class ClassMappings:
@@ -59,10 +62,17 @@ class ClassMappings:
         "basic": BasicSentanceExtractor,
         "spacy_with_basic": SpacyWithBasicSentenceExtractor,
         "spacy": SpacySentenceExtractor,
+        "rule_based": RuleBasedSentenceExtractor,
     }
 
     algo_sentence_tagging_map = {
         "gpt": TaggingSentenceByGPT,
+        "openai_compatible": TaggingSentenceByOpenAICompatible,
+    }
+
+    batch_backend_map = {
+        "openai": OpenAIBatchBackend,
+        "local": LocalBatchBackend,
     }
 
     models_map = {
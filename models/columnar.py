@@ -0,0 +1,224 @@
+from array import array
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+import numpy as np
+from models.model import Annotations, SingleAnnotation
+
+NO_TYPE = "NO_TYPE"
+# kind of a label: outside of any entity, first token of an entity, following token of an entity
+OUTSIDE, BEGIN, INSIDE = 0, 1, 2
+
+
+class LabelVocab:
+    """
+    Interned token labels. NO_TYPE is id 0; a "B-X" / "I-X" label maps to its kind & the id of entity X.
+    Any other label is kept as is and is outside of entities.
+    """
+
+    def __init__(self):
+        self.labels: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self.entities: List[str] = []
+        self.entity_ids: Dict[str, int] = {}
+        self._kinds: List[int] = []
+        self._label_entities: List[int] = []
+        self.id(NO_TYPE)
+
+    def id(self, label: str) -> int:
+        label_id = self.ids.get(label)
+        if label_id is None:
+            label_id = len(self.labels)
+            self.labels.append(label)
+            self.ids[label] = label_id
+            kind, entity = OUTSIDE, -1
+            if label[:2] in ("B-", "I-"):
+                kind = BEGIN if label[0] == "B" else INSIDE
+                entity = self.entity_id(label[2:])
+            self._kinds.append(kind)
+            self._label_entities.append(entity)
+        return label_id
+
+    def entity_id(self, entity: str) -> int:
+        entity_id = self.entity_ids.get(entity)
+        if entity_id is None:
+            entity_id = len(self.entities)
+            self.entities.append(entity)
+            self.entity_ids[entity] = entity_id
+        return entity_id
+
+    def kinds(self) -> np.ndarray:
+        # kind of each label id
+        return np.array(self._kinds, dtype=np.int8)
+
+    def label_entities(self) -> np.ndarray:
+        # entity id of each label id, -1 for labels outside of entities
+        return np.array(self._label_entities, dtype=np.int32)
+
+    def bio_ids(self) -> Tuple[np.ndarray, np.ndarray]:
+        # label ids of "B-X" & "I-X" for each entity id X
+        entities = list(self.entities)
+        begin = np.array([self.id(f"B-{entity}") for entity in entities], dtype=np.int32)
+        inside = np.array([self.id(f"I-{entity}") for entity in entities], dtype=np.int32)
+        return begin, inside
+
+
+class Spans(NamedTuple):
+    # entity spans of many sentences, one row per span, sorted by sentence & start
+    sentence: np.ndarray
+    start: np.ndarray
+    end: np.ndarray
+    entity: np.ndarray
+
+
+class ColumnarAnnotations:
+    """
+    Token annotations of many sentences as columns, instead of one SingleAnnotation per token:
+    - starts, ends: int32 character offsets of the tokens in their sentence
+    - labels: int32 label ids of `vocab`
+    - offsets: the tokens of sentence i are the rows offsets[i]:offsets[i+1]
+    - sources: annotation_source of each sentence
+    Tokens are not stored, they are slices of the sentence texts; the few that are not (`tokens`, by row)
+    are kept so the conversion back to Annotations is lossless.
+    """
+
+    def __init__(
+        self,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        labels: np.ndarray,
+        offsets: np.ndarray,
+        vocab: LabelVocab,
+        sources: List[str],
+        tokens: Optional[Dict[int, str]] = None,
+    ):
+        self.starts = starts
+        self.ends = ends
+        self.labels = labels
+        self.offsets = offsets
+        self.vocab = vocab
+        self.sources = sources
+        self.tokens = tokens or {}
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    @property
+    def num_tokens(self) -> int:
+        return len(self.labels)
+
+    def rows(self, i: int) -> slice:
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def token(self, row: int, text: str) -> str:
+        # token of a row, `text` being the text of its sentence
+        return self.tokens.get(row, text[self.starts[row] : self.ends[row]])
+
+    def token_sentences(self) -> np.ndarray:
+        # sentence index of each token
+        return np.repeat(np.arange(len(self), dtype=np.int32), np.diff(self.offsets))
+
+    @classmethod
+    def from_records(
+        cls, records: Iterable[Tuple[str, dict]], vocab: LabelVocab = None
+    ) -> "ColumnarAnnotations":
+        # (sentence text, annotations as parsed from json) pairs, without building pydantic objects
+        vocab = vocab or LabelVocab()
+        ids = vocab.ids
+        starts, ends, labels, offsets = array("i"), array("i"), array("i"), array("q", [0])
+        sources, tokens = [], {}
+        for text, annotations in records:
+            sources.append(annotations["annotation_source"])
+            items = annotations["annotations"]
+            row = len(labels)
+            # one extend per column & sentence, the per token work is kept to the list comprehensions
+            starts.extend([item["start_index"] for item in items])
+            ends.extend([item["end_index"] for item in items])
+            labels.extend([ids[item["type"]] if item["type"] in ids else vocab.id(item["type"]) for item in items])
+            for i, item in enumerate(items):
+                if item["start_index"] < 0 or text[item["start_index"] : item["end_index"]] != item["token"]:
+                    tokens[row + i] = item["token"]
+            offsets.append(len(labels))
+        return cls(
+            np.frombuffer(starts, dtype=np.int32).copy(),
+            np.frombuffer(ends, dtype=np.int32).copy(),
+            np.frombuffer(labels, dtype=np.int32).copy(),
+            np.frombuffer(offsets, dtype=np.int64).copy(),
+            vocab,
+            sources,
+            tokens,
+        )
+
+    @classmethod
+    def from_annotations(
+        cls, texts: Iterable[str], annotations: Iterable[Annotations], vocab: LabelVocab = None
+    ) -> "ColumnarAnnotations":
+        return cls.from_records(
+            ((text, annotation.model_dump()) for text, annotation in zip(texts, annotations)), vocab
+        )
+
+    def to_annotations(self, texts: Iterable[str]) -> List[Annotations]:
+        labels = self.vocab.labels
+        result = []
+        for i, text in enumerate(texts):
+            rows = range(int(self.offsets[i]), int(self.offsets[i + 1]))
+            result.append(
+                Annotations(
+                    annotation_source=self.sources[i],
+                    annotations=[
+                        SingleAnnotation(
+                            token=self.token(row, text),
+                            start_index=int(self.starts[row]),
+                            end_index=int(self.ends[row]),
+                            type=labels[self.labels[row]],
+                        )
+                        for row in rows
+                    ],
+                )
+            )
+        return result
+
+    def spans(self) -> Spans:
+        """
+        Entity spans of the BIO tokens, as convert_machine_readable_to_human_readable_annotations:
+        a span starts at a B-X token and extends over the I-X tokens right after it, stray I- tokens are ignored.
+        """
+        kinds = self.vocab.kinds()[self.labels]
+        entities = self.vocab.label_entities()[self.labels]
+        sentences = self.token_sentences()
+        # a token continues the entity of the token before it
+        continues = np.zeros(len(kinds), dtype=bool)
+        continues[1:] = (
+            (kinds[1:] == INSIDE)
+            & (kinds[:-1] != OUTSIDE)
+            & (entities[1:] == entities[:-1])
+            & (sentences[1:] == sentences[:-1])
+        )
+        heads = np.flatnonzero(~continues)
+        lasts = np.append(heads[1:], len(kinds)) - 1
+        keep = kinds[heads] == BEGIN
+        heads, lasts = heads[keep], lasts[keep]
+        return Spans(sentences[heads], self.starts[heads], self.ends[lasts], entities[heads])
+
+    def label_spans(self, spans: Spans) -> np.ndarray:
+        """
+        BIO label ids of the tokens for the given entity spans (e.g. predicted spans on the gold tokens):
+        a token starting inside a span is B- if it is the span's first token, I- otherwise, NO_TYPE outside of spans.
+        """
+        labels = np.zeros(len(self.labels), dtype=np.int32)
+        if len(spans.start) == 0 or len(labels) == 0:
+            return labels
+        sentences = self.token_sentences().astype(np.int64)
+        token_keys = (sentences << 32) | self.starts.astype(np.int64)
+        span_keys = (spans.sentence.astype(np.int64) << 32) | spans.start.astype(np.int64)
+        span = np.searchsorted(span_keys, token_keys, side="right") - 1
+        candidate = np.maximum(span, 0)
+        inside = (
+            (span >= 0)
+            & (spans.sentence[candidate] == sentences)
+            & (self.starts < spans.end[candidate])
+        )
+        first = inside.copy()
+        first[1:] &= ~(inside[:-1] & (span[:-1] == span[1:]))
+        begin_ids, inside_ids = self.vocab.bio_ids()
+        entity = spans.entity[candidate]
+        labels[inside] = np.where(first[inside], begin_ids[entity[inside]], inside_ids[entity[inside]])
+        return labels
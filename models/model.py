@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import ClassVar, Dict, Iterator, List, Optional, Tuple
 
 
 class SingleAnnotation(BaseModel):
@@ -46,7 +46,40 @@ class CompareSentenceAnnotations(AnnotatedSentence):
     secondary_annotations: Annotations
 
 
-class UserInfo2006i2b2(BaseModel):
+class PHIInfo(BaseModel):
+    """
+    Base of the model responses: PHI strings per field.
+    PHI_TYPES maps a list field to its PHI type, in matching priority order (a string returned
+    in two fields gets the type of the first one).
+    """
+
+    PHI_TYPES: ClassVar[Dict[str, str]] = {}
+
+    def normalize_phi(self, phi_type: str, value: str, sentence: str) -> Optional[str]:
+        # the string to look for in the sentence, None to drop the value
+        return value
+
+    def phi_strings(self, sentence: str) -> Iterator[Tuple[str, str]]:
+        # (string, PHI type) pairs in priority order, to look for in the sentence
+        for field, phi_type in self.PHI_TYPES.items():
+            for value in getattr(self, field):
+                value = self.normalize_phi(phi_type, value, sentence)
+                if value:
+                    yield value, phi_type
+
+
+class UserInfo2006i2b2(PHIInfo):
+    PHI_TYPES: ClassVar[Dict[str, str]] = {
+        "patients": "PATIENT",
+        "doctors": "DOCTOR",
+        "hospitals": "HOSPITAL",
+        "ids": "ID",
+        "dates": "DATE",
+        "locations": "LOCATION",
+        "phone_numbers": "PHONE",
+        "ages": "AGE",
+    }
+
     patients: list[str]
     doctors: list[str]
     hospitals: list[str]
@@ -56,7 +89,32 @@ class UserInfo2006i2b2(BaseModel):
     phone_numbers: list[str]
     ages: list[str]
 
-class UserInfo2014i2b2(BaseModel):
+    def normalize_phi(self, phi_type: str, value: str, sentence: str) -> Optional[str]:
+        # only ages over 90 are PHI, tagged on their digits when the age as returned is in the sentence
+        if phi_type == "AGE":
+            if value not in sentence:
+                return None
+            age = "".join([a for a in value if a.isnumeric()])
+            return age if age and int(age) > 90 else None
+        return value
+
+class IndexedUserInfo2006i2b2(UserInfo2006i2b2):
+    index: int
+
+class BatchUserInfo2006i2b2(BaseModel):
+    sentences: list[IndexedUserInfo2006i2b2]
+
+class UserInfo2014i2b2(PHIInfo):
+    PHI_TYPES: ClassVar[Dict[str, str]] = {
+        "names": "NAME",
+        "locations": "LOCATION",
+        "ages": "AGE",
+        "ids": "ID",
+        "dates": "DATE",
+        "contacts": "CONTACT",
+        "professions": "PROFESSION",
+    }
+
     names: list[str]
     locations: list[str]
     ages: list[str]
@@ -1,3 +1,4 @@
+from models.columnar import ColumnarAnnotations, LabelVocab, Spans
 from utils.constants import DataConstants
 import matplotlib.pyplot as plt
 import json
@@ -7,10 +8,62 @@ import numpy as np
 import os
 
 
+# sentences evaluated together, bounds the memory whatever the size of the file
+CHUNK_SIZE = 10000
+
+
+def _grow(counts, size):
+    # counts padded with zeros to `size` entries (the label vocabulary grows while streaming)
+    if len(counts) >= size:
+        return counts
+    return np.concatenate([counts, np.zeros(size - len(counts), dtype=counts.dtype)])
+
+
+def _prf(tp, predicted, gold, tp_predicted=None):
+    # tp_predicted - true positives among the predictions, when they are not counted as the gold ones
+    tp_predicted = tp if tp_predicted is None else tp_predicted
+    precision = float(tp_predicted / predicted) if predicted else 0.0
+    recall = float(tp / gold) if gold else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": round(precision, 4), "recall": round(recall, 4), "f1": round(f1, 4), "support": int(gold)}
+
+
+def _span_keys(spans: Spans, num_entities: int, width: int) -> np.ndarray:
+    # one int64 key per span, ordered by (sentence, entity, start)
+    group = spans.sentence.astype(np.int64) * num_entities + spans.entity
+    return group * width + spans.start
+
+
+def _overlapping(spans: Spans, others: Spans, num_entities: int, width: int) -> np.ndarray:
+    # spans overlapping a span of `others` of the same entity in the same sentence;
+    # the spans of one entity in one sentence do not overlap, their ends grow with their starts
+    if len(others.start) == 0:
+        return np.zeros(len(spans.start), dtype=bool)
+    other_keys = _span_keys(others, num_entities, width)
+    order = np.argsort(other_keys, kind="stable")
+    other_keys = other_keys[order]
+    group = spans.sentence.astype(np.int64) * num_entities + spans.entity
+    # the last span of the group starting before the end of the span
+    last = np.searchsorted(other_keys, group * width + spans.end, side="left") - 1
+    candidate = order[np.maximum(last, 0)]
+    return (
+        (last >= 0)
+        & (others.sentence[candidate] == spans.sentence)
+        & (others.entity[candidate] == spans.entity)
+        & (others.end[candidate] > spans.start)
+    )
 
 
 class Accuracy:
-    def __init__(self, file_path, root_dir, dataset, trues=[], preds=[]):
+    """
+    Evaluates the secondary (model) annotations of tagged sentences against their ground truth annotations.
+    The file is streamed in chunks of sentences; in each chunk the tokens of both annotations are joined on
+    (sentence, start_index, token) and counted in a confusion matrix of label ids.
+    Reports token level & span level (strict: same offsets & type, partial: overlap & same type)
+    precision / recall / F1 per category, besides the correctly / incorrectly / un / extra tagged counts.
+    """
+
+    def __init__(self, file_path, root_dir, dataset, trues=[], preds=[], chunk_size=CHUNK_SIZE):
         self.inp_file = file_path
         self.file_name = self.inp_file.split("/")[-1].split(".")[0]
         self.out_dir = DataConstants.METRICS_DIR.format(root_dir=root_dir)
@@ -18,24 +71,16 @@ class Accuracy:
         self.dataset = dataset
         self.trues = trues
         self.preds = preds
+        self.chunk_size = chunk_size
+        self.vocab = LabelVocab()
+        self.confusion = np.zeros((0, 0), dtype=np.int64)
+        self.span_counts = {
+            key: np.zeros(0, dtype=np.int64)
+            for key in ("gold", "predicted", "strict", "partial_gold", "partial_predicted")
+        }
+        self.total = 0
 
     def calculate_accuracy(self):
-        tagged_sentences = []
-        with open(self.inp_file, "r", encoding="utf-8") as file:
-            for line in tqdm.tqdm(file):
-                tagged_sentences.append(json.loads(line))
-        
-        match_ = 0
-        total_ = 0
-        correctly_tagged = 0
-        incorrectly_tagged = 0
-        untagged = 0
-        extra_tagged = 0
-        correctly_tagged_dict = {}
-        incorrectly_tagged_dict = {}
-        untagged_dict = {}
-        extra_tagged_dict = {}
-        mis_matched_tags = []
         if self.dataset == "2006":
             raw_categories = ['NAME', 'AGE', 'DATE', 'ID', 'LOCATION', 'HOSPITAL', 'DOCTOR', 'PHONE']
         elif self.dataset == "2014":
@@ -46,54 +91,44 @@ class Accuracy:
         for category in raw_categories:
             categories.append("B-" + category)
             categories.append("I-" + category)
-        for category in categories:
-            key_ = category[2:]
-            correctly_tagged_dict[key_] = 0
-            incorrectly_tagged_dict[key_] = 0
-            untagged_dict[key_] = 0
-            extra_tagged_dict[key_] = 0
-        for sentence in tagged_sentences:
-            mimic = []
-            gpt = []
-            total_ += len(sentence["annotations"]["annotations"])
-            for annotation in sentence["annotations"]["annotations"]:
-                for sannotation in sentence["secondary_annotations"]["annotations"]:
-                    if sannotation["token"] == annotation["token"] and sannotation["start_index"] == annotation["start_index"]:
-                        true = annotation["type"]
-                        pred = sannotation["type"]
-                        for category in categories:
-                            key_ = category[2:]
-                            if true == category and pred == category:
-                                correctly_tagged_dict[key_] += 1
-                                correctly_tagged += 1
-                            elif true == category and pred == "NO_TYPE":
-                                untagged_dict[key_] += 1
-                                untagged += 1
-                                mimic.append([annotation["start_index"], annotation["end_index"], annotation["type"]])
-                                gpt.append([sannotation["start_index"], sannotation["end_index"], sannotation["type"]])
-                            elif true == category and pred != category:
-                                incorrectly_tagged_dict[key_] += 1
-                                incorrectly_tagged += 1
-                                mimic.append([annotation["start_index"], annotation["end_index"], annotation["type"]])
-                                gpt.append([sannotation["start_index"], sannotation["end_index"], sannotation["type"]])
-                            elif true == "NO_TYPE" and pred == category:
-                                extra_tagged_dict[key_] += 1
-                                extra_tagged += 1
-                                mimic.append([annotation["start_index"], annotation["end_index"], annotation["type"]])
-                                gpt.append([sannotation["start_index"], sannotation["end_index"], sannotation["type"]])
-                        match_ += 1
-                        break
-            if len(gpt) or len(mimic):
-                mis_matched_tags.append({
-                    "text": sentence["text"] + "   __MIMIC",
-                    "label": mimic  
-                })
-                mis_matched_tags.append({
-                    "text": sentence["text"] + "   __GPT",
-                    "label": gpt  
-                })                             
-        
-        print(f"Matched {match_} out of {total_} tags : {round((match_ / total_) * 100, 2)}%")
+        self.category_ids = np.array([self.vocab.id(category) for category in categories], dtype=np.int32)
+
+        with open(self.inp_file, "r", encoding="utf-8") as file, open(
+            f"{self.out_dir}/{self.file_name}-mismatches.json", "w"
+        ) as mismatches:
+            chunk = []
+            for line in tqdm.tqdm(file):
+                chunk.append(line)
+                if len(chunk) >= self.chunk_size:
+                    self._evaluate_chunk(chunk, mismatches)
+                    chunk = []
+            if chunk:
+                self._evaluate_chunk(chunk, mismatches)
+
+        confusion = self._confusion()
+        labels = self.vocab.ids
+        correctly_tagged_dict = {}
+        incorrectly_tagged_dict = {}
+        untagged_dict = {}
+        extra_tagged_dict = {}
+        for category in raw_categories:
+            rows = [labels[f"B-{category}"], labels[f"I-{category}"]]
+            correctly_tagged_dict[category] = int(sum(confusion[row, row] for row in rows))
+            untagged_dict[category] = int(sum(confusion[row, 0] for row in rows))
+            incorrectly_tagged_dict[category] = int(
+                sum(confusion[row].sum() for row in rows)
+                - correctly_tagged_dict[category]
+                - untagged_dict[category]
+            )
+            extra_tagged_dict[category] = int(sum(confusion[0, row] for row in rows))
+        correctly_tagged = sum(correctly_tagged_dict.values())
+        incorrectly_tagged = sum(incorrectly_tagged_dict.values())
+        untagged = sum(untagged_dict.values())
+        extra_tagged = sum(extra_tagged_dict.values())
+        match_ = int(confusion.sum())
+        total_ = self.total
+
+        print(f"Matched {match_} out of {total_} tags : {round((match_ / total_) * 100, 2) if total_ else 0.0}%")
         print("Correctly tagged: ", correctly_tagged)
         print("Incorrectly tagged: ", incorrectly_tagged)
         print("Untagged: ", untagged)
@@ -102,15 +137,22 @@ class Accuracy:
         print("Incorrectly tagged: ", incorrectly_tagged_dict)
         print("Untagged: ", untagged_dict)
         print("Extra tagged: ", extra_tagged_dict)
-        sum = correctly_tagged + incorrectly_tagged + untagged
+        sum_ = correctly_tagged + incorrectly_tagged + untagged
         metrics = {
-            "correctly_tagged(%)": round((correctly_tagged / sum) * 100, 2),
-            "incorrectly_tagged(%)": round((incorrectly_tagged / sum) * 100, 2),
-            "untagged(%)": round((untagged / sum) * 100, 2),
-            "extra_tagged(%)": round((extra_tagged / match_) * 100, 2),
+            "correctly_tagged(%)": round((correctly_tagged / sum_) * 100, 2) if sum_ else 0.0,
+            "incorrectly_tagged(%)": round((incorrectly_tagged / sum_) * 100, 2) if sum_ else 0.0,
+            "untagged(%)": round((untagged / sum_) * 100, 2) if sum_ else 0.0,
+            "extra_tagged(%)": round((extra_tagged / match_) * 100, 2) if match_ else 0.0,
         }
         print(metrics)
-        
+        scores = self._scores(confusion)
+        for level, per_category in scores.items():
+            print(f"{level}:")
+            for category, score in per_category.items():
+                print(f"  {category:<12} {json.dumps(score)}")
+        with open(f"{self.out_dir}/{self.file_name}-metrics.json", "w") as f:
+            json.dump({"counts": metrics, **scores}, f, indent=2)
+
         categories = raw_categories
         fig = plt.figure(figsize=(8,6))
         fig = plt.figure(facecolor=(1, 1, 1))
@@ -129,9 +171,150 @@ class Accuracy:
         ax.bar_label(p, label_type="center")
         ax.legend()
         fig.savefig(f"{self.out_dir}/{self.file_name}-BarPlot.jpg", bbox_inches='tight')
-        with open(f"{self.out_dir}/{self.file_name}-mismatches.json", "w") as f:
-            for tag in mis_matched_tags:
-                f.write(json.dumps(tag) + "\n")
+        return scores
+
+    def _evaluate_chunk(self, lines, mismatches):
+        sentences = [json.loads(line) for line in lines]
+        gold = ColumnarAnnotations.from_records(
+            ((sentence["text"], sentence["annotations"]) for sentence in sentences), self.vocab
+        )
+        pred = ColumnarAnnotations.from_records(
+            ((sentence["text"], sentence["secondary_annotations"]) for sentence in sentences), self.vocab
+        )
+        self.total += gold.num_tokens
+        matched, partner = self._join(sentences, gold, pred)
+
+        # confusion matrix of the (true, predicted) label ids of the joined tokens
+        trues = gold.labels[matched]
+        preds = pred.labels[partner[matched]]
+        size = len(self.vocab.labels)
+        counts = np.bincount(trues.astype(np.int64) * size + preds, minlength=size * size)
+        confusion = self._confusion()
+        confusion += counts.reshape(size, size)
+        self.confusion = confusion
+
+        # sentences with a category token tagged otherwise, or a NO_TYPE token tagged with a category
+        true_category = np.isin(trues, self.category_ids)
+        mismatched = (true_category & (preds != trues)) | ((trues == 0) & np.isin(preds, self.category_ids))
+        self._write_mismatches(sentences, gold, pred, np.flatnonzero(matched)[mismatched], partner, mismatches)
+        width = int(max(gold.starts.max(initial=0), gold.ends.max(initial=0), pred.starts.max(initial=0), pred.ends.max(initial=0))) + 1
+        self._count_spans(gold.spans(), pred.spans(), width)
+
+    @staticmethod
+    def _join(sentences, gold, pred):
+        # hash join of the gold tokens with the predicted tokens of the same sentence on (start_index, token):
+        # tokens are slices of the sentence, so (start_index, end_index) identify them
+        width = int(max(
+            gold.starts.max(initial=0), gold.ends.max(initial=0), pred.starts.max(initial=0), pred.ends.max(initial=0)
+        )) + 2
+
+        def keys(annotations):
+            token_sentences = annotations.token_sentences().astype(np.int64)
+            return (token_sentences * width + (annotations.starts + 1)) * width + (annotations.ends + 1)
+
+        gold_keys = keys(gold)
+        if pred.num_tokens == 0:
+            return np.zeros(len(gold_keys), dtype=bool), np.zeros(len(gold_keys), dtype=np.int64)
+        pred_keys = keys(pred)
+        order = np.argsort(pred_keys, kind="stable")
+        sorted_keys = pred_keys[order]
+        position = np.minimum(np.searchsorted(sorted_keys, gold_keys), len(sorted_keys) - 1)
+        matched = sorted_keys[position] == gold_keys
+        partner = order[position]
+        # the rare tokens that are not slices of their sentence are compared as strings
+        if gold.tokens or pred.tokens:
+            token_sentences = gold.token_sentences()
+            rows = set(gold.tokens) | set(np.flatnonzero(np.isin(partner, list(pred.tokens))).tolist())
+            for row in rows:
+                if matched[row]:
+                    text = sentences[token_sentences[row]]["text"]
+                    matched[row] = gold.token(row, text) == pred.token(int(partner[row]), text)
+        return matched, partner
+
+    def _write_mismatches(self, sentences, gold, pred, rows, partner, mismatches):
+        labels = self.vocab.labels
+        # rows are sorted, the rows of a sentence are contiguous
+        row_sentences = gold.token_sentences()[rows]
+        if len(rows) == 0:
+            return
+        boundaries = np.flatnonzero(np.diff(row_sentences)) + 1
+        for i, sentence_rows in zip(row_sentences[np.r_[0, boundaries]], np.split(rows, boundaries)):
+            mimic = [
+                [int(gold.starts[row]), int(gold.ends[row]), labels[gold.labels[row]]] for row in sentence_rows
+            ]
+            gpt = [
+                [int(pred.starts[row]), int(pred.ends[row]), labels[pred.labels[row]]]
+                for row in partner[sentence_rows]
+            ]
+            text = sentences[i]["text"]
+            mismatches.write(json.dumps({"text": text + "   __MIMIC", "label": mimic}) + "\n")
+            mismatches.write(json.dumps({"text": text + "   __GPT", "label": gpt}) + "\n")
+
+    def _count_spans(self, gold: Spans, pred: Spans, width: int):
+        num_entities = len(self.vocab.entities)
+        counts = {key: _grow(value, num_entities) for key, value in self.span_counts.items()}
+        counts["gold"] += np.bincount(gold.entity, minlength=num_entities)
+        counts["predicted"] += np.bincount(pred.entity, minlength=num_entities)
+        # strict: same sentence, offsets & entity
+        gold_keys = _span_keys(gold, num_entities, width) * width + gold.end
+        pred_keys = _span_keys(pred, num_entities, width) * width + pred.end
+        strict = np.isin(gold_keys, pred_keys)
+        counts["strict"] += np.bincount(gold.entity[strict], minlength=num_entities)
+        counts["partial_gold"] += np.bincount(
+            gold.entity[_overlapping(gold, pred, num_entities, width)], minlength=num_entities
+        )
+        counts["partial_predicted"] += np.bincount(
+            pred.entity[_overlapping(pred, gold, num_entities, width)], minlength=num_entities
+        )
+        self.span_counts = counts
+
+    def _confusion(self):
+        # the confusion matrix padded to the current label vocabulary
+        size = len(self.vocab.labels)
+        if self.confusion.shape[0] < size:
+            confusion = np.zeros((size, size), dtype=np.int64)
+            confusion[: self.confusion.shape[0], : self.confusion.shape[1]] = self.confusion
+            self.confusion = confusion
+        return self.confusion
+
+    def _scores(self, confusion):
+        entities = self.vocab.entities
+        num_entities = len(entities)
+        # token level, B- & I- labels of an entity count as the entity, everything else as outside
+        label_entities = self.vocab.label_entities()
+        label_entities = np.where(label_entities < 0, num_entities, label_entities)
+        one_hot = np.zeros((len(label_entities), num_entities + 1), dtype=np.int64)
+        one_hot[np.arange(len(label_entities)), label_entities] = 1
+        by_entity = one_hot.T @ confusion @ one_hot
+        tp = np.diag(by_entity)[:num_entities]
+        predicted = by_entity[:, :num_entities].sum(axis=0)
+        gold = by_entity[:num_entities, :].sum(axis=1)
+        spans = {key: _grow(value, num_entities) for key, value in self.span_counts.items()}
+
+        scores = {"token": {}, "span_strict": {}, "span_partial": {}}
+        for entity_id, entity in sorted(enumerate(entities), key=lambda item: item[1]):
+            if not (gold[entity_id] or predicted[entity_id] or spans["gold"][entity_id] or spans["predicted"][entity_id]):
+                continue
+            scores["token"][entity] = _prf(tp[entity_id], predicted[entity_id], gold[entity_id])
+            scores["span_strict"][entity] = _prf(
+                spans["strict"][entity_id], spans["predicted"][entity_id], spans["gold"][entity_id]
+            )
+            # a partial match counts once on each side, precision & recall come from their own counts
+            scores["span_partial"][entity] = _prf(
+                spans["partial_gold"][entity_id],
+                spans["predicted"][entity_id],
+                spans["gold"][entity_id],
+                tp_predicted=spans["partial_predicted"][entity_id],
+            )
+        scores["token"]["ALL"] = _prf(tp.sum(), predicted.sum(), gold.sum())
+        scores["span_strict"]["ALL"] = _prf(spans["strict"].sum(), spans["predicted"].sum(), spans["gold"].sum())
+        scores["span_partial"]["ALL"] = _prf(
+            spans["partial_gold"].sum(),
+            spans["predicted"].sum(),
+            spans["gold"].sum(),
+            tp_predicted=spans["partial_predicted"].sum(),
+        )
+        return scores
 
 
 def main(args):
@@ -0,0 +1,140 @@
+from models.model import SingleAnnotation
+from scripts.post_processing_of_tagged_sentences import (
+    convert_human_readable_to_machine_readable_annotations,
+)
+from typing import List
+import argparse
+import json
+import random
+import time
+
+
+# Micro-benchmark of the human readable (spans) to machine readable (BIO tokens) conversion:
+# the offset based conversion against the previous string rewriting one, on synthetic sentences
+# of growing length, or on the tags of an annotated sentences file.
+# Run from the root of the repository: python -m scripts.benchmark_bio_conversion --help
+
+
+def legacy_convert_human_readable_to_machine_readable_annotations(
+    sentence: str, tags: List[SingleAnnotation]
+) -> List[SingleAnnotation]:
+    # previous implementation, kept for comparison
+    tags = sorted(tags, key=lambda x: x.start_index)
+    annotations = []
+    sent = sentence
+    sent1 = sentence
+    for tag in tags:
+        token = [t for t in tag.token.split(" ") if len(t) > 0]
+        for i in range(len(token)):
+            start = sentence.find(token[i])
+            end = sentence.find(token[i]) + len(token[i])
+            annotations.append(
+                SingleAnnotation(
+                    token=token[i],
+                    start_index=start,
+                    end_index=end,
+                    type=f"B-{tag.type}" if i == 0 else f"I-{tag.type}",
+                )
+            )
+            for j in range(0, end):
+                sentence = sentence.replace(sentence[j], "{", 1)
+            sent = sent[:start] + "{" * len(token[i]) + sent[end:]
+            sent1 = sent1[:start] + " " * len(token[i]) + sent1[end:]
+    sent1 = [s for s in sent1.strip().split(" ") if len(s) > 0]
+    for s in sent1:
+        annotations.append(
+            SingleAnnotation(
+                token=s,
+                start_index=sent.index(s),
+                end_index=sent.index(s) + len(s),
+                type="NO_TYPE",
+            )
+        )
+        sent = sent.replace(s, "{" * len(s), 1)
+    annotations = sorted(annotations, key=lambda x: x.start_index)
+    return annotations
+
+
+def synthetic_sentence(num_words, seed):
+    # clinical-ish words, ~1 tag per 8 words, tags are never repeated as plain words
+    rng = random.Random(seed)
+    words = ["patient", "was", "given", "mg", "of", "aspirin", "daily", "and", "discharged", "home", "with", "follow-up"]
+    phi = [("Smith", "PATIENT"), ("Dr. Bland", "DOCTOR"), ("12/03/2006", "DATE"), ("Lake Hospital", "HOSPITAL")]
+    parts, tags, position = [], [], 0
+    for i in range(num_words):
+        if rng.random() < 0.125:
+            token, phi_type = phi[rng.randrange(len(phi))]
+            token = f"{token}{i}"
+            tags.append(SingleAnnotation(token=token, start_index=position, end_index=position + len(token), type=phi_type))
+        else:
+            token = f"{rng.choice(words)}{i}"
+        parts.append(token)
+        position += len(token) + 1
+    return " ".join(parts), tags
+
+
+def read_tagged_sentences(file_path, limit):
+    # (text, spans) of annotated sentences, spans rebuilt from their BIO tokens
+    from scripts.post_processing_of_tagged_sentences import (
+        convert_machine_readable_to_human_readable_annotations,
+    )
+
+    samples = []
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line in file:
+            sentence = json.loads(line)
+            tokens = [SingleAnnotation(**a) for a in sentence["annotations"]["annotations"]]
+            samples.append(
+                (sentence["text"], convert_machine_readable_to_human_readable_annotations(sentence["text"], tokens))
+            )
+            if len(samples) >= limit:
+                break
+    return samples
+
+
+def timed(convert, samples, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for sentence, tags in samples:
+            convert(sentence, tags)
+    return (time.perf_counter() - start) / (repeat * len(samples))
+
+
+def compare(name, samples, repeat):
+    mismatches = sum(
+        legacy_convert_human_readable_to_machine_readable_annotations(sentence, tags)
+        != convert_human_readable_to_machine_readable_annotations(sentence, tags)
+        for sentence, tags in samples
+    )
+    legacy = timed(legacy_convert_human_readable_to_machine_readable_annotations, samples, repeat)
+    current = timed(convert_human_readable_to_machine_readable_annotations, samples, repeat)
+    return {
+        "sample": name,
+        "sentences": len(samples),
+        "legacy_us_per_sentence": round(legacy * 1e6, 1),
+        "offset_us_per_sentence": round(current * 1e6, 1),
+        "speedup": round(legacy / current, 1) if current else None,
+        "mismatches": mismatches,
+    }
+
+
+def main(args):
+    reports = []
+    if args.input_file:
+        reports.append(compare(args.input_file, read_tagged_sentences(args.input_file, args.num_sentences), args.repeat))
+    else:
+        for num_words in args.words:
+            samples = [synthetic_sentence(num_words, seed) for seed in range(args.num_sentences)]
+            reports.append(compare(f"{num_words} words", samples, args.repeat))
+    for report in reports:
+        print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the spans to BIO tokens conversion.")
+    parser.add_argument("-i", "--input_file", type=str, default=None, help="Annotated sentences file, synthetic sentences if not given")
+    parser.add_argument("-n", "--num_sentences", type=int, default=200, help="Number of sentences")
+    parser.add_argument("-w", "--words", type=int, nargs="+", default=[10, 50, 200, 1000], help="Words per synthetic sentence")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Timed passes over the sentences")
+    args = parser.parse_args()
+    main(args)
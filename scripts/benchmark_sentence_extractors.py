@@ -0,0 +1,116 @@
+from factory.classmaps import ClassMappings
+from typing import List, Set, Tuple
+import argparse
+import glob
+import json
+import time
+import xml.etree.ElementTree as ET
+
+
+# Throughput & boundary agreement of the sentence extractors: notes/sec of each extractor, and how many of the
+# sentence boundaries of the reference extractor (rule_based by default) each of the others finds.
+# Notes are read from a clinical notes ndjson file, or from the bundled i2b2 samples as the dataset ETLs read them.
+# Run from the root of the repository: python -m scripts.benchmark_sentence_extractors --help
+
+
+def read_clinical_notes(file_path, limit):
+    notes = []
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line in file:
+            notes.append(json.loads(line)["text"])
+            if len(notes) >= limit:
+                break
+    return notes
+
+
+def read_i2b2_samples(data_dir):
+    # note texts of the bundled i2b2 xml files, with the newline handling of the dataset_to_clinicalnotes ETLs
+    notes = []
+    for file_path in sorted(glob.glob(f"{data_dir}/*.xml")):
+        root = ET.parse(file_path).getroot()
+        for text in root.iter("TEXT"):
+            note = "".join(text.itertext())
+            if "2014" in file_path:
+                note = " ".join(note.split())
+            else:
+                note = note.replace("\n", " ")
+            notes.append(note)
+    return notes
+
+
+def boundaries(notes: List[str], all_spans: List[List[Tuple[int, int]]]) -> Set[Tuple[int, int]]:
+    # (note, offset) of every sentence start but the first of a note, whitespace skipped
+    result = set()
+    for i, (note, spans) in enumerate(zip(notes, all_spans)):
+        for start, end in spans[1:]:
+            result.add((i, start + len(note[start:end]) - len(note[start:end].lstrip())))
+    return result
+
+
+def agreement(reference: Set, other: Set) -> dict:
+    common = len(reference & other)
+    precision = common / len(other) if other else 0.0
+    recall = common / len(reference) if reference else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": round(precision, 4), "recall": round(recall, 4), "f1": round(f1, 4)}
+
+
+def create_extractor(name, args):
+    extractor_class = ClassMappings.algo_sentence_extractor_map[name]
+    if name.startswith("spacy"):
+        return extractor_class(
+            model=args.spacy_model, mode=args.spacy_mode, batch_size=args.batch_size, warm_up=True
+        )
+    return extractor_class()
+
+
+def timed(extractor, notes, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        all_spans = list(extractor.extract_spans_many(notes))
+    return all_spans, (time.perf_counter() - start) / repeat
+
+
+def main(args):
+    if args.input_file:
+        notes = read_clinical_notes(args.input_file, args.num_notes)
+    else:
+        notes = read_i2b2_samples(args.data_dir) * args.copies
+
+    results = {}
+    for name in args.extractors:
+        try:
+            extractor = create_extractor(name, args)
+        except OSError as e:
+            # spaCy model not installed
+            print(json.dumps({"extractor": name, "skipped": str(e).splitlines()[0]}))
+            continue
+        results[name] = timed(extractor, notes, args.repeat)
+
+    reference = boundaries(notes, results[args.reference][0]) if args.reference in results else None
+    for name, (all_spans, seconds) in results.items():
+        report = {
+            "extractor": name,
+            "notes": len(notes),
+            "sentences": sum(len(spans) for spans in all_spans),
+            "notes_per_sec": round(len(notes) / seconds, 1) if seconds else None,
+        }
+        if reference is not None and name != args.reference:
+            report[f"agreement_with_{args.reference}"] = agreement(reference, boundaries(notes, all_spans))
+        print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the sentence extractors.")
+    parser.add_argument("-i", "--input_file", type=str, default=None, help="Clinical notes ndjson file, the bundled i2b2 samples if not given")
+    parser.add_argument("-d", "--data_dir", type=str, default="data/I2B2Data", help="Directory of the bundled i2b2 xml samples")
+    parser.add_argument("-n", "--num_notes", type=int, default=1000, help="Number of notes read from the input file")
+    parser.add_argument("-c", "--copies", type=int, default=50, help="Copies of the bundled samples, to time more than a few notes")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Timed passes over the notes")
+    parser.add_argument("-e", "--extractors", type=str, nargs="+", default=["rule_based", "basic", "spacy", "spacy_with_basic"], help="Extractors to compare")
+    parser.add_argument("--reference", type=str, default="rule_based", help="Extractor the boundaries of the others are compared to")
+    parser.add_argument("--spacy_model", type=str, default="en_core_web_sm", help="spaCy model of the spacy extractors")
+    parser.add_argument("--spacy_mode", type=str, default="parser", help="parser | senter | sentencizer")
+    parser.add_argument("--batch_size", type=int, default=64, help="nlp.pipe batch size of the spacy extractors")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,130 @@
+from algos.sentence_tagging.cache import TaggingCache
+from algos.sentence_tagging.openai_compatible import TaggingSentenceByOpenAICompatible
+from algos.sentence_tagging.ratelimit import RateLimiter
+from common.utils.base import AsyncUtils
+from models.model import BatchUserInfo2006i2b2, UserInfo2006i2b2
+from scripts.mock_openai_server import start_server
+from utils.prompt import i2b2_2006_batch_prompt, i2b2_2006_prompt
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+
+
+# Tagging throughput benchmark, by default against the bundled mock server (no network, no api credits):
+# sentences are tagged with the 2006 i2b2 prompt through the same concurrency, rate limiting & cache paths as the ETLs.
+# Run from the root of the repository: python -m scripts.benchmark_tagging --help
+
+
+def read_sentences(file_path, limit):
+    sentences = []
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line in file:
+            sentences.append(json.loads(line)["text"])
+            if len(sentences) >= limit:
+                break
+    return sentences
+
+
+async def benchmark(args, api_base, sentences):
+    cache = TaggingCache(args.cache_dir) if args.cache_dir else None
+    tagger = TaggingSentenceByOpenAICompatible(
+        model=args.model,
+        api_base=api_base,
+        max_connections=args.max_concurrency,
+        cache=cache,
+        rate_limiter=RateLimiter(
+            rpm=args.rpm,
+            tpm=args.tpm,
+            max_retries=args.max_retries,
+            request_timeout=args.request_timeout,
+            hedge=args.hedge,
+        ),
+    )
+    latencies = []
+
+    async def tag(batch):
+        start = time.perf_counter()
+        if len(batch) == 1:
+            await tagger.atagging_sentence(batch[0], i2b2_2006_prompt, UserInfo2006i2b2)
+        else:
+            await tagger.atagging_sentences(batch, i2b2_2006_batch_prompt, BatchUserInfo2006i2b2)
+        latencies.append(time.perf_counter() - start)
+
+    batches = [sentences[i : i + args.batch_size] for i in range(0, len(sentences), args.batch_size)]
+    start = time.perf_counter()
+    async for _ in AsyncUtils.bounded_ordered_map(tag, batches, args.max_concurrency):
+        pass
+    elapsed = time.perf_counter() - start
+    await tagger.aclose()
+
+    report = {
+        "sentences": len(sentences),
+        "tagging_calls": len(batches),
+        "max_concurrency": args.max_concurrency,
+        "batch_size": args.batch_size,
+        "seconds": round(elapsed, 2),
+        "sentences_per_second": round(len(sentences) / elapsed, 2),
+        "latency_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1),
+        "latency_p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 1),
+        "latency_max_ms": round(max(latencies) * 1000, 1),
+    }
+    report.update(tagger.summary())
+    print(json.dumps(report, indent=2))
+    return report
+
+
+def main(args):
+    if args.input_file:
+        sentences = read_sentences(args.input_file, args.num_sentences)
+    else:
+        sentences = [
+            f"Patient John Smith {i} was seen on 12/{i % 28 + 1:02d}/2006 by Dr . Bland at Lake Hospital ."
+            for i in range(args.num_sentences)
+        ]
+
+    server = None
+    api_base = args.api_base
+    if api_base is None:
+        server, api_base = start_server(
+            port=0,
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            error_429=args.error_429,
+            error_500=args.error_500,
+            retry_after=args.retry_after,
+            slow_rate=args.slow_rate,
+            slow_ms=args.slow_ms,
+        )
+    try:
+        asyncio.run(benchmark(args, api_base, sentences))
+    finally:
+        if server is not None:
+            server.shutdown()
+            print(f"mock server: {json.dumps(server.RequestHandlerClass.responder.counts)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the tagging throughput.")
+    parser.add_argument("-i", "--input_file", type=str, default=None, help="Clinical sentences file, synthetic sentences if not given")
+    parser.add_argument("-n", "--num_sentences", type=int, default=1000, help="Number of sentences to tag")
+    parser.add_argument("--api_base", type=str, default=None, help="OpenAI-compatible endpoint, a mock server is started if not given")
+    parser.add_argument("--model", type=str, default="mock", help="Model name sent to the endpoint")
+    parser.add_argument("-c", "--max_concurrency", type=int, default=8, help="Requests kept in flight")
+    parser.add_argument("-b", "--batch_size", type=int, default=1, help="Sentences packed in one request")
+    parser.add_argument("--rpm", type=float, default=None, help="Requests per minute budget")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens per minute budget")
+    parser.add_argument("--max_retries", type=int, default=6, help="Retries of a failed request")
+    parser.add_argument("--request_timeout", type=float, default=None, help="Deadline of a call, in seconds")
+    parser.add_argument("--hedge", action="store_true", help="Race calls slower than the p95 latency with a duplicate")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Directory of a tagging cache, no cache if not given")
+    parser.add_argument("--latency_ms", type=float, default=200, help="Mock server: mean latency")
+    parser.add_argument("--jitter_ms", type=float, default=100, help="Mock server: latency jitter")
+    parser.add_argument("--error_429", type=float, default=0.0, help="Mock server: share of 429 answers")
+    parser.add_argument("--error_500", type=float, default=0.0, help="Mock server: share of 500 answers")
+    parser.add_argument("--retry_after", type=float, default=1.0, help="Mock server: Retry-After of a 429")
+    parser.add_argument("--slow_rate", type=float, default=0.0, help="Mock server: share of slow answers")
+    parser.add_argument("--slow_ms", type=float, default=5000, help="Mock server: extra latency of a slow answer")
+    args = parser.parse_args()
+    main(args)
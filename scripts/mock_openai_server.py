@@ -0,0 +1,118 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from algos.sentence_tagging.mock import MockResponder
+import argparse
+import json
+import threading
+import time
+
+
+# Local stand-in for an OpenAI-compatible chat completions endpoint, for load tests & benchmarks without network.
+# The answers come from algos.sentence_tagging.mock.MockResponder: tool call arguments that validate against the
+# tool's json schema (UserInfo*), built from the capitalized words & numbers of the sentence.
+# Latency (with an optional slow tail) & the share of 429 / 500 answers are configurable.
+# Run from the root of the repository: python -m scripts.mock_openai_server --help
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # keep-alive, so pooled clients reuse their connections
+    protocol_version = "HTTP/1.1"
+    # headers & body are separate writes, without this the client waits on a delayed ack
+    disable_nagle_algorithm = True
+    responder: MockResponder = None
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        elif self.path.rstrip("/").endswith("/stats"):
+            self.send_json(200, self.responder.counts)
+        else:
+            self.send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        responder = self.responder
+        responder.count("requests")
+        responder.delay()
+        status = responder.pick_error()
+        if status == 429:
+            responder.count("429")
+            self.send_json(
+                429,
+                {"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}},
+                headers={"retry-after": str(responder.retry_after)},
+            )
+        elif status == 500:
+            responder.count("500")
+            self.send_json(500, {"error": {"message": "The server had an error (mock)", "type": "server_error"}})
+        else:
+            responder.count("ok")
+            self.send_json(200, responder.completion(body))
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up on this request (deadline, losing hedge)
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        # one line per request would drown the load test output
+        pass
+
+
+def start_server(host="127.0.0.1", port=8000, **responder_args):
+    # serves in a background thread, returns the server (server.shutdown() to stop) & its api base url
+    handler = type("Handler", (MockHandler,), {"responder": MockResponder(**responder_args)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main(args):
+    server, api_base = start_server(
+        host=args.host,
+        port=args.port,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_429=args.error_429,
+        error_500=args.error_500,
+        retry_after=args.retry_after,
+        slow_rate=args.slow_rate,
+        slow_ms=args.slow_ms,
+        seed=args.seed,
+    )
+    print(f"Mock OpenAI-compatible server on {api_base} (use it as api-base)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(json.dumps(server.RequestHandlerClass.responder.counts))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible stand-in server.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to bind")
+    parser.add_argument("-p", "--port", type=int, default=8000, help="Port to bind, 0 for any free port")
+    parser.add_argument("--latency_ms", type=float, default=200, help="Mean latency of an answer")
+    parser.add_argument("--jitter_ms", type=float, default=100, help="Latency varies uniformly by +/- this much")
+    parser.add_argument("--error_429", type=float, default=0.0, help="Share of requests answered 429")
+    parser.add_argument("--error_500", type=float, default=0.0, help="Share of requests answered 500")
+    parser.add_argument("--retry_after", type=float, default=1.0, help="Retry-After (seconds) sent with a 429")
+    parser.add_argument("--slow_rate", type=float, default=0.0, help="Share of answers delayed by slow_ms")
+    parser.add_argument("--slow_ms", type=float, default=5000, help="Extra latency of a slow answer")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the latency & error draws")
+    args = parser.parse_args()
+    main(args)
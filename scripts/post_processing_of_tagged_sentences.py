@@ -1,45 +1,66 @@
-from models.model import SingleAnnotation, UserInfo2006i2b2, UserInfo2014i2b2
-from typing import List
+from common.utils.ahocorasick import AhoCorasick
+from models.model import PHIInfo, SingleAnnotation, UserInfo2006i2b2, UserInfo2014i2b2
+from functools import lru_cache
+from typing import List, Tuple
 import json
 from loguru import logger
 
 
+def _space_separated_tokens(text: str, offset: int, end: int):
+    # (start, end) of the space separated tokens of text[offset:end]
+    tokens = []
+    start = offset
+    while start < end:
+        if text[start] == " ":
+            start += 1
+            continue
+        stop = text.find(" ", start, end)
+        if stop == -1:
+            stop = end
+        tokens.append((start, stop))
+        start = stop
+    return tokens
+
+
 def convert_human_readable_to_machine_readable_annotations(
     sentence: str, tags: List[SingleAnnotation]
 ) -> List[SingleAnnotation]:
+    # Single pass over the sentence, tags are located by their offsets:
+    # - a tag's start_index is trusted when the token is found there, else the token is searched
+    #   after the previous tag (tags of a note carry note offsets); a tag not found is skipped
+    # - tag tokens are B-/I- tagged per space separated token, the text between tags is NO_TYPE
     tags = sorted(tags, key=lambda x: x.start_index)
     annotations = []
-    sent = sentence
-    sent1 = sentence
+    # whitespace around the sentence is not a token
+    first, last = len(sentence) - len(sentence.lstrip()), len(sentence.rstrip())
+    cursor = first
     for tag in tags:
-        token = [t for t in tag.token.split(" ") if len(t) > 0]
-        for i in range(len(token)):
-            start = sentence.find(token[i])
-            end = sentence.find(token[i]) + len(token[i])
+        if not tag.token.strip():
+            continue
+        start = tag.start_index
+        if start < cursor or sentence[start : start + len(tag.token)] != tag.token:
+            start = sentence.find(tag.token, cursor)
+            if start == -1:
+                continue
+        end = start + len(tag.token)
+        for s, e in _space_separated_tokens(sentence, cursor, start):
+            annotations.append(
+                SingleAnnotation(token=sentence[s:e], start_index=s, end_index=e, type="NO_TYPE")
+            )
+        for i, (s, e) in enumerate(_space_separated_tokens(sentence, start, end)):
             annotations.append(
                 SingleAnnotation(
-                    token=token[i],
-                    start_index=start,
-                    end_index=end,
+                    token=sentence[s:e],
+                    start_index=s,
+                    end_index=e,
                     type=f"B-{tag.type}" if i == 0 else f"I-{tag.type}",
                 )
             )
-            for j in range(0, end):
-                sentence = sentence.replace(sentence[j], "{", 1)
-            sent = sent[:start] + "{" * len(token[i]) + sent[end:]
-            sent1 = sent1[:start] + " " * len(token[i]) + sent1[end:]
-    sent1 = [s for s in sent1.strip().split(" ") if len(s) > 0]
-    for s in sent1:
+        cursor = end
+    for s, e in _space_separated_tokens(sentence, cursor, last):
         annotations.append(
-            SingleAnnotation(
-                token=s,
-                start_index=sent.index(s),
-                end_index=sent.index(s) + len(s),
-                type="NO_TYPE",
-            )
+            SingleAnnotation(token=sentence[s:e], start_index=s, end_index=e, type="NO_TYPE")
         )
-        sent = sent.replace(s, "{" * len(s), 1)
-    annotations = sorted(annotations, key=lambda x: x.start_index)
     return annotations
 
 
@@ -101,232 +122,37 @@ def write_doccano_tagged_sentences(
     return
 
 
+@lru_cache(maxsize=1024)
+def _phi_automaton(patterns: Tuple[str, ...]) -> AhoCorasick:
+    # responses repeat (deduplicated sentences, the same few names across a note), build each automaton once
+    return AhoCorasick(patterns)
+
+
+def get_human_readable_annotations(
+    sentence: str, response_obj: PHIInfo
+) -> List[SingleAnnotation]:
+    # Every occurrence of the response's PHI strings, found in one pass over the sentence.
+    # Overlapping occurrences are resolved by the response schema's priority (PHI_TYPES order, then list order).
+    strings = list(response_obj.phi_strings(sentence))
+    automaton = _phi_automaton(tuple(string for string, _ in strings))
+    return [
+        SingleAnnotation(
+            token=sentence[start:end],
+            start_index=start,
+            end_index=end,
+            type=strings[index][1],
+        )
+        for start, end, index in automaton.non_overlapping(sentence)
+    ]
+
+
 def get_human_readable_annotations_2006i2b2(
     sentence: str, response_obj: UserInfo2006i2b2
 ) -> List[SingleAnnotation]:
-    annotations = []
-    for i in range(len(response_obj.patients)):
-        while response_obj.patients[i] in sentence:
-            annotations.append(
-                SingleAnnotation(
-                    token=response_obj.patients[i],
-                    start_index=sentence.index(response_obj.patients[i]),
-                    end_index=sentence.index(response_obj.patients[i])
-                    + len(response_obj.patients[i]),
-                    type="PATIENT",
-                )
-            )
-            sentence = sentence.replace(
-                response_obj.patients[i], "{" * len(response_obj.patients[i]), 1
-            )
-    for i in range(len(response_obj.doctors)):
-        while response_obj.doctors[i] in sentence:
-            annotations.append(
-                SingleAnnotation(
-                    token=response_obj.doctors[i],
-                    start_index=sentence.index(response_obj.doctors[i]),
-                    end_index=sentence.index(response_obj.doctors[i])
-                    + len(response_obj.doctors[i]),
-                    type="DOCTOR",
-                )
-            )
-            sentence = sentence.replace(
-                response_obj.doctors[i], "{" * len(response_obj.doctors[i]), 1
-            )
-    for i in range(len(response_obj.hospitals)):
-        while response_obj.hospitals[i] in sentence:
-            annotations.append(
-                SingleAnnotation(
-                    token=response_obj.hospitals[i],
-                    start_index=sentence.index(response_obj.hospitals[i]),
-                    end_index=sentence.index(response_obj.hospitals[i])
-                    + len(response_obj.hospitals[i]),
-                    type="HOSPITAL",
-                )
-            )
-            sentence = sentence.replace(
-                response_obj.hospitals[i], "{" * len(response_obj.hospitals[i]), 1
-            )
-    for i in range(len(response_obj.ids)):
-        while response_obj.ids[i] in sentence:
-            annotations.append(
-                SingleAnnotation(
-                    token=response_obj.ids[i],
-                    start_index=sentence.index(response_obj.ids[i]),
-                    end_index=sentence.index(response_obj.ids[i])
-                    + len(response_obj.ids[i]),
-                    type="ID",
-                )
-            )
-            sentence = sentence.replace(
-                response_obj.ids[i], "{" * len(response_obj.ids[i]), 1
-            )
-    for i in range(len(response_obj.dates)):
-        while response_obj.dates[i] in sentence:
-            annotations.append(
-                SingleAnnotation(
-                    token=response_obj.dates[i],
-                    start_index=sentence.index(response_obj.dates[i]),
-                    end_index=sentence.index(response_obj.dates[i])
-                    + len(response_obj.dates[i]),
-                    type="DATE",
-                )
-            )
-            sentence = sentence.replace(
-                response_obj.dates[i], "{" * len(response_obj.dates[i]), 1
-            )
-    for i in range(len(response_obj.locations)):
-        while response_obj.locations[i] in sentence:
-            annotations.append(
-                SingleAnnotation(
-                    token=response_obj.locations[i],
-                    start_index=sentence.index(response_obj.locations[i]),
-                    end_index=sentence.index(response_obj.locations[i])
-                    + len(response_obj.locations[i]),
-                    type="LOCATION",
-                )
-            )
-            sentence = sentence.replace(
-                response_obj.locations[i], "{" * len(response_obj.locations[i]), 1
-            )
-    for i in range(len(response_obj.phone_numbers)):
-        while response_obj.phone_numbers[i] in sentence:
-            annotations.append(
-                SingleAnnotation(
-                    token=response_obj.phone_numbers[i],
-                    start_index=sentence.index(response_obj.phone_numbers[i]),
-                    end_index=sentence.index(response_obj.phone_numbers[i])
-                    + len(response_obj.phone_numbers[i]),
-                    type="PHONE",
-                )
-            )
-            sentence = sentence.replace(
-                response_obj.phone_numbers[i],
-                "{" * len(response_obj.phone_numbers[i]),
-                1,
-            )
-    for i in range(len(response_obj.ages)):
-        while response_obj.ages[i] in sentence:
-            age = "".join([a for a in response_obj.ages[i] if a.isnumeric()])
-            if age and int(age) > 90:
-                annotations.append(
-                    SingleAnnotation(
-                        token=age,
-                        start_index=sentence.index(age),
-                        end_index=sentence.index(age) + len(age),
-                        type="AGE",
-                    )
-                )
-                sentence = sentence.replace(age, "{" * len(age), 1)
-            else:
-                break
-    annotations = sorted(annotations, key=lambda x: x.start_index)
-    return annotations
+    return get_human_readable_annotations(sentence, response_obj)
 
 
 def get_human_readable_annotations_2014i2b2(
     sentence: str, response_obj: UserInfo2014i2b2
 ) -> List[SingleAnnotation]:
-    annotations = []
-    for i in range(len(response_obj.names)):
-        while response_obj.names[i] in sentence:
-            annotations.append(
-                SingleAnnotation(
-                    token=response_obj.names[i],
-                    start_index=sentence.index(response_obj.names[i]),
-                    end_index=sentence.index(response_obj.names[i])
-                    + len(response_obj.names[i]),
-                    type="NAME",
-                )
-            )
-            sentence = sentence.replace(
-                response_obj.names[i], "{" * len(response_obj.names[i]), 1
-            )
-    for i in range(len(response_obj.locations)):
-        while response_obj.locations[i] in sentence:
-            annotations.append(
-                SingleAnnotation(
-                    token=response_obj.locations[i],
-                    start_index=sentence.index(response_obj.locations[i]),
-                    end_index=sentence.index(response_obj.locations[i])
-                    + len(response_obj.locations[i]),
-                    type="LOCATION",
-                )
-            )
-            sentence = sentence.replace(
-                response_obj.locations[i], "{" * len(response_obj.locations[i]), 1
-            )
-    for i in range(len(response_obj.ages)):
-        while response_obj.ages[i] in sentence:
-            annotations.append(
-                SingleAnnotation(
-                    token=response_obj.ages[i],
-                    start_index=sentence.index(response_obj.ages[i]),
-                    end_index=sentence.index(response_obj.ages[i])
-                    + len(response_obj.ages[i]),
-                    type="AGE",
-                )
-            )
-            sentence = sentence.replace(
-                response_obj.ages[i], "{" * len(response_obj.ages[i]), 1
-            )
-    for i in range(len(response_obj.ids)):
-        while response_obj.ids[i] in sentence:
-            annotations.append(
-                SingleAnnotation(
-                    token=response_obj.ids[i],
-                    start_index=sentence.index(response_obj.ids[i]),
-                    end_index=sentence.index(response_obj.ids[i])
-                    + len(response_obj.ids[i]),
-                    type="ID",
-                )
-            )
-            sentence = sentence.replace(
-                response_obj.ids[i], "{" * len(response_obj.ids[i]), 1
-            )
-    for i in range(len(response_obj.dates)):
-        while response_obj.dates[i] in sentence:
-            annotations.append(
-                SingleAnnotation(
-                    token=response_obj.dates[i],
-                    start_index=sentence.index(response_obj.dates[i]),
-                    end_index=sentence.index(response_obj.dates[i])
-                    + len(response_obj.dates[i]),
-                    type="DATE",
-                )
-            )
-            sentence = sentence.replace(
-                response_obj.dates[i], "{" * len(response_obj.dates[i]), 1
-            )
-    for i in range(len(response_obj.contacts)):
-        while response_obj.contacts[i] in sentence:
-            annotations.append(
-                SingleAnnotation(
-                    token=response_obj.contacts[i],
-                    start_index=sentence.index(response_obj.contacts[i]),
-                    end_index=sentence.index(response_obj.contacts[i])
-                    + len(response_obj.contacts[i]),
-                    type="CONTACT",
-                )
-            )
-            sentence = sentence.replace(
-                response_obj.contacts[i], "{" * len(response_obj.contacts[i]), 1
-            )
-    for i in range(len(response_obj.professions)):
-        while response_obj.professions[i] in sentence:
-            annotations.append(
-                SingleAnnotation(
-                    token=response_obj.professions[i],
-                    start_index=sentence.index(response_obj.professions[i]),
-                    end_index=sentence.index(response_obj.professions[i])
-                    + len(response_obj.professions[i]),
-                    type="PROFESSION",
-                )
-            )
-            sentence = sentence.replace(
-                response_obj.professions[i],
-                "{" * len(response_obj.professions[i]),
-                1,
-            )
-    annotations = sorted(annotations, key=lambda x: x.start_index)
-    return annotations
\ No newline at end of file
+    return get_human_readable_annotations(sentence, response_obj)
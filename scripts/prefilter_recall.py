@@ -0,0 +1,67 @@
+from algos.sentence_tagging.prefilter import PHIPrefilter
+import argparse
+import json
+import time
+import tqdm
+
+
+# Measures the PHI prefilter on annotated clinical sentences (2006 / 2014 i2b2):
+# - recall: share of the sentences holding ground truth PHI that are still sent to the model
+# - skip rate: share of all the sentences answered without the model
+# - throughput of the rule stage, in sentences per minute
+# Run from the root of the repository: python -m scripts.prefilter_recall --help
+
+
+def prefilter_recall(file_path):
+    sentences = []
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line in tqdm.tqdm(file):
+            sentences.append(json.loads(line))
+
+    prefilter = PHIPrefilter()
+    start = time.perf_counter()
+    decisions = [prefilter.needs_model(sentence["text"]) for sentence in sentences]
+    elapsed = time.perf_counter() - start
+
+    phi_sentences = 0
+    kept_phi_sentences = 0
+    missed_types = {}
+    missed_examples = []
+    for sentence, needs_model in zip(sentences, decisions):
+        phi_types = {
+            annotation["type"][2:]
+            for annotation in sentence["annotations"]["annotations"]
+            if annotation["type"] != "NO_TYPE"
+        }
+        if not phi_types:
+            continue
+        phi_sentences += 1
+        if needs_model:
+            kept_phi_sentences += 1
+            continue
+        for phi_type in phi_types:
+            missed_types[phi_type] = missed_types.get(phi_type, 0) + 1
+        missed_examples.append(sentence["text"])
+
+    report = prefilter.stats()
+    report["phi_sentences"] = phi_sentences
+    report["recall"] = round(kept_phi_sentences / phi_sentences, 4) if phi_sentences else 1.0
+    report["missed_phi_types"] = missed_types
+    report["sentences_per_minute"] = int(len(sentences) / elapsed * 60) if elapsed else 0
+    print(json.dumps(report, indent=2))
+    for text in missed_examples[:20]:
+        print(f"missed: {text}")
+    return report
+
+
+def main(args):
+    prefilter_recall(args.input_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the recall & skip rate of the PHI prefilter.")
+    parser.add_argument(
+        "-i", "--input_file", type=str, help="Path to the annotated clinical sentences file"
+    )
+    args = parser.parse_args()
+    main(args)
@@ -5,4 +5,6 @@ class DataConstants:
     TAGGED_SENTENCES_MACHINE_DIR = "{root_dir}/taggedsentences(machine_readable)"
     TAGGED_SENTENCES_HUMAN_DIR = "{root_dir}/taggedsentences(human_readable)"
     TAGGED_SENTENCES_DOCCANO_DIR = "{root_dir}/taggedsentences(doccano_readable)"
-    METRICS_DIR = "{root_dir}/metrics"
\ No newline at end of file
+    METRICS_DIR = "{root_dir}/metrics"
+    TAGGING_CACHE_DIR = "{root_dir}/cache"
+    BATCH_JOBS_DIR = "{root_dir}/batchjobs"
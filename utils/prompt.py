@@ -38,4 +38,32 @@ i2b2_2014_prompt="""
             types of ids should be: SOCIAL SECURITY NUMBER, MEDICAL RECORD NUMBER, HEALTH PLAN NUMBER, ACCOUNT NUMBER, LICENSE NUMBER, VEHICLE ID, DEVICE ID, BIOMETRIC ID, ID NUMBER
         ---
         clinical note : "{sentence}"
-"""
\ No newline at end of file
+"""
+
+i2b2_2006_batch_prompt="""
+    Please extract the following things into a structured data from each of the given numbered sentences if present:
+    
+    Patients: includes the first and last names of patients, their health proxies, and family members. It excludes titles, such as Mrs., e.g., Mrs. [Mary Joe] was admitted, Mrs. [Petter Deo] has blurred vision...
+
+    Doctors: refers to medical doctors and other practitioners mentioned in the records. For transcribed records, it includes the transcribers' names and initials. It excludes titles, such as Dr. and M.D., e.g., He met with Dr. [John Bland] , M.D.
+
+    Hospitals: marks the names of medical organizations and of nursing homes where patients are treated and may also reside. It includes room numbers of patients, and buildings and floors related to doctors' affiliations, e.g., The patient was transferred to [Gates 4].
+
+    IDs: refers to any combination of numbers, letters, and special characters identifying medical records, patients, doctors, or hospitals, e.g., Provider Number : [12344].
+
+    Dates: includes all elements of a date except for the year. HIPAA specifies that years are not considered PHI. Therefore, we exclude them from this category. Extract only and only dates and months, do not extract year, day, any time, or othr entities related to Dates.
+
+    Locations: includes geographic locations such as cities, states, countries, street names, zip codes, building names, and numbers, e.g., He lives in [Newton].
+
+    Phone numbers: includes telephone, pager, and fax numbers.
+
+    Ages: includes ages above 90. HIPAA dictates that ages above 90 should be collected under one category, and should be marked as PHI. Ages below 90 can be left as is.
+    
+    Take a time and Keep in mind the following rules for extraction of entities for each feilds: 
+        - Each sentence is prefixed with its index in square brackets, e.g; [3]. Return exactly one entry for every sentence, with the same index, even if nothing is present in it.
+        - Extract the entities of a sentence only from that sentence, never from its neighbours.
+        - If any of the above infomation is not present then simply just return empty list for those feilds. 
+        - Make sure to extract all the information regarding all the above feilds should be in as it is form as present in the sentence, e.g; entity "X , Y" should be extracted as it is, not as  "X, Y", "X ,Y", "X", "Y" or any other forms. Here there might be different punctuation present insted of  ","  but the rule is same for each punctuation ,arks.
+    sentences :
+{sentences}
+"""